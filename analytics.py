@@ -0,0 +1,174 @@
+# Рыночная аналитика по объявлениям: помесячные свертки по городу, комнатам и типу
+# (таблица listing_rollups). Средние считаются по точным суммам, квантили — по скетчу
+# с логарифмическими корзинами, как в DDSketch: скетчи разных месяцев и групп складываются,
+# а при удалении объявления его значение вычитается
+import math
+import os
+from datetime import date, UTC
+
+import numpy as np
+
+# Относительная ошибка квантилей: оценка отличается от истинного значения не больше чем на 1%
+ANALYTICS_SKETCH_ACCURACY = float(os.getenv("ANALYTICS_SKETCH_ACCURACY", 0.01))
+SKETCH_GAMMA = (1 + ANALYTICS_SKETCH_ACCURACY) / (1 - ANALYTICS_SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+ROLLUP_KEY = ("city", "rooms", "type", "month")
+# Метрики со средним; для SKETCH_METRICS еще и квантили
+METRICS = ("price", "price_per_m2", "deposit", "commission_percent")
+SKETCH_METRICS = ("price", "price_per_m2", "deposit")
+ROLLUP_COLUMNS = ("count", *(f"{metric}_{part}" for metric in METRICS for part in ("count", "sum")))
+SKETCH_COLUMNS = tuple(f"{metric}_sketch" for metric in SKETCH_METRICS)
+# Поля объявления, из которых строятся свертки
+ROLLUP_FIELDS = ("address_city", "rooms", "type", "created_at", "price", "total_area", "deposit", "commission_percent")
+
+
+class Sketch:
+    # Счетчики корзин (gamma^(k-1), gamma^k] подряд начиная с offset, плюс отдельный счетчик нулей
+    # (залог 0 — у нуля нет логарифма). В базе — int32: [zero, offset, counts...]
+    __slots__ = ("zero", "offset", "counts")
+
+    def __init__(self, zero: int = 0, offset: int = 0, counts=None):
+        self.zero = zero
+        self.offset = offset
+        self.counts = np.zeros(0, np.int64) if counts is None else counts
+
+    @classmethod
+    def from_buckets(cls, buckets: dict):
+        zero = buckets.get(None, 0)
+        buckets = {bucket: count for bucket, count in buckets.items() if bucket is not None}
+        if not buckets:
+            return cls(zero)
+        offset = min(buckets)
+        counts = np.zeros(max(buckets) - offset + 1, np.int64)
+        counts[np.fromiter(buckets, np.int64) - offset] = list(buckets.values())
+        return cls(zero, offset, counts)
+
+    @classmethod
+    def decode(cls, data: bytes | None):
+        if not data:
+            return cls()
+        array = np.frombuffer(data, "<i4")
+        return cls(int(array[0]), int(array[1]), array[2:])
+
+    @classmethod
+    def merge(cls, sketches):
+        # Сумма скетчей одним проходом: общий диапазон корзин, затем сложение срезов
+        sketches = [sketch for sketch in sketches if sketch.zero or len(sketch.counts)]
+        ranged = [sketch for sketch in sketches if len(sketch.counts)]
+        zero = sum(sketch.zero for sketch in sketches)
+        if not ranged:
+            return cls(zero)
+        offset = min(sketch.offset for sketch in ranged)
+        counts = np.zeros(max(sketch.offset + len(sketch.counts) for sketch in ranged) - offset, np.int64)
+        for sketch in ranged:
+            start = sketch.offset - offset
+            counts[start:start + len(sketch.counts)] += sketch.counts
+        return cls(zero, offset, counts)
+
+    def encode(self):
+        # Пустые корзины по краям отбрасываются — одинаковые скетчи дают одинаковые байты
+        nonzero = np.flatnonzero(self.counts)
+        if len(nonzero):
+            counts, offset = self.counts[nonzero[0]:nonzero[-1] + 1], self.offset + int(nonzero[0])
+        else:
+            counts, offset = self.counts[:0], 0
+        if not self.zero and not len(counts):
+            return None
+        return np.concatenate([[self.zero, offset], counts]).astype("<i4").tobytes()
+
+    @property
+    def total(self):
+        return self.zero + int(self.counts.sum())
+
+    def quantile(self, q: float):
+        total = self.total
+        if total <= 0:
+            return None
+        rank = q * (total - 1)
+        if rank < self.zero:
+            return 0.0
+        bucket = self.offset + int(np.searchsorted(np.cumsum(self.counts), rank - self.zero, side="right"))
+        # Середина корзины: относительная ошибка не больше ANALYTICS_SKETCH_ACCURACY
+        return 2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1)
+
+
+def month_start(created_at):
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(UTC)
+    return date(created_at.year, created_at.month, 1)
+
+
+def rollup_key(values):
+    # Пустые город, комнаты и тип — отдельная группа: в первичном ключе нет NULL
+    return (values["address_city"] or "", values["rooms"] or 0, values["type"] or "",
+            month_start(values["created_at"]))
+
+
+def metric_values(values):
+    price, total_area = values["price"], values["total_area"]
+    return {
+        "price": price,
+        "price_per_m2": price / total_area if price is not None and total_area else None,
+        "deposit": values["deposit"],
+        "commission_percent": values["commission_percent"],
+    }
+
+
+def sketch_bucket(value: float):
+    # None — корзина нулей
+    if value <= 0:
+        return None
+    return math.ceil(math.log(value) / SKETCH_LOG_GAMMA)
+
+
+def aggregate_listings(rows, sign: int = 1, rollups: dict | None = None):
+    # Вклад объявлений (словари с ROLLUP_FIELDS) в свертки: sign=1 — создание, -1 — удаление.
+    # Возвращает {ключ: {столбец ROLLUP_COLUMNS: значение, метрика SKETCH_METRICS: {корзина: количество}}};
+    # rollups — продолжить накопление в уже собранный словарь
+    rollups = {} if rollups is None else rollups
+    for values in rows:
+        key = rollup_key(values)
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = {**dict.fromkeys(ROLLUP_COLUMNS, 0), **{metric: {} for metric in SKETCH_METRICS}}
+        rollup["count"] += sign
+        for metric, value in metric_values(values).items():
+            if value is None:
+                continue
+            rollup[f"{metric}_count"] += sign
+            rollup[f"{metric}_sum"] += sign * value
+            if metric in SKETCH_METRICS:
+                buckets = rollup[metric]
+                bucket = sketch_bucket(value)
+                buckets[bucket] = buckets.get(bucket, 0) + sign
+    return rollups
+
+
+def quantile_name(q: float):
+    return f"p{q * 100:g}"
+
+
+def summarize_rollups(group_by: list[str], rows, quantiles: list[float]):
+    # Строки listing_rollups (ROLLUP_KEY, ROLLUP_COLUMNS, SKETCH_COLUMNS) -> группы ответа /analytics/listings
+    positions = [ROLLUP_KEY.index(column) for column in group_by]
+    width = len(ROLLUP_KEY)
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(tuple(row[position] for position in positions), []).append(row)
+
+    groups = []
+    for group, group_rows in sorted(grouped.items()):
+        sums = dict(zip(ROLLUP_COLUMNS, (sum(column) for column in zip(*(row[width:width + len(ROLLUP_COLUMNS)]
+                                                                          for row in group_rows)))))
+        if sums["count"] <= 0:
+            continue
+        item = {**dict(zip(group_by, group)), "count": sums["count"]}
+        for metric in METRICS:
+            count = sums[f"{metric}_count"]
+            item[metric] = {"count": count, "avg": sums[f"{metric}_sum"] / count if count else None}
+        for index, metric in enumerate(SKETCH_METRICS, width + len(ROLLUP_COLUMNS)):
+            sketch = Sketch.merge(Sketch.decode(row[index]) for row in group_rows)
+            item[metric]["quantiles"] = {quantile_name(q): sketch.quantile(q) for q in quantiles}
+        groups.append(item)
+    return groups
@@ -1,10 +1,91 @@
 # auth.py
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Стоимость bcrypt: хэши с меньшим числом раундов пересчитываются при следующем входе
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))
+# Хэширование идет в отдельных процессах, чтобы не занимать event loop и потоки воркера.
+# Если в очереди уже PASSWORD_HASH_QUEUE_SIZE задач, новые сразу отклоняются
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", PASSWORD_HASH_WORKERS * 4))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_HASH_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
 
-def hash_password(password: str):
+def _hash_password(password: str):
     return pwd_context.hash(password)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+
+def _verify_password(plain_password: str, hashed_password: str):
+    # (совпал ли пароль, новый хэш или None, если старый еще годится)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        # spawn, а не fork: воркер приложения к этому моменту уже держит потоки и соединения
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _discard_executor(self, executor):
+        # Один упавший дочерний процесс ломает весь пул: дальше задачи получает новый пул
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, func, *args):
+        if self.pending >= self.queue_size:
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            # Задача, попавшая на сломанный пул, повторяется один раз на новом; не вышло — 503
+            for _ in range(2):
+                executor = self._get_executor()
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+                except BrokenProcessPool:
+                    self._discard_executor(executor)
+            raise PasswordHasherBusy()
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        return await self._run(_hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str):
+        return await self._run(_verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
+
+
+async def hash_password(password: str):
+    return await password_hasher.hash(password)
+
+
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
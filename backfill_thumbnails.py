@@ -0,0 +1,51 @@
+# Обработка фото, загруженных до появления копий: поворот по EXIF, очистка метаданных,
+# thumb/medium в JPEG и WebP. Новые загрузки обрабатывает очередь image_jobs.
+# Запуск: python backfill_thumbnails.py [--batch-size 200]
+import argparse
+
+from db import SessionLocal
+from images import apply_renditions
+from models import ListingPhoto, User
+
+
+def backfill(db, model, batch_size: int):
+    processed = created = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.query(model)
+            .filter(model.id > last_id, model.image_path.isnot(None), model.thumbnail_webp_path.is_(None))
+            .order_by(model.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        for obj in batch:
+            apply_renditions(obj, obj.image_path)
+            processed += 1
+            if obj.thumbnail_webp_path:
+                created += 1
+        db.commit()
+        last_id = batch[-1].id
+
+    return processed, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill photo thumbnails")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for model in (ListingPhoto, User):
+            processed, created = backfill(db, model, args.batch_size)
+            print(f"{model.__tablename__}: processed={processed} created={created}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
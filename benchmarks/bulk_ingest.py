@@ -0,0 +1,67 @@
+# Пропускная способность импорта: POST /listings/bulk (NDJSON) против POST /listings/ по одному.
+# Запуск из корня проекта: python -m benchmarks.bulk_ingest --rows 100000
+# База берется из DATABASE_URL
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks.datagen import listing_rows
+from db import async_engine
+from main import app
+
+PAYLOAD_FIELDS = ("id", "created_at")
+
+
+def payload_rows(count: int, seed: int):
+    for row in listing_rows(count, seed=seed):
+        for field in PAYLOAD_FIELDS:
+            row.pop(field)
+        yield row
+
+
+async def ndjson_body(count: int, seed: int, chunk_rows: int = 500):
+    lines = []
+    for row in payload_rows(count, seed):
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) == chunk_rows:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def run(rows: int, single_rows: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        response = await client.post(
+            "/listings/bulk",
+            content=ndjson_body(rows, seed=1),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        elapsed = time.perf_counter() - started
+        result = response.json()
+        print(f"  bulk: {result['inserted']} rows in {elapsed:6.2f} s -> {result['inserted'] / elapsed:10.0f} rows/s "
+              f"(failed {result['failed']})")
+
+        started = time.perf_counter()
+        for row in payload_rows(single_rows, seed=2):
+            await client.post("/listings/", json=row)
+        elapsed = time.perf_counter() - started
+        print(f"single: {single_rows} rows in {elapsed:6.2f} s -> {single_rows / elapsed:10.0f} rows/s")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--single-rows", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.single_rows))
+
+
+if __name__ == "__main__":
+    main()
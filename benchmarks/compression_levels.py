@@ -0,0 +1,98 @@
+# Сжатие ответов: размер и время сжатия/распаковки по кодировкам и уровням на типичных
+# телах — лента с миниатюрами в base64 и id лайкнувших, лента без картинок, карточка объявления.
+# brotli и zstd меряются, только если установлены пакеты brotli и zstandard.
+# Запуск из корня проекта: python -m benchmarks.compression_levels --repeat 5
+import argparse
+import base64
+import gzip
+import random
+import tempfile
+import time
+
+from benchmarks.datagen import listing_rows, make_photo_files
+from compression import COMPRESSION_CPU_BUDGET, GzipCoding, BrotliCoding, ZstdCoding, brotli, zstandard
+from schemas import ListingPage, ListingPreview, ListingRead
+
+LEVELS = {
+    "gzip": (GzipCoding, (1, 3, 5, 6, 7, 9), gzip.decompress),
+    "br": (BrotliCoding, (0, 1, 3, 4, 5, 6, 9, 11), brotli and brotli.decompress),
+    "zstd": (ZstdCoding, (1, 3, 6, 9, 12, 19),
+             zstandard and (lambda body: zstandard.ZstdDecompressor().decompress(body))),
+}
+
+
+def encoded(path: str):
+    with open(path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+def make_payloads(photos: list[dict], seed: int):
+    rng = random.Random(seed)
+    rows = list(listing_rows(100, seed=seed, user_ids=list(range(1, 10001))))
+    thumbnails = [encoded(photo["thumbnail_path"]) for photo in photos]
+    likers = [sorted(rng.sample(range(1, 10001), int(rng.paretovariate(1.2) * 5))) for _ in rows]
+
+    feed = ListingPage(items=[
+        ListingPreview(id=row["id"], title=row["title"], price=row["price"], owner_name=f"user{row['user_id']}",
+                       image_base64=thumbnails[i % len(thumbnails)],
+                       image_url=f"/listing-photos/{row['id']}?size=thumb",
+                       like_count=len(likers[i]), liked_by_users=likers[i])
+        for i, row in enumerate(rows[:20])
+    ], next_cursor="MjAyNC0wMS0wMVQwMDoyMDowMCswMDowMHwyMA")
+    feed_no_images = ListingPage(items=[
+        ListingPreview(id=row["id"], title=row["title"], price=row["price"], owner_name=f"user{row['user_id']}",
+                       image_base64=None, like_count=len(likers[i]))
+        for i, row in enumerate(rows)
+    ])
+    row = rows[0]
+    detail = ListingRead(**{**row, "image_paths": []}, owner_name=f"user{row['user_id']}",
+                         owner_email=f"user{row['user_id']}@example.com", owner_phone="+79990000000",
+                         image_base64=encoded(photos[0]["medium_path"]), image_url="/listing-photos/1?size=medium",
+                         like_count=len(likers[0]), liked_user_ids=likers[0])
+    return {
+        "feed (20, thumbnails)": feed.model_dump_json().encode(),
+        "feed (100, no images)": feed_no_images.model_dump_json().encode(),
+        "listing detail": detail.model_dump_json().encode(),
+    }
+
+
+def best_time(repeat: int, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--photos", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        payloads = make_payloads(make_photo_files(directory, args.photos), args.seed)
+
+    for name, body in payloads.items():
+        print(f"{name}: {len(body) / 1024:.1f} KiB")
+        for coding_name, (coding_class, levels, decompress) in LEVELS.items():
+            if decompress is None:
+                print(f"  {coding_name:>4}: not installed")
+                continue
+            for level in levels:
+                compressed, compress_seconds = best_time(args.repeat, coding_class(level).compress, body)
+                restored, decompress_seconds = best_time(args.repeat, decompress, compressed)
+                assert restored == body
+                # Сколько таких ответов в секунду сожмет воркер в пределах COMPRESSION_CPU_BUDGET
+                per_second = COMPRESSION_CPU_BUDGET / compress_seconds
+                print(f"  {coding_name:>4} {level:>2}: {len(compressed) / 1024:8.1f} KiB "
+                      f"({len(compressed) / len(body) * 100:5.1f}%)  compress {compress_seconds * 1000:7.2f} ms "
+                      f"({len(body) / compress_seconds / 2 ** 20:6.0f} MiB/s)  "
+                      f"decompress {decompress_seconds * 1000:6.2f} ms  budget {per_second:8.0f} resp/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# Синтетические данные для бенчмарков: детерминированы seed'ом
+import os
+import random
+from datetime import datetime, timedelta, UTC
+
+from PIL import Image
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from images import make_renditions, rendition_base
+from models import Like, Listing, ListingPhoto, User
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Нижний Новгород",
+          "Самара", "Краснодар", "Воронеж", "Пермь", "Уфа", "Ростов-на-Дону"]
+STREETS = ["Ленина", "Мира", "Советская", "Гагарина", "Пушкина", "Садовая", "Лесная", "Школьная"]
+TYPES = ["flat", "room", "studio", "house"]
+WORDS = ["уютная", "светлая", "просторная", "квартира", "ремонт", "балкон", "метро", "парк",
+         "мебель", "техника", "тихий", "двор", "вид", "центр", "новостройка"]
+
+
+def listing_rows(count: int, seed: int = 0, start_id: int = 1, user_ids: list[int] | None = None):
+    rng = random.Random(seed)
+    started_at = datetime(2024, 1, 1, tzinfo=UTC)
+    for listing_id in range(start_id, start_id + count):
+        rooms = rng.choices([1, 2, 3, 4, 5], weights=[35, 35, 20, 7, 3])[0]
+        total_area = round(rng.uniform(18, 30) + rooms * rng.uniform(12, 22), 1)
+        total_floors = rng.choice([5, 9, 12, 17, 25])
+        price = int(rng.lognormvariate(10.6, 0.45)) // 500 * 500 + rooms * 5000
+        yield {
+            "id": listing_id,
+            "title": f"{rooms}-к. квартира, {total_area} м²",
+            "price": price,
+            "created_at": started_at + timedelta(minutes=listing_id),
+            "rooms": rooms,
+            "total_area": total_area,
+            "kitchen_area": round(rng.uniform(5, 15), 1),
+            "floor": rng.randint(1, total_floors),
+            "total_floors": total_floors,
+            "deposit": price,
+            "commission_percent": rng.choice([0.0, 50.0, 100.0]),
+            "utilities_separate": rng.random() < 0.5,
+            "allowed_children": rng.random() < 0.6,
+            "allowed_pets": rng.random() < 0.3,
+            "allowed_smoking": rng.random() < 0.1,
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "address_city": rng.choices(CITIES, weights=range(len(CITIES), 0, -1))[0],
+            "address_street": rng.choice(STREETS),
+            "address_house": str(rng.randint(1, 150)),
+            "type": rng.choice(TYPES),
+            "user_id": rng.choice(user_ids) if user_ids else None,
+        }
+
+
+def insert_listings(engine, count: int, seed: int = 0, batch_size: int = 10000, user_ids=None):
+    # Досоздает объявления до count штук; повторный запуск ничего не делает
+    with engine.begin() as connection:
+        existing = connection.execute(select(func.count()).select_from(Listing)).scalar()
+        last_id = connection.execute(select(func.coalesce(func.max(Listing.id), 0))).scalar()
+
+    missing = count - existing
+    if missing <= 0:
+        return 0
+
+    rows = listing_rows(missing, seed=seed + last_id, start_id=last_id + 1, user_ids=user_ids)
+    inserted = 0
+    while inserted < missing:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        with engine.begin() as connection:
+            connection.execute(Listing.__table__.insert(), batch)
+        inserted += len(batch)
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.exec_driver_sql("SELECT setval('listings_id_seq', (SELECT max(id) FROM listings))")
+            connection.exec_driver_sql("ANALYZE listings")
+    return inserted
+
+
+# Пароль всех сгенерированных пользователей: нужен сценарию входа
+USER_PASSWORD = "benchmark-password"
+
+
+def user_rows(count: int, start_id: int, hashed_password: str, image_paths: dict[str, str] | None = None):
+    started_at = datetime(2023, 1, 1, tzinfo=UTC)
+    for user_id in range(start_id, start_id + count):
+        yield {
+            "id": user_id,
+            "name": f"user_{user_id}",
+            "email": f"user{user_id}@bench.example.com",
+            "phone": f"+7900{user_id:07d}",
+            "hashed_password": hashed_password,
+            "created_at": started_at + timedelta(minutes=user_id),
+            **(image_paths or {}),
+            "image_base": rendition_base(image_paths["image_path"]) if image_paths else None,
+        }
+
+
+def insert_users(engine, count: int, hashed_password: str, image_paths: dict[str, str] | None = None,
+                 batch_size: int = 10000):
+    # Досоздает пользователей до count штук, возвращает id сгенерированных пользователей
+    generated = User.email.like("user%@bench.example.com")
+    with engine.begin() as connection:
+        existing = connection.execute(select(func.count()).select_from(User).where(generated)).scalar()
+        last_id = connection.execute(select(func.coalesce(func.max(User.id), 0))).scalar()
+
+    rows = user_rows(max(count - existing, 0), last_id + 1, hashed_password, image_paths)
+    while batch := [row for _, row in zip(range(batch_size), rows)]:
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert(), batch)
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.exec_driver_sql("SELECT setval('users_id_seq', (SELECT max(id) FROM users))")
+    with engine.begin() as connection:
+        return list(connection.execute(select(User.id).where(generated).order_by(User.id)).scalars())
+
+
+def make_photo_files(directory: str, count: int, width: int = 1600, height: int = 1200, seed: int = 0):
+    # Небольшой набор настоящих файлов с миниатюрами, на который ссылаются все фото объявлений.
+    # Уже созданные файлы не пересоздаются
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    photos = []
+    for i in range(count):
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        if not os.path.isfile(path):
+            color = tuple(rng.randrange(256) for _ in range(3))
+            noise = Image.effect_noise((width, height), 48).convert("RGB")
+            Image.blend(Image.new("RGB", (width, height), color), noise, 0.5).save(path, "JPEG", quality=85)
+        renditions = make_renditions(path)
+        photos.append({
+            "image_path": path,
+            "thumbnail_path": renditions.get("thumb"),
+            "medium_path": renditions.get("medium"),
+        })
+    return photos
+
+
+def insert_listing_photos(engine, photos: list[dict], per_listing: int = 1, batch_size: int = 10000):
+    # Фото получают только объявления, у которых их еще нет
+    photos = [{**photo, "image_base": rendition_base(photo["image_path"])} for photo in photos]
+    inserted = 0
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            listing_ids = list(connection.execute(
+                select(Listing.id)
+                .where(Listing.id > last_id, ~Listing.id.in_(select(ListingPhoto.listing_id)))
+                .order_by(Listing.id)
+                .limit(batch_size)
+            ).scalars())
+            if not listing_ids:
+                return inserted
+            connection.execute(ListingPhoto.__table__.insert(), [
+                {"listing_id": listing_id, **photos[(listing_id * per_listing + i) % len(photos)]}
+                for listing_id in listing_ids
+                for i in range(per_listing)
+            ])
+        inserted += len(listing_ids) * per_listing
+        last_id = listing_ids[-1]
+
+
+def like_pairs(count: int, listing_ids: list[int], user_ids: list[int], seed: int = 0):
+    # Популярность объявлений неравномерна: часть объявлений собирает большую часть лайков
+    rng = random.Random(seed)
+    pairs = set()
+    limit = min(count, len(listing_ids) * len(user_ids))
+    while len(pairs) < limit:
+        if rng.random() < 0.5:
+            listing_id = listing_ids[min(int(rng.paretovariate(1.2)) - 1, len(listing_ids) - 1)]
+        else:
+            listing_id = rng.choice(listing_ids)
+        pairs.add((listing_id, rng.choice(user_ids)))
+    return sorted(pairs)
+
+
+def insert_likes(engine, count: int, user_ids: list[int], seed: int = 0, batch_size: int = 10000):
+    # Досоздает лайки до count штук и пересчитывает like_count
+    with engine.begin() as connection:
+        existing = connection.execute(select(func.count()).select_from(Like)).scalar()
+        if existing >= count:
+            return 0
+        listing_ids = list(connection.execute(select(Listing.id).order_by(Listing.id)).scalars())
+
+    on_conflict_insert = postgresql_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    pairs = like_pairs(count, listing_ids, user_ids, seed=seed)
+    for start in range(0, len(pairs), batch_size):
+        with engine.begin() as connection:
+            connection.execute(
+                on_conflict_insert(Like).on_conflict_do_nothing(index_elements=["listing_id", "user_id"]),
+                [{"listing_id": listing_id, "user_id": user_id} for listing_id, user_id in pairs[start:start + batch_size]],
+            )
+
+    with engine.begin() as connection:
+        connection.execute(update(Listing).values(like_count=(
+            select(func.count()).where(Like.listing_id == Listing.id).scalar_subquery()
+        )))
+    return len(pairs) - existing
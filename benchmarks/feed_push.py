@@ -0,0 +1,98 @@
+# Push-канал лент: память воркера на N простаивающих SSE-подключений и время,
+# за которое событие о новом объявлении доходит до всех.
+# Запуск из корня проекта: python -m benchmarks.feed_push --connections 2000
+# База берется из DATABASE_URL (схема — alembic upgrade head), нужен ulimit -n больше N
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.datagen import listing_rows
+
+SERVE = "import uvicorn; uvicorn.run('main:app', host='127.0.0.1', port={port}, log_level='warning')"
+
+
+def rss_mib(pid: int):
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def post_json(url: str, payload: dict):
+    request = urllib.request.Request(url, json.dumps(payload).encode(), {"content-type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+async def open_stream(port: int, city: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /feed/events?city={city} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+    await writer.drain()
+    await reader.readuntil(b"retry: 3000\n\n")
+    return reader, writer
+
+
+async def wait_event(reader, started: float):
+    await reader.readuntil(b"event: listing_created\n")
+    return time.perf_counter() - started
+
+
+async def run(args, pid: int):
+    before = rss_mib(pid)
+    streams = []
+    for offset in range(0, args.connections, 200):
+        batch = min(200, args.connections - offset)
+        streams += await asyncio.gather(*(open_stream(args.port, args.city) for _ in range(batch)))
+    await asyncio.sleep(1)
+    after = rss_mib(pid)
+    print(f"{args.connections} idle connections: RSS {before:.0f} -> {after:.0f} MiB "
+          f"({(after - before) * 1024 / args.connections:.1f} KiB per connection)")
+
+    user = post_json(f"http://127.0.0.1:{args.port}/register", {
+        "name": f"feed_{time.time_ns()}", "email": f"feed{time.time_ns()}@bench.example.com",
+        "password": "bench-password"})
+    listing = next(listing_rows(1, user_ids=[user["id"]]))
+    for field in ("id", "created_at"):
+        listing.pop(field)
+    listing["address_city"] = args.city
+
+    started = time.perf_counter()
+    waiters = [asyncio.create_task(wait_event(reader, started)) for reader, _ in streams]
+    await asyncio.to_thread(post_json, f"http://127.0.0.1:{args.port}/listings/", listing)
+    latencies = sorted(await asyncio.gather(*waiters))
+    print(f"fan-out of one event: p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    for _, writer in streams:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--city", default="FeedBench")
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, "-c", SERVE.format(port=args.port)],
+                              env={**os.environ, "PYTHONWARNINGS": "ignore"})
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{args.port}/metrics", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.05)
+        asyncio.run(run(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Лента целиком против потоковой (?stream=json|ndjson): время до первого байта,
+# полное время и пик памяти Python на один запрос страницы с картинками в base64.
+# Запуск из корня проекта: python -m benchmarks.feed_streaming --listings 100 --limit 100
+# База берется из DATABASE_URL, кэш ответов на время замера выключен
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ["RESPONSE_CACHE_TTL"] = "0"
+
+from sqlalchemy import delete, select  # noqa: E402
+
+from benchmarks.datagen import insert_listings  # noqa: E402
+from benchmarks.preview_payload import make_photo  # noqa: E402
+from db import Base, SessionLocal, async_engine, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import Listing, ListingPhoto  # noqa: E402
+
+MODES = {
+    "buffered": "",
+    "json": "&stream=json",
+    "ndjson": "&stream=ndjson",
+}
+
+
+def seed_photos(directory: str, listings: int, photos: int, width: int, height: int):
+    paths = []
+    for i in range(photos):
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        make_photo(path, width, height)
+        paths.append(path)
+    with SessionLocal() as db:
+        db.execute(delete(ListingPhoto))
+        listing_ids = db.scalars(
+            select(Listing.id).order_by(Listing.created_at.desc(), Listing.id.desc()).limit(listings)
+        ).all()
+        db.add_all(ListingPhoto(listing_id=listing_id, image_path=paths[i % len(paths)])
+                   for i, listing_id in enumerate(listing_ids))
+        db.commit()
+
+
+async def request(query_string: str):
+    # Приложение вызывается напрямую по ASGI: так видно момент первого куска тела
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/listings/", "raw_path": b"/listings/", "root_path": "",
+        "query_string": query_string.encode(), "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # Тело запроса пустое; потом — ждать, пока ответ не будет отправлен целиком
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal first_byte, size
+        if message["type"] == "http.response.body" and message.get("body"):
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(message["body"])
+
+    await app(scope, receive, send)
+    finished.set()
+    return first_byte, time.perf_counter() - started, size
+
+
+async def run(limit: int, repeat: int):
+    for name, suffix in MODES.items():
+        query_string = f"limit={limit}{suffix}"
+        await request(query_string)  # прогрев image_cache
+
+        first_bytes, totals, peaks = [], [], []
+        for _ in range(repeat):
+            tracemalloc.start()
+            first_byte, total, size = await request(query_string)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            first_bytes.append(first_byte)
+            totals.append(total)
+        print(f"{name:>9}: {size / 1024 / 1024:7.1f} MiB  first byte {min(first_bytes) * 1000:8.1f} ms  "
+              f"total {min(totals) * 1000:8.1f} ms  peak memory {min(peaks) / 1024 / 1024:7.1f} MiB")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--photos", type=int, default=20, help="distinct photo files")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    insert_listings(engine, args.listings)
+    with tempfile.TemporaryDirectory() as directory:
+        seed_photos(directory, args.limit, args.photos, args.width, args.height)
+        asyncio.run(run(args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
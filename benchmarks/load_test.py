@@ -0,0 +1,346 @@
+# Нагрузочный прогон эндпоинтов main.py на синтетических данных: пропускная способность,
+# p50/p95/p99, число SQL-запросов и байт по сети на запрос по каждому сценарию.
+# Запуск из корня проекта:
+#   python -m benchmarks.load_test --listings 10000 --users 1000 --likes 20000 --concurrency 16
+#   python -m benchmarks.load_test ... --compare benchmarks/results/<предыдущий прогон>.json
+# База берется из DATABASE_URL (PostgreSQL или файл SQLite). Без --base-url приложение
+# вызывается в этом же процессе через ASGI, с --base-url — запущенный сервер (без подсчета запросов)
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, UTC
+
+import bcrypt
+import httpx
+from PIL import Image
+from sqlalchemy import event, func, select
+
+from auth import PASSWORD_HASH_ROUNDS
+from benchmarks.datagen import CITIES, WORDS, USER_PASSWORD, insert_likes, insert_listing_photos, insert_listings, \
+    insert_users, listing_rows, make_photo_files
+from benchmarks.search_latency import percentile
+from db import Base, async_engine, engine, replica_engines
+from main import app
+from models import Like, Listing, ListingPhoto
+from pagination import encode_cursor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+class BenchData:
+    # id и курсоры, из которых сценарии собирают запросы
+    def __init__(self, user_ids: list[int], listing_ids: list[int], photo_ids: list[int],
+                 liker_ids: list[int], deep_cursor: str | None):
+        self.user_ids = user_ids
+        self.listing_ids = listing_ids
+        self.photo_ids = photo_ids
+        self.liker_ids = liker_ids or user_ids
+        self.deep_cursor = deep_cursor
+        self.created_ids = []
+        self.etags = {}
+        self.counter = itertools.count()
+        self.small_photo = small_photo()
+
+
+def small_photo():
+    buffer = io.BytesIO()
+    Image.effect_noise((640, 480), 48).convert("RGB").save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def listing_payload(rng: random.Random, data: BenchData):
+    row = next(listing_rows(1, seed=rng.randrange(1 << 30), user_ids=data.user_ids))
+    for field in ("id", "created_at"):
+        row.pop(field)
+    return row
+
+
+def bulk_body(rng: random.Random, data: BenchData, rows: int = 100):
+    return "".join(json.dumps(listing_payload(rng, data), ensure_ascii=False) + "\n" for _ in range(rows))
+
+
+def revalidated(data: BenchData, request: dict):
+    # Повтор запроса клиентом, у которого ответ уже есть: If-None-Match с ETag прошлого ответа
+    etag = data.etags.get(httpx.URL(request["url"], params=request.get("params")).raw_path)
+    if etag is not None:
+        request["headers"] = {"if-none-match": etag}
+    return request
+
+
+# Сценарий: (rng, data) -> аргументы httpx.AsyncClient.request
+SCENARIOS = {
+    "feed": lambda rng, data: dict(method="GET", url="/listings/", params={"limit": 20}),
+    "feed_deep_page": lambda rng, data: dict(
+        method="GET", url="/listings/", params={"limit": 20, "cursor": data.deep_cursor}),
+    "feed_no_images": lambda rng, data: dict(
+        method="GET", url="/listings/", params={"limit": 100, "inline_images": "false", "likers": "false"}),
+    "feed_stream": lambda rng, data: dict(method="GET", url="/listings/", params={"limit": 20, "stream": "ndjson"}),
+    "my_listings": lambda rng, data: dict(
+        method="GET", url="/my-listings/", params={"user_id": rng.choice(data.user_ids), "limit": 20}),
+    "liked_listings": lambda rng, data: dict(
+        method="GET", url="/liked-listings/", params={"user_id": rng.choice(data.liker_ids), "limit": 20}),
+    "filtered_city": lambda rng, data: dict(
+        method="GET", url="/filtered-listings/", params={"query": "city", "value": rng.choice(CITIES), "limit": 20}),
+    "search": lambda rng, data: dict(method="GET", url="/search/listings", params={
+        "q": rng.choice(WORDS), "city": rng.choice(CITIES), "rooms": rng.randint(1, 3), "limit": 20}),
+    "listing_detail": lambda rng, data: dict(method="GET", url=f"/listing/{rng.choice(data.listing_ids)}"),
+    "feed_revalidate": lambda rng, data: revalidated(data, dict(method="GET", url="/listings/", params={"limit": 20})),
+    "listing_detail_revalidate": lambda rng, data: revalidated(
+        data, dict(method="GET", url=f"/listing/{rng.choice(data.listing_ids[:100])}")),
+    # Обновление сохраненного списка: 50 карточек одним запросом, только цена и адрес
+    "listing_batch_50": lambda rng, data: dict(method="GET", url="/listings/batch", params={
+        "ids": ",".join(map(str, rng.sample(data.listing_ids, min(50, len(data.listing_ids))))),
+        "fields": "price,address_city,address_street,address_house"}),
+    "listing_photo_first": lambda rng, data: dict(
+        method="GET", url=f"/listing-photo/{rng.choice(data.listing_ids)}", params={"size": "thumb"}),
+    "listing_photo_file": lambda rng, data: dict(
+        method="GET", url=f"/listing-photos/{rng.choice(data.photo_ids)}", params={"size": "medium"}),
+    "user_photo_base64": lambda rng, data: dict(method="GET", url=f"/user-photo/{rng.choice(data.user_ids)}"),
+    "user_photo_file": lambda rng, data: dict(method="GET", url=f"/user-photos/{rng.choice(data.user_ids)}"),
+    "login": lambda rng, data: dict(method="POST", url="/login", json={
+        "email": f"user{rng.choice(data.user_ids)}@bench.example.com", "password": USER_PASSWORD}),
+    "register": lambda rng, data: dict(method="POST", url="/register", json={
+        "name": f"bench_{os.getpid()}_{time.time_ns()}_{next(data.counter)}",
+        "email": f"bench{os.getpid()}.{time.time_ns()}.{next(data.counter)}@bench.example.com",
+        "password": USER_PASSWORD}),
+    "create_listing": lambda rng, data: dict(method="POST", url="/listings/", json=listing_payload(rng, data)),
+    "bulk_ingest_100": lambda rng, data: dict(
+        method="POST", url="/listings/bulk", content=bulk_body(rng, data),
+        headers={"content-type": "application/x-ndjson"}),
+    "upload_listing_photo": lambda rng, data: dict(
+        method="POST", url=f"/listing-photo/{rng.choice(data.created_ids or data.listing_ids)}",
+        files={"file": ("photo.jpg", data.small_photo, "image/jpeg")}),
+    "like": lambda rng, data: dict(method="POST", url="/listing-like", params={
+        "listing_id": rng.choice(data.listing_ids), "user_id": rng.choice(data.user_ids)}),
+    "unlike": lambda rng, data: dict(method="DELETE", url="/listing-unlike", params={
+        "listing_id": rng.choice(data.listing_ids), "user_id": rng.choice(data.user_ids)}),
+    "like_batch": lambda rng, data: dict(method="POST", url="/listing-likes/batch", json={
+        "user_id": rng.choice(data.user_ids),
+        "like": rng.sample(data.listing_ids, min(10, len(data.listing_ids))),
+        "unlike": rng.sample(data.listing_ids, min(10, len(data.listing_ids)))}),
+    # Удаляются только объявления, созданные сценарием create_listing
+    "delete_listing": lambda rng, data: dict(
+        method="DELETE", url=f"/listing/{data.created_ids.pop() if data.created_ids else 0}"),
+}
+
+
+def remember_created(data: BenchData, response: httpx.Response):
+    if response.status_code == 200:
+        data.created_ids.append(response.json()["id"])
+
+
+def remember_etag(data: BenchData, response: httpx.Response):
+    if response.status_code == 200 and "etag" in response.headers:
+        data.etags[response.request.url.raw_path] = response.headers["etag"]
+
+
+ON_RESPONSE = {
+    "create_listing": remember_created,
+    "feed_revalidate": remember_etag,
+    "listing_detail_revalidate": remember_etag,
+}
+
+
+class QueryCounter:
+    def __init__(self, engines):
+        self.count = 0
+        for engine_ in engines:
+            event.listen(engine_.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, data: BenchData, requests: int, concurrency: int,
+                       seed: int, queries: QueryCounter | None):
+    rng = random.Random(seed)
+    make_request = SCENARIOS[name]
+    on_response = ON_RESPONSE.get(name)
+    remaining = itertools.count()
+    latencies, statuses, sizes = [], {}, 0
+
+    async def worker():
+        nonlocal sizes
+        while next(remaining) < requests:
+            request = make_request(rng, data)
+            started = time.perf_counter()
+            response = await client.request(**request)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            # Байты по сети: тело после сжатия, 304 — без тела
+            sizes += response.num_bytes_downloaded
+            if on_response:
+                on_response(data, response)
+
+    queries_before = queries.count if queries else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_request": (queries.count - queries_before) / requests if queries else None,
+        "bytes_per_request": sizes / requests,
+    }
+
+
+def seed_data(args):
+    started = time.perf_counter()
+    photos = make_photo_files(os.path.join(args.workdir, "photos"), args.photo_files)
+    hashed_password = bcrypt.hashpw(USER_PASSWORD.encode(), bcrypt.gensalt(PASSWORD_HASH_ROUNDS)).decode()
+    user_ids = insert_users(engine, args.users, hashed_password, photos[0])
+    insert_listings(engine, args.listings, user_ids=user_ids)
+    insert_listing_photos(engine, photos, per_listing=args.photos_per_listing)
+    insert_likes(engine, args.likes, user_ids)
+    print(f"data ready in {time.perf_counter() - started:.1f} s")
+
+    with engine.connect() as connection:
+        listing_ids = list(connection.execute(select(Listing.id)).scalars())
+        photo_ids = list(connection.execute(
+            select(ListingPhoto.id).order_by(func.random()).limit(10000)).scalars())
+        liker_ids = list(connection.execute(
+            select(Like.user_id).group_by(Like.user_id).order_by(func.count().desc()).limit(100)).scalars())
+        deep = connection.execute(
+            select(Listing.created_at, Listing.id)
+            .order_by(Listing.created_at.desc(), Listing.id.desc())
+            .offset(len(listing_ids) // 2)
+            .limit(1)
+        ).first()
+    return BenchData(user_ids, listing_ids, photo_ids, liker_ids, encode_cursor(*deep) if deep else None)
+
+
+async def run(args, data: BenchData):
+    queries = None
+    headers = {"accept-encoding": args.accept_encoding} if args.accept_encoding else None
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, headers=headers, timeout=None)
+    else:
+        queries = QueryCounter([async_engine, *replica_engines])
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   headers=headers, timeout=None)
+
+    results = {}
+    async with client:
+        for index, name in enumerate(args.scenarios):
+            requests = args.requests if name not in ("login", "register") else min(args.requests, args.auth_requests)
+            result = await run_scenario(client, name, data, requests, args.concurrency, args.seed + index, queries)
+            results[name] = result
+            queries_text = f"{result['queries_per_request']:6.1f}" if queries else "     -"
+            print(f"{name:>22}: {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f}  "
+                  f"p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms  queries {queries_text}  "
+                  f"{result['bytes_per_request'] / 1024:9.1f} KiB  {result['status_codes']}")
+    await async_engine.dispose()
+    return results
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=REPO_DIR, text=True))
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def save_results(args, results: dict):
+    commit, dirty = git_revision()
+    started_at = datetime.now(UTC)
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "started_at": started_at.isoformat(),
+            "dialect": engine.dialect.name,
+            "python": platform.python_version(),
+            "base_url": args.base_url,
+            "accept_encoding": args.accept_encoding,
+            "scale": {"users": args.users, "listings": args.listings, "likes": args.likes,
+                      "photos_per_listing": args.photos_per_listing},
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "scenarios": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{started_at:%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"saved {path}")
+
+
+def compare(path: str, results: dict):
+    # Изменение относительно прошлого прогона: + у req/s лучше, + у p99 и запросов хуже
+    with open(path) as file:
+        previous = json.load(file)
+    print(f"compared with {path} ({previous['meta'].get('commit')})")
+    for name, result in results.items():
+        before = previous["scenarios"].get(name)
+        if not before:
+            continue
+        changes = []
+        for key, label in (("throughput_rps", "req/s"), ("p99_ms", "p99"), ("queries_per_request", "queries")):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{label} {(result[key] - before[key]) / before[key] * 100:+7.1f}%")
+        print(f"{name:>22}: {'  '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--listings", type=int, default=10_000)
+    parser.add_argument("--likes", type=int, default=20_000)
+    parser.add_argument("--photos-per-listing", type=int, default=1)
+    parser.add_argument("--photo-files", type=int, default=20, help="distinct photo files on disk")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--auth-requests", type=int, default=100, help="requests for login/register")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--accept-encoding", default=None,
+                        help="Accept-Encoding header (default: what httpx can decode; identity: no compression)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "listings-bench"),
+                        help="photo files and uploads made by the app")
+    parser.add_argument("--output", default=RESULTS_DIR)
+    parser.add_argument("--compare", default=None, help="previous results JSON")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    Base.metadata.create_all(bind=engine)
+    os.makedirs(args.workdir, exist_ok=True)
+    data = seed_data(args)
+    # Эндпоинты загрузки пишут в static/ относительно текущего каталога
+    os.chdir(args.workdir)
+
+    results = asyncio.run(run(args, data))
+    save_results(args, results)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
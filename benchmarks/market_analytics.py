@@ -0,0 +1,107 @@
+# Рыночная аналитика: задержка запросов к сверткам против разовых GROUP BY по listings
+# и ошибка приближенной медианы. Свертки для сгенерированных объявлений заполняются
+# пересборкой (check_rollups --repair), ее время тоже печатается.
+# Запуск из корня проекта: python -m benchmarks.market_analytics --listings 1000000
+# База берется из DATABASE_URL (схема — alembic upgrade head)
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import func, select
+
+from analytics import summarize_rollups
+from benchmarks.datagen import insert_listings
+from check_rollups import check
+from crud import get_listing_rollups
+from db import AsyncSessionLocal, engine, async_engine
+from models import Listing
+
+# (group_by, фильтры) — как в /analytics/listings
+SCENARIOS = {
+    "all by city": (["city"], {}),
+    "city x rooms x type": (["city", "rooms", "type"], {}),
+    "Москва by rooms": (["rooms"], {"city": "Москва"}),
+    "Москва 2к trend": (["month"], {"city": "Москва", "rooms": 2}),
+}
+GROUP_COLUMNS = {"city": Listing.address_city, "rooms": Listing.rooms, "type": Listing.type,
+                 "month": func.strftime("%Y-%m", Listing.created_at)}
+FILTER_COLUMNS = {"city": Listing.address_city, "rooms": Listing.rooms, "type": Listing.type}
+
+
+def percentile(values: list[float], q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def timed(repeat: int, func_, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await func_(*args)
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times), percentile(times, 0.95)
+
+
+async def from_rollups(db, group_by, filters):
+    return summarize_rollups(group_by, await get_listing_rollups(db, filters), [0.5])
+
+
+async def ad_hoc(db, group_by, filters):
+    # Запрос, который раньше запускали вручную: средние по всей таблице объявлений (медиан в SQLite нет)
+    columns = [GROUP_COLUMNS[column] for column in group_by]
+    return (await db.execute(
+        select(*columns, func.count(), func.avg(Listing.price), func.avg(Listing.price / Listing.total_area),
+               func.avg(Listing.deposit), func.avg(Listing.commission_percent))
+        .where(*(FILTER_COLUMNS[column] == value for column, value in filters.items()))
+        .group_by(*columns)
+    )).all()
+
+
+async def exact_medians(db, group_by):
+    prices = {}
+    columns = [GROUP_COLUMNS[column] for column in group_by]
+    for *group, price in await db.execute(select(*columns, Listing.price)):
+        prices.setdefault(tuple(group), []).append(price)
+    return {group: statistics.median_low(values) for group, values in prices.items()}
+
+
+async def run(repeat: int):
+    started = time.perf_counter()
+    await check(repair=True, batch_size=10000)
+    print(f"rollups rebuilt in {time.perf_counter() - started:.1f} s")
+
+    async with AsyncSessionLocal() as db:
+        for name, (group_by, filters) in SCENARIOS.items():
+            groups, rollup_p50, rollup_p95 = await timed(repeat, from_rollups, db, group_by, filters)
+            _, scan_p50, scan_p95 = await timed(max(1, repeat // 10), ad_hoc, db, group_by, filters)
+            print(f"{name:>20}: groups={len(groups):>4}  rollups p50={rollup_p50 * 1000:7.1f} ms "
+                  f"p95={rollup_p95 * 1000:7.1f} ms  GROUP BY listings p50={scan_p50 * 1000:8.1f} ms "
+                  f"p95={scan_p95 * 1000:8.1f} ms")
+
+        group_by = ["city", "rooms", "type"]
+        exact = await exact_medians(db, group_by)
+        groups = await from_rollups(db, group_by, {})
+        errors = [abs(group["price"]["quantiles"]["p50"] - exact[tuple(group[column] for column in group_by)])
+                  / exact[tuple(group[column] for column in group_by)] for group in groups]
+        print(f"median price over {len(groups)} groups: relative error max={max(errors) * 100:.2f}% "
+              f"mean={statistics.mean(errors) * 100:.2f}%")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    inserted = insert_listings(engine, args.listings)
+    if inserted:
+        print(f"seeded {inserted} listings in {time.perf_counter() - started:.1f} s")
+
+    asyncio.run(run(args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Проверка паролей под нагрузкой: bcrypt в пуле потоков (как было в main.py) против
+# пула процессов из auth.py. Параллельно с входами крутится «лента» — короткие задачи
+# в event loop, по их задержке видно, насколько хэширование мешает остальным запросам.
+# Запуск из корня проекта: python -m benchmarks.password_hashing --logins 200 --concurrency 50
+import argparse
+import asyncio
+import time
+
+import bcrypt
+from fastapi.concurrency import run_in_threadpool
+
+from auth import PASSWORD_HASH_ROUNDS, PasswordHasherBusy, password_hasher, verify_password
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(values: list[float], q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def inline_verify(hashed: str):
+    return await run_in_threadpool(bcrypt.checkpw, PASSWORD.encode(), hashed.encode())
+
+
+async def pool_verify(hashed: str):
+    return await verify_password(PASSWORD, hashed)
+
+
+async def feed_probe(stop: asyncio.Event, lags: list[float], interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        await run_in_threadpool(lambda: None)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run_scenario(verify, hashed: str, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, rejected = [], 0
+
+    async def login():
+        nonlocal rejected
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await verify(hashed)
+            except PasswordHasherBusy:
+                rejected += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(feed_probe(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return elapsed, latencies, rejected, lags
+
+
+async def run(logins: int, concurrency: int):
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(PASSWORD_HASH_ROUNDS)).decode()
+    # Прогрев: процессы пула стартуют при первом обращении
+    await asyncio.gather(*(pool_verify(hashed) for _ in range(password_hasher.workers)))
+
+    print(f"rounds={PASSWORD_HASH_ROUNDS} workers={password_hasher.workers} "
+          f"queue={password_hasher.queue_size} logins={logins} concurrency={concurrency}")
+    for name, verify in (("inline", inline_verify), ("pool", pool_verify)):
+        elapsed, latencies, rejected, lags = await run_scenario(verify, hashed, logins, concurrency)
+        print(f"{name:>6}: {len(latencies) / elapsed:7.1f} logins/s  "
+              f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+              f"rejected {rejected:4d}  feed p99 lag {percentile(lags, 0.99) * 1000:7.1f} ms")
+    password_hasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.logins, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
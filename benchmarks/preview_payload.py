@@ -0,0 +1,63 @@
+# Размер и время сериализации ленты превью: оригиналы против миниатюр.
+# Запуск из корня проекта: python -m benchmarks.preview_payload --items 100
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+from PIL import Image
+
+from images import make_renditions
+from schemas import ListingPreview
+
+
+def make_photo(path: str, width: int, height: int):
+    # Шум сжимается плохо — по размеру файла это ближе к реальной фотографии, чем заливка
+    Image.effect_noise((width, height), 64).convert("RGB").save(path, "JPEG", quality=90)
+
+
+def encode_image(path: str):
+    # Кодирование без кэша: сравниваем сами файлы, а не попадания в image_cache
+    with open(path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+def build_feed(paths: list[str]):
+    started = time.perf_counter()
+    previews = [
+        ListingPreview(id=i, title="2-к. квартира", price=50000, owner_name="owner",
+                       image_base64=encode_image(path), liked_by_users=[1, 2, 3])
+        for i, path in enumerate(paths)
+    ]
+    body = "[" + ",".join(preview.model_dump_json() for preview in previews) + "]"
+    return len(body), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--photos", type=int, default=10, help="distinct photo files")
+    parser.add_argument("--width", type=int, default=2400)
+    parser.add_argument("--height", type=int, default=1600)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        originals, thumbnails = [], []
+        for i in range(args.photos):
+            path = os.path.join(directory, f"photo_{i}.jpg")
+            make_photo(path, args.width, args.height)
+            originals.append(path)
+            thumbnails.append(make_renditions(path)["thumb"])
+
+        for name, paths in (("original", originals), ("thumbnail", thumbnails)):
+            feed = [paths[i % len(paths)] for i in range(args.items)]
+            runs = [build_feed(feed) for _ in range(args.repeat)]
+            size = runs[0][0]
+            best = min(elapsed for _, elapsed in runs)
+            print(f"{name:>9}: {args.items} items, {size / 1024 / 1024:8.2f} MiB, {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Задержка комбинированного поиска с фасетами на синтетических данных.
+# Запуск из корня проекта: python -m benchmarks.search_latency --listings 1000000
+# База берется из DATABASE_URL (PostgreSQL или файл SQLite)
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.datagen import insert_listings
+from crud import get_listings
+from db import AsyncSessionLocal, Base, engine, async_engine
+from schemas import ListingSearch
+from search import build_search_query, get_facets
+
+SCENARIOS = {
+    "city": ListingSearch(city="Казань"),
+    "city+rooms+price": ListingSearch(city="Москва", rooms=[2, 3], min_price=40000, max_price=80000),
+    "flags+area": ListingSearch(allowed_pets=True, allowed_children=True, min_total_area=50, max_total_area=80),
+    "type+floor": ListingSearch(type="studio", min_floor=3, max_floor=10),
+    "text": ListingSearch(q="балкон метро"),
+    "text+city+rooms": ListingSearch(q="ремонт", city="Москва", rooms=[1]),
+}
+
+
+def percentile(values: list[float], q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(repeat: int, limit: int):
+    async with AsyncSessionLocal() as db:
+        for name, search in SCENARIOS.items():
+            page_times, facet_times = [], []
+            for _ in range(repeat):
+                query, rank = build_search_query(db, search)
+
+                started = time.perf_counter()
+                await get_listings(db, limit=limit, query=query, rank=rank)
+                page_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                facets = await get_facets(db, query)
+                facet_times.append(time.perf_counter() - started)
+
+            print(f"{name:>18}: matches={facets.total:>8}  "
+                  f"page p50={statistics.median(page_times) * 1000:7.1f} ms p95={percentile(page_times, 0.95) * 1000:7.1f} ms  "
+                  f"facets p50={statistics.median(facet_times) * 1000:7.1f} ms p95={percentile(facet_times, 0.95) * 1000:7.1f} ms")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    inserted = insert_listings(engine, args.listings)
+    if inserted:
+        print(f"seeded {inserted} listings in {time.perf_counter() - started:.1f} s")
+
+    asyncio.run(run(args.repeat, args.limit))
+
+
+if __name__ == "__main__":
+    main()
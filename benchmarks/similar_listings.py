@@ -0,0 +1,84 @@
+# Похожие объявления: загрузка матрицы признаков из базы, задержка ранжирования
+# и стоимость точечных обновлений на синтетических данных.
+# Запуск из корня проекта: python -m benchmarks.similar_listings --listings 1000000
+# База берется из DATABASE_URL (схема — alembic upgrade head)
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks.datagen import insert_listings, listing_rows
+from crud import LISTING_FEATURE_COLUMNS
+from db import AsyncSessionLocal, engine, async_engine
+from similar import similar_listings
+
+
+def percentile(values: list[float], q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def feature_row(row: dict):
+    return tuple(row[column.key] for column in LISTING_FEATURE_COLUMNS)
+
+
+async def run(repeat: int, limit: int, seed: int):
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await similar_listings.sync(db)
+        matrix = similar_listings.matrix
+        print(f"loaded {len(matrix)} listings in {time.perf_counter() - started:.1f} s, "
+              f"matrix {matrix.nbytes / 2 ** 20:.0f} MiB")
+
+        rng = random.Random(seed)
+        listing_ids = rng.sample(matrix.ids[:matrix.size].tolist(), repeat)
+        for same_city in (True, False):
+            times = []
+            for listing_id in listing_ids:
+                started = time.perf_counter()
+                matrix.nearest(listing_id, limit, same_city)
+                times.append(time.perf_counter() - started)
+            print(f"nearest {limit} (same_city={same_city}): p50={statistics.median(times) * 1000:6.1f} ms "
+                  f"p95={percentile(times, 0.95) * 1000:6.1f} ms p99={percentile(times, 0.99) * 1000:6.1f} ms")
+
+        # Синхронизация без изменений — то, что добавляется к каждому запросу
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await similar_listings.sync(db)
+            times.append(time.perf_counter() - started)
+        print(f"sync without changes: p50={statistics.median(times) * 1000:6.2f} ms")
+
+    start_id = int(matrix.ids[matrix.size - 1]) + 1
+    rows = [feature_row(row) for row in listing_rows(repeat, seed=seed + 1, start_id=start_id)]
+    started = time.perf_counter()
+    for row in rows:
+        matrix.upsert([row])
+    added = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for row in rows:
+        matrix.remove([row[0]])
+    removed = (time.perf_counter() - started) / repeat
+    print(f"incremental update: add {added * 1e6:.0f} us, remove {removed * 1e6:.0f} us per listing")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    inserted = insert_listings(engine, args.listings)
+    if inserted:
+        print(f"seeded {inserted} listings in {time.perf_counter() - started:.1f} s")
+
+    asyncio.run(run(args.repeat, args.limit, args.seed))
+
+
+if __name__ == "__main__":
+    main()
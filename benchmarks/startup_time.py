@@ -0,0 +1,64 @@
+# Время готовности воркера: от запуска процесса до первого ответа.
+# "create_all" — как раньше, схема проверяется при импорте main.py; "migrations" — текущий
+# старт без обращения к базе (схема обновляется отдельно: alembic upgrade head).
+# Запуск из корня проекта: python -m benchmarks.startup_time --repeat 5
+# База берется из DATABASE_URL
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+MODES = {
+    "create_all": "from db import Base, engine; import models; Base.metadata.create_all(bind=engine); ",
+    "migrations": "",
+}
+SERVE = "import uvicorn; uvicorn.run('main:app', host='127.0.0.1', port={port}, log_level='warning')"
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"worker exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.005)
+    raise TimeoutError(url)
+
+
+def measure(mode: str, port: int, timeout: float):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", MODES[mode] + SERVE.format(port=port)],
+        env={**os.environ, "PYTHONWARNINGS": "ignore"},
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/metrics", process, timeout)
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    for mode in MODES:
+        times = [measure(mode, args.port, args.timeout) for _ in range(args.repeat)]
+        print(f"{mode:>10}: ready in median {statistics.median(times) * 1000:7.0f} ms  "
+              f"min {min(times) * 1000:7.0f} ms  max {max(times) * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Сверка сверток аналитики (listing_rollups) с полным пересчетом по listings.
+# С --repair свертки пересобираются из пересчета — так же они заполняются для объявлений,
+# созданных до миграции 0007. Код выхода 1, если найдены расхождения и не исправлены.
+# Запуск: python check_rollups.py [--repair] [--batch-size 10000]
+import argparse
+import asyncio
+import math
+import sys
+
+from analytics import ROLLUP_COLUMNS, SKETCH_COLUMNS, SKETCH_METRICS, Sketch, aggregate_listings
+from crud import begin_rollup_check, get_stored_rollups, replace_listing_rollups, stream_listing_rollup_values
+from db import AsyncSessionLocal, async_engine
+
+# Суммы вещественные: после многих приращений и вычитаний возможна ошибка округления.
+# Скетчи сравниваются побайтно
+SUM_TOLERANCE = 1e-9
+EXAMPLES = 10
+
+
+def expected_rollups(rollups: dict):
+    # Результат aggregate_listings -> форма get_stored_rollups; пустые группы не хранятся
+    return {
+        key: {**{column: values[column] for column in ROLLUP_COLUMNS},
+              **{column: Sketch.from_buckets(values[metric]).encode()
+                 for metric, column in zip(SKETCH_METRICS, SKETCH_COLUMNS)}}
+        for key, values in rollups.items() if values["count"]
+    }
+
+
+def differs(expected: dict, stored: dict):
+    return any(
+        not math.isclose(expected[column], stored[column], rel_tol=SUM_TOLERANCE, abs_tol=1e-6)
+        for column in ROLLUP_COLUMNS
+    ) or any(expected[column] != stored[column] for column in SKETCH_COLUMNS)
+
+
+def compare(expected: dict, stored: dict):
+    return [
+        (key, expected.get(key), stored.get(key))
+        for key in sorted(expected.keys() | stored.keys())
+        if key not in expected or key not in stored or differs(expected[key], stored[key])
+    ]
+
+
+async def check(repair: bool, batch_size: int):
+    async with AsyncSessionLocal() as db:
+        await begin_rollup_check(db, repair)
+        rollups, listings = {}, 0
+        async for rows in stream_listing_rollup_values(db, batch_size):
+            aggregate_listings(rows, 1, rollups)
+            listings += len(rows)
+        expected = expected_rollups(rollups)
+        stored = await get_stored_rollups(db)
+        problems = compare(expected, stored)
+
+        print(f"listings={listings} rollups={len(stored)} expected={len(expected)} mismatches={len(problems)}")
+        for key, expected_values, stored_values in problems[:EXAMPLES]:
+            print(f"  {key}: expected={expected_values} stored={stored_values}")
+        if problems and repair:
+            await replace_listing_rollups(db, expected, batch_size)
+            print("rollups rebuilt")
+        await db.commit()
+    await async_engine.dispose()
+    return not problems or repair
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare analytics rollups with a full recompute")
+    parser.add_argument("--repair", action="store_true", help="rebuild rollups when they differ")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if not asyncio.run(check(args.repair, args.batch_size)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Удаление файлов хранилища фото, на которые не ссылается ни одно объявление или пользователь.
+# Подбирает то, что не успела убрать фоновая уборка при удалении (например, свежие файлы).
+# Запуск: python cleanup_photos.py [--batch-size 500] [--dry-run]
+import argparse
+import asyncio
+import os
+
+from crud import get_referenced_photo_bases
+from db import AsyncSessionLocal, async_engine
+from images import rendition_base
+from photo_store import photo_store
+
+
+def iter_bases(shard: str):
+    # Исходник и его копии дают одну общую часть имени
+    for directory, _, files in os.walk(shard):
+        yield from sorted({rendition_base(os.path.join(directory, name)) for name in files})
+
+
+async def cleanup_batch(bases: list[str], dry_run: bool):
+    async with AsyncSessionLocal() as db:
+        referenced = await get_referenced_photo_bases(db, bases)
+    orphans = [base for base in bases if base not in referenced]
+    if dry_run:
+        return len(orphans)
+    return sum(photo_store.remove(base) for base in orphans)
+
+
+async def cleanup(batch_size: int, dry_run: bool):
+    checked = removed = 0
+    photo_store.clear_temp()
+    for shard in photo_store.iter_shards():
+        batch = []
+        for base in iter_bases(shard):
+            batch.append(base)
+            if len(batch) >= batch_size:
+                removed += await cleanup_batch(batch, dry_run)
+                checked += len(batch)
+                batch = []
+        if batch:
+            removed += await cleanup_batch(batch, dry_run)
+            checked += len(batch)
+    await async_engine.dispose()
+    return checked, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove unreferenced photo files")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    checked, removed = asyncio.run(cleanup(args.batch_size, args.dry_run))
+    print(f"checked={checked} {'orphans' if args.dry_run else 'removed'}={removed}")
+
+
+if __name__ == "__main__":
+    main()
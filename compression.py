@@ -0,0 +1,421 @@
+# Сжатие ответов (заголовок Accept-Encoding): zstd и br, если установлены zstandard и brotli, иначе gzip.
+# Сжимаются только текстовые ответы (JSON, NDJSON, CSV) размером от COMPRESSION_MIN_BYTES
+# до COMPRESSION_MAX_BYTES. Время сжатия ограничено бюджетом CPU: когда он исчерпан,
+# ответы уходят несжатыми, а не встают в очередь.
+# Сжатые тела ответов с сильным ETag запоминаются — повторная отдача той же ленты не сжимает ее заново
+import gzip
+import os
+import time
+import zlib
+
+from anyio import to_thread
+
+from metrics import record_compress
+from response_cache import MemoryCacheBackend
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+# Больше этого — в основном base64 исходных фото (карточка объявления): gzip убирает лишь
+# накладные расходы base64, около четверти размера, ценой десятков миллисекунд CPU
+COMPRESSION_MAX_BYTES = int(os.getenv("COMPRESSION_MAX_BYTES", 512 * 1024))
+# Уровни по benchmarks/compression_levels: base64-картинки в лентах почти не сжимаются на любом уровне,
+# а JSON без картинок и на gzip 1 уменьшается в 8 раз — выше уровни тратят CPU почти впустую
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 1))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+# Бюджет — доля одного ядра, которую воркер в среднем тратит на сжатие, плюс запас
+# на всплеск в секундах CPU (token bucket)
+COMPRESSION_CPU_BUDGET = float(os.getenv("COMPRESSION_CPU_BUDGET", 0.25))
+COMPRESSION_CPU_BURST_SECONDS = float(os.getenv("COMPRESSION_CPU_BURST_SECONDS", 0.2))
+# Большие тела сжимаются в потоке, чтобы не держать event loop (zlib, brotli и zstd отпускают GIL)
+COMPRESSION_THREAD_MIN_BYTES = int(os.getenv("COMPRESSION_THREAD_MIN_BYTES", 256 * 1024))
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+COMPRESSION_CACHE_TTL = int(os.getenv("COMPRESSION_CACHE_TTL", 3600))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"application/x-ndjson", b"text/csv", b"text/plain")
+# При равном q в Accept-Encoding
+CODING_PREFERENCE = ("zstd", "br", "gzip")
+
+
+class ZlibStream:
+    # Каждая порция дожимается Z_SYNC_FLUSH: клиент разбирает потоковую ленту, не дожидаясь конца
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 — формат gzip
+
+    def write(self, data: bytes):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def write(self, data: bytes):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def write(self, data: bytes):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class GzipCoding:
+    name = "gzip"
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self.level = level
+
+    def compress(self, body: bytes):
+        # mtime=0 — одинаковое тело сжимается в одинаковые байты
+        return gzip.compress(body, self.level, mtime=0)
+
+    def stream(self):
+        return ZlibStream(self.level)
+
+
+class BrotliCoding:
+    name = "br"
+
+    def __init__(self, level: int = COMPRESSION_BROTLI_QUALITY):
+        self.level = level
+
+    def compress(self, body: bytes):
+        return brotli.compress(body, quality=self.level)
+
+    def stream(self):
+        return BrotliStream(self.level)
+
+
+class ZstdCoding:
+    name = "zstd"
+
+    def __init__(self, level: int = COMPRESSION_ZSTD_LEVEL):
+        self.level = level
+
+    def compress(self, body: bytes):
+        return zstandard.ZstdCompressor(level=self.level).compress(body)
+
+    def stream(self):
+        return ZstdStream(self.level)
+
+
+def available_codings():
+    codings = {"gzip": GzipCoding()}
+    if brotli is not None:
+        codings["br"] = BrotliCoding()
+    if zstandard is not None:
+        codings["zstd"] = ZstdCoding()
+    return codings
+
+
+def parse_accept_encoding(header: str):
+    # "gzip, br;q=0.8, *;q=0" -> {"gzip": 1.0, "br": 0.8, "*": 0.0}
+    weights = {}
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+    return weights
+
+
+def choose_coding(header: str, codings: dict):
+    weights = parse_accept_encoding(header)
+    best, best_weight = None, 0.0
+    for name in CODING_PREFERENCE:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if name in codings and weight > best_weight:
+            best, best_weight = codings[name], weight
+    return best
+
+
+class CpuBudget:
+    # Token bucket в секундах CPU: пополняется со скоростью share в секунду, не больше burst
+    def __init__(self, share: float, burst: float):
+        self.share = share
+        self.burst = burst
+        self.available = burst
+        self.updated = time.monotonic()
+
+    def allows(self):
+        now = time.monotonic()
+        self.available = min(self.burst, self.available + (now - self.updated) * self.share)
+        self.updated = now
+        return self.available > 0
+
+    def spend(self, seconds: float):
+        self.available -= seconds
+
+
+def timed_compress(coding, body: bytes):
+    # Время CPU потока, а не по часам: ожидание ядра при параллельном сжатии в бюджет не входит
+    started = time.thread_time()
+    compressed = coding.compress(body)
+    return compressed, time.thread_time() - started
+
+
+class ResponseCompressor:
+    # Общие для всех запросов воркера кодировки, бюджет, кэш сжатых тел и счетчики
+    def __init__(self, codings: dict, min_bytes: int, max_bytes: int, budget: CpuBudget, cache: MemoryCacheBackend):
+        self.codings = codings
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.cache = cache
+        self.counters = {name: {"responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0} for name in codings}
+        self.cache_hits = 0
+        self.skipped_small = 0
+        self.skipped_large = 0
+        self.skipped_budget = 0
+
+    async def compress(self, coding, body: bytes, cache_key: str | None = None):
+        # Сжатое тело или None, если бюджет исчерпан
+        if cache_key is not None:
+            cache_key = f"{coding.name}:{coding.level}:{cache_key}"
+            compressed = await self.cache.get(cache_key)
+            if compressed is not None:
+                self.cache_hits += 1
+                self.count(coding, len(body), len(compressed), 0.0)
+                return compressed
+        if not self.budget.allows():
+            self.skipped_budget += 1
+            return None
+
+        if len(body) >= COMPRESSION_THREAD_MIN_BYTES:
+            compressed, seconds = await to_thread.run_sync(timed_compress, coding, body)
+        else:
+            compressed, seconds = timed_compress(coding, body)
+        self.spent(coding, len(body), len(compressed), seconds)
+        if cache_key is not None:
+            await self.cache.set(cache_key, compressed, COMPRESSION_CACHE_TTL)
+        return compressed
+
+    def write(self, coding, stream, data: bytes, finish: bool):
+        # Очередная порция потокового ответа
+        started = time.thread_time()
+        compressed = stream.write(data) if data else b""
+        if finish:
+            compressed += stream.finish()
+        self.spent(coding, len(data), len(compressed), time.thread_time() - started)
+        return compressed
+
+    def spent(self, coding, bytes_in: int, bytes_out: int, seconds: float):
+        self.budget.spend(seconds)
+        record_compress(seconds)
+        self.count(coding, bytes_in, bytes_out, seconds)
+
+    def count(self, coding, bytes_in: int, bytes_out: int, seconds: float):
+        counters = self.counters[coding.name]
+        counters["bytes_in"] += bytes_in
+        counters["bytes_out"] += bytes_out
+        counters["seconds"] += seconds
+
+    def stats(self):
+        return {
+            "codings": {
+                name: {**counters,
+                       "ratio": counters["bytes_out"] / counters["bytes_in"] if counters["bytes_in"] else 0.0}
+                for name, counters in self.counters.items()
+            },
+            "levels": {name: coding.level for name, coding in self.codings.items()},
+            "cache_hits": self.cache_hits,
+            "skipped_small": self.skipped_small,
+            "skipped_large": self.skipped_large,
+            "skipped_budget": self.skipped_budget,
+            "budget_available_seconds": self.budget.available,
+            "cache": self.cache.stats(),
+        }
+
+
+def header_value(headers, name: bytes):
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def coded_etag(etag: bytes | None, coding):
+    # Сжатое тело — другое представление, и сильный ETag у него свой: "<etag>-gzip"
+    if etag is None or not etag.startswith(b'"'):
+        return etag
+    return etag[:-1] + b"-" + coding.name.encode() + b'"'
+
+
+def strip_etag_codings(headers, coding):
+    # If-None-Match от клиента со сжатой копией содержит "<etag>-gzip"; приложение сравнивает
+    # исходные ETag, поэтому суффикс снимается. Только суффикс кодировки, выбранной для этого
+    # запроса: копия в другой кодировке клиенту уже не подходит и должна прийти заново.
+    # Возвращает заголовки и {исходный тег: присланный}
+    value = header_value(headers, b"if-none-match")
+    if value is None or coding is None:
+        return headers, {}
+    suffix = f'-{coding.name}"'
+    sent = {}
+    tags = []
+    for tag in value.decode("latin-1").split(","):
+        tag = tag.strip()
+        original = tag
+        if tag.endswith(suffix):
+            original = tag[:-len(suffix)] + '"'
+            sent[original.removeprefix("W/")] = tag
+        tags.append(original)
+    if not sent:
+        return headers, {}
+    headers = [(key, value) for key, value in headers if key != b"if-none-match"]
+    headers.append((b"if-none-match", ", ".join(tags).encode("latin-1")))
+    return headers, sent
+
+
+def is_compressible(message):
+    headers = message.get("headers", [])
+    content_type = header_value(headers, b"content-type") or b""
+    return (message["status"] not in (204, 206, 304)
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+            and header_value(headers, b"content-encoding") is None)
+
+
+def add_vary(headers):
+    vary = header_value(headers, b"vary")
+    headers = [(key, value) for key, value in headers if key != b"vary"]
+    headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+    return headers
+
+
+def encoded_headers(headers, coding, length: int | None):
+    etag = coded_etag(header_value(headers, b"etag"), coding)
+    headers = [(key, value) for key, value in headers if key not in (b"content-length", b"etag")]
+    headers.append((b"content-encoding", coding.name.encode()))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    if etag is not None:
+        headers.append((b"etag", etag))
+    return headers
+
+
+class CompressionMiddleware:
+    # ASGI-middleware: обычный ответ сжимается целиком (его первое сообщение тела — последнее),
+    # потоковый — по порциям. Начало ответа придерживается до первого сообщения тела:
+    # только тогда известны размер и нужно ли сжатие
+    def __init__(self, app, compressor=None):
+        self.app = app
+        self.compressor = compressor or response_compressor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        compressor = self.compressor
+        accept_encoding = header_value(scope["headers"], b"accept-encoding")
+        coding = choose_coding(accept_encoding.decode("latin-1"), compressor.codings) if accept_encoding else None
+        request_headers, sent_tags = strip_etag_codings(scope["headers"], coding)
+        if sent_tags:
+            # Заголовки меняются в самом scope, а не в копии: route, который запишет роутер,
+            # должен увидеть и MetricsMiddleware снаружи
+            scope["headers"] = request_headers
+
+        start = None
+        stream = None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                if message["status"] == 304 and sent_tags:
+                    # В 304 — тот ETag, что прислал клиент: он относится к его сжатой копии
+                    etag = header_value(message.get("headers", []), b"etag")
+                    if etag is not None and etag.decode("latin-1") in sent_tags:
+                        headers = [(key, value) for key, value in message["headers"] if key != b"etag"]
+                        headers.append((b"etag", sent_tags[etag.decode("latin-1")].encode("latin-1")))
+                        message = {**message, "headers": add_vary(headers)}
+                if not is_compressible(message):
+                    await send(message)
+                    return
+                message = {**message, "headers": add_vary(message.get("headers", []))}
+                if coding is None:
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if message["type"] != "http.response.body" or (start is None and stream is None):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                message = {**message, "body": compressor.write(coding, stream, body, not more_body)}
+                await send(message)
+                return
+
+            headers = start["headers"]
+            if not more_body:
+                compressed = None
+                if len(body) < compressor.min_bytes:
+                    compressor.skipped_small += 1
+                elif len(body) > compressor.max_bytes:
+                    compressor.skipped_large += 1
+                else:
+                    etag = header_value(headers, b"etag")
+                    cache_key = None
+                    if etag is not None and etag.startswith(b'"'):
+                        cache_key = f"{scope['path']}?{scope['query_string'].decode('latin-1')} {etag.decode()}"
+                    compressed = await compressor.compress(coding, body, cache_key)
+                if compressed is None:
+                    await send(start)
+                    await send(message)
+                else:
+                    compressor.counters[coding.name]["responses"] += 1
+                    await send({**start, "headers": encoded_headers(headers, coding, len(compressed))})
+                    await send({**message, "body": compressed})
+            elif compressor.budget.allows():
+                compressor.counters[coding.name]["responses"] += 1
+                stream = coding.stream()
+                await send({**start, "headers": encoded_headers(headers, coding, None)})
+                await send({**message, "body": compressor.write(coding, stream, body, False)})
+            else:
+                compressor.skipped_budget += 1
+                await send(start)
+                await send(message)
+            start = None
+
+        await self.app(scope, receive, send_compressed)
+
+
+response_compressor = ResponseCompressor(
+    available_codings(),
+    COMPRESSION_MIN_BYTES,
+    COMPRESSION_MAX_BYTES,
+    CpuBudget(COMPRESSION_CPU_BUDGET, COMPRESSION_CPU_BURST_SECONDS),
+    MemoryCacheBackend(COMPRESSION_CACHE_MAX_BYTES),
+)
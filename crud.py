@@ -1,21 +1,65 @@
-from datetime import datetime, UTC
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, UTC
 
-from models import Listing, ListingPhoto
+import orjson
+from sqlalchemy import and_, delete, false, func, insert, literal, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from analytics import ROLLUP_COLUMNS, ROLLUP_FIELDS, ROLLUP_KEY, SKETCH_COLUMNS, SKETCH_METRICS, Sketch, \
+    aggregate_listings
+from file_io import run_file_io
+from images import rendition_base, set_renditions
+from photo_store import photo_store
+from photos import listing_photo_url
+from models import CacheVersion, FeedEvent, ImageJob, Listing, ListingPhoto, ListingRollup, Like, User
+from pagination import encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor
 from schemas import ListingBase
 
 
-def get_listings(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Listing).all()
+async def get_listings(db: AsyncSession, limit: int = 100, cursor: str | None = None, query=None,
+                       user_id: int | None = None, liked_by: int | None = None, rank=None):
+    # Keyset-пагинация по (created_at, id): глубокие страницы стоят столько же, сколько первая.
+    # Для поисковой выдачи с rank — по (rank, id)
+    if query is None:
+        query = select(Listing)
+    if user_id is not None:
+        query = query.where(Listing.user_id == user_id)
+    if liked_by is not None:
+        query = query.where(
+            Listing.id.in_(select(Like.listing_id).where(Like.user_id == liked_by))
+        )
 
-def create_listing(db: Session, listing_data: ListingBase):
-    # logging.info("Начало создания нового объявления")
+    if rank is None:
+        if cursor:
+            created_at, listing_id = decode_cursor(cursor)
+            query = query.where(tuple_(Listing.created_at, Listing.id) < tuple_(created_at, listing_id))
+        query = query.order_by(Listing.created_at.desc(), Listing.id.desc())
+    else:
+        if cursor:
+            last_rank, listing_id = decode_rank_cursor(cursor)
+            query = query.where(or_(rank < last_rank, and_(rank == last_rank, Listing.id < listing_id)))
+        query = query.add_columns(rank).order_by(rank.desc(), Listing.id.desc())
+
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    listings = [row[0] for row in rows]
+
+    next_cursor = None
+    if len(listings) > limit:
+        listings = listings[:limit]
+        if rank is None:
+            next_cursor = encode_cursor(listings[-1].created_at, listings[-1].id)
+        else:
+            next_cursor = encode_rank_cursor(rows[limit - 1][1], listings[-1].id)
 
+    return listings, next_cursor
+
+def listing_values(listing_data: ListingBase):
     title = (f"{listing_data.rooms}-к. квартира, "
              f"{listing_data.total_area} м², "
              f"{listing_data.floor}/{listing_data.total_floors} эт.")
 
-    db_listing = Listing(
+    return dict(
         title=title,
         price=listing_data.price,
         rooms=listing_data.rooms,
@@ -37,18 +81,556 @@ def create_listing(db: Session, listing_data: ListingBase):
         user_id=listing_data.user_id,
         created_at=datetime.now(UTC)
     )
+
+async def create_listing(db: AsyncSession, listing_data: ListingBase):
+    # logging.info("Начало создания нового объявления")
+
+    values = listing_values(listing_data)
+    db_listing = Listing(**values)
     db.add(db_listing)
-    db.commit()
-    db.refresh(db_listing)
+    await db.flush()
+    await add_feed_events(db, [listing_created_event(db_listing.id, values)])
+    await change_listing_rollups(db, [values], 1)
+    await bump_cache_versions(db, ["listings"])
+    await db.commit()
+    await db.refresh(db_listing)
 
     if listing_data.image_paths:
         for path in listing_data.image_paths:
             db_photo = ListingPhoto(listing_id=db_listing.id, image_path=path)
             db.add(db_photo)
-        db.commit()
+            # Копии пишутся рядом с исходником: обрабатываются только файлы хранилища,
+            # а не любой путь на сервере, присланный клиентом
+            if photo_store.contains(path):
+                await enqueue_image_job(db, "listing_photo", db_photo)
+        await bump_listing_versions(db, [db_listing.id])
+        await db.commit()
 
     # logging.info(f"Создано объявление id={db_listing.id} "
     #              f"name={db_listing.title} "
     #              f"от пользователя id={db_listing.user_id}")
 
     return db_listing
+
+
+async def get_preview_data(db: AsyncSession, listings: list[Listing], with_likers: bool = True):
+    # Данные для превью целой страницы объявлений за фиксированное число запросов:
+    # имена владельцев, первое фото и id лайкнувших
+    listing_ids = [listing.id for listing in listings]
+    owner_ids = {listing.user_id for listing in listings if listing.user_id is not None}
+
+    owner_names = {}
+    if owner_ids:
+        owner_names = dict((await db.execute(select(User.id, User.name).where(User.id.in_(owner_ids)))).all())
+
+    first_photos = {}
+    liked_ids = {}
+    if listing_ids:
+        first_photo_ids = (
+            select(func.min(ListingPhoto.id))
+            .where(ListingPhoto.listing_id.in_(listing_ids))
+            .group_by(ListingPhoto.listing_id)
+        )
+        # В превью идет миниатюра, оригинал — только если миниатюры еще нет
+        first_photos = {
+            listing_id: (photo_id, image_path)
+            for listing_id, photo_id, image_path in await db.execute(
+                select(
+                    ListingPhoto.listing_id,
+                    ListingPhoto.id,
+                    func.coalesce(ListingPhoto.thumbnail_path, ListingPhoto.image_path),
+                )
+                .where(ListingPhoto.id.in_(first_photo_ids))
+            )
+        }
+
+    if listing_ids and with_likers:
+        likes = await db.execute(
+            select(Like.listing_id, Like.user_id)
+            .where(Like.listing_id.in_(listing_ids))
+            .order_by(Like.id)
+        )
+        for listing_id, user_id in likes:
+            liked_ids.setdefault(listing_id, []).append(user_id)
+
+    return owner_names, first_photos, liked_ids
+
+
+# Поля ListingRead, которые лежат в самой таблице объявлений и у владельца
+LISTING_DETAIL_COLUMNS = {
+    name: getattr(Listing, name)
+    for name in ListingBase.model_fields if name != "image_paths"
+} | {"like_count": Listing.like_count}
+OWNER_DETAIL_COLUMNS = {"owner_name": User.name, "owner_email": User.email, "owner_phone": User.phone}
+
+
+async def get_listing_details(db: AsyncSession, listing_ids: list[int], fields: set[str]):
+    # Карточки пачки объявлений за фиксированное число запросов: запрошенные столбцы объявления
+    # и владельца — одним SELECT, первое фото и лайкнувшие — по запросу, только если они нужны.
+    # Возвращает ({id: строка с id, version и полями}, {id: (photo_id, image_path)}, {id: [user_id]})
+    columns = [Listing.id, Listing.version]
+    columns += [column.label(name) for name, column in LISTING_DETAIL_COLUMNS.items() if name in fields]
+    owner_columns = [column.label(name) for name, column in OWNER_DETAIL_COLUMNS.items() if name in fields]
+    query = select(*columns, *owner_columns).where(Listing.id.in_(listing_ids))
+    if owner_columns:
+        query = query.outerjoin(User, User.id == Listing.user_id)
+    rows = {row.id: row._asdict() for row in await db.execute(query)}
+
+    first_photos = {}
+    if rows and fields & {"image_base64", "image_url"}:
+        first_photo_ids = (
+            select(func.min(ListingPhoto.id))
+            .where(ListingPhoto.listing_id.in_(rows))
+            .group_by(ListingPhoto.listing_id)
+        )
+        first_photos = {
+            listing_id: (photo_id, image_path)
+            for listing_id, photo_id, image_path in await db.execute(
+                select(ListingPhoto.listing_id, ListingPhoto.id, ListingPhoto.image_path)
+                .where(ListingPhoto.id.in_(first_photo_ids))
+            )
+        }
+
+    liked_ids = {}
+    if rows and "liked_user_ids" in fields:
+        likes = await db.execute(
+            select(Like.listing_id, Like.user_id)
+            .where(Like.listing_id.in_(rows))
+            .order_by(Like.id)
+        )
+        for listing_id, user_id in likes:
+            liked_ids.setdefault(listing_id, []).append(user_id)
+
+    return rows, first_photos, liked_ids
+
+
+async def get_listings_by_ids(db: AsyncSession, listing_ids: list[int]):
+    # Объявления в порядке listing_ids, удаленные пропускаются
+    listings = {listing.id: listing for listing in await db.scalars(select(Listing).where(Listing.id.in_(listing_ids)))}
+    return [listings[listing_id] for listing_id in listing_ids if listing_id in listings]
+
+
+# Признаки для похожих объявлений (similar.py), порядок столбцов важен
+LISTING_FEATURE_COLUMNS = (
+    Listing.id, Listing.price, Listing.rooms, Listing.total_area, Listing.kitchen_area, Listing.floor,
+    Listing.total_floors, Listing.allowed_children, Listing.allowed_pets, Listing.allowed_smoking,
+    Listing.type, Listing.address_city,
+)
+
+
+async def stream_listing_features(db: AsyncSession, batch_size: int):
+    result = await db.stream(
+        select(*LISTING_FEATURE_COLUMNS).order_by(Listing.id).execution_options(yield_per=batch_size)
+    )
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_listing_features(db: AsyncSession, listing_ids: list[int]):
+    return (await db.execute(select(*LISTING_FEATURE_COLUMNS).where(Listing.id.in_(listing_ids)))).all()
+
+
+async def bulk_create_listings(db: AsyncSession, listings: list[ListingBase]):
+    # Пачка объявлений и их фото без ORM-объектов и без промежуточных коммитов.
+    # Миниатюры здесь не строятся — их догоняет backfill_thumbnails.py
+    if not listings:
+        return []
+    rows = [listing_values(listing_data) for listing_data in listings]
+
+    if db.get_bind().dialect.name == "postgresql":
+        listing_ids = await copy_listings(db, rows)
+    else:
+        listing_ids = list(await db.scalars(
+            insert(Listing).returning(Listing.id, sort_by_parameter_order=True),
+            rows,
+        ))
+
+    photo_rows = [
+        {"listing_id": listing_id, "image_path": path, "image_base": rendition_base(path)}
+        for listing_id, listing_data in zip(listing_ids, listings)
+        for path in listing_data.image_paths or []
+    ]
+    if photo_rows:
+        if db.get_bind().dialect.name == "postgresql":
+            await copy_records(db, ListingPhoto.__tablename__, photo_rows)
+        else:
+            await db.execute(insert(ListingPhoto), photo_rows)
+
+    await add_feed_events(db, [listing_created_event(listing_id, row) for listing_id, row in zip(listing_ids, rows)])
+    await change_listing_rollups(db, rows, 1)
+    await bump_cache_versions(db, ["listings"])
+    return listing_ids
+
+
+async def copy_listings(db: AsyncSession, rows: list[dict]):
+    # COPY не умеет RETURNING, поэтому id берутся из последовательности заранее
+    listing_ids = list(await db.scalars(
+        select(func.nextval("listings_id_seq")).select_from(func.generate_series(1, len(rows)))
+    ))
+    for listing_id, row in zip(listing_ids, rows):
+        row["id"] = listing_id
+    await copy_records(db, Listing.__tablename__, rows)
+    return listing_ids
+
+
+async def copy_records(db: AsyncSession, table_name: str, rows: list[dict]):
+    # COPY ... FROM STDIN через asyncpg в рамках текущей транзакции сессии
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    columns = list(rows[0])
+    await raw_connection.driver_connection.copy_records_to_table(
+        table_name,
+        records=[tuple(row[column] for column in columns) for row in rows],
+        columns=columns,
+    )
+
+
+def dialect_insert(db: AsyncSession):
+    # INSERT ... ON CONFLICT есть только в диалектных insert()
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert
+    return sqlite_insert
+
+
+async def add_likes(db: AsyncSession, user_id: int, listing_ids: list[int]):
+    # Один INSERT ... SELECT ... ON CONFLICT DO NOTHING: несуществующие объявления и
+    # повторные лайки отсеиваются в базе, RETURNING отдает только реально добавленные
+    if not listing_ids:
+        return []
+    on_conflict_insert = dialect_insert(db)
+    inserted = list(await db.scalars(
+        on_conflict_insert(Like)
+        .from_select(
+            ["listing_id", "user_id"],
+            select(Listing.id, literal(user_id)).where(Listing.id.in_(listing_ids)),
+        )
+        .on_conflict_do_nothing(index_elements=["listing_id", "user_id"])
+        .returning(Like.listing_id)
+    ))
+    await change_like_counts(db, inserted, 1)
+    if inserted:
+        await bump_cache_versions(db, [f"likes:{user_id}"])
+    return inserted
+
+
+async def remove_likes(db: AsyncSession, user_id: int, listing_ids: list[int]):
+    if not listing_ids:
+        return []
+    deleted = list(await db.scalars(
+        delete(Like)
+        .where(Like.user_id == user_id, Like.listing_id.in_(listing_ids))
+        .returning(Like.listing_id)
+    ))
+    await change_like_counts(db, deleted, -1)
+    if deleted:
+        await bump_cache_versions(db, [f"likes:{user_id}"])
+    return deleted
+
+
+async def change_like_counts(db: AsyncSession, listing_ids: list[int], delta: int):
+    if listing_ids:
+        rows = await db.execute(
+            update(Listing)
+            .where(Listing.id.in_(listing_ids))
+            .values(like_count=Listing.like_count + delta, version=Listing.version + 1)
+            .returning(Listing.id, Listing.like_count, Listing.address_city, Listing.user_id)
+        )
+        await add_feed_events(db, [
+            {"kind": "likes_changed", "listing_id": listing_id, "city": city, "user_id": owner_id,
+             "payload": {"id": listing_id, "like_count": like_count}}
+            for listing_id, like_count, city, owner_id in rows
+        ])
+
+
+async def get_cache_versions(db: AsyncSession, keys: list[str]):
+    rows = await db.execute(select(CacheVersion.key, CacheVersion.version).where(CacheVersion.key.in_(keys)))
+    versions = dict(rows.all())
+    return {key: versions.get(key, 0) for key in keys}
+
+
+async def bump_cache_versions(db: AsyncSession, keys: list[str]):
+    # Версии растут в той же транзакции, что и сама запись
+    on_conflict_insert = dialect_insert(db)
+    statement = on_conflict_insert(CacheVersion).values([{"key": key, "version": 1} for key in keys])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"version": CacheVersion.version + 1},
+    ))
+
+
+async def get_listing_versions(db: AsyncSession, listing_ids: list[int]):
+    rows = await db.execute(select(Listing.id, Listing.version).where(Listing.id.in_(listing_ids)))
+    return {str(listing_id): version for listing_id, version in rows}
+
+
+async def bump_listing_versions(db: AsyncSession, listing_ids: list[int]):
+    await db.execute(update(Listing).where(Listing.id.in_(listing_ids)).values(version=Listing.version + 1))
+
+
+async def get_referenced_photo_bases(db: AsyncSession, bases: list[str]):
+    # Какие из файлов (по общей части имени, см. rendition_base) еще используются
+    # фото объявлений или аватарами — в обработанном виде или еще в виде исходника
+    if not bases:
+        return set()
+    referenced = set()
+    for model in (ListingPhoto, User):
+        referenced.update(await db.scalars(select(model.image_base.distinct()).where(model.image_base.in_(bases))))
+    return referenced
+
+
+async def remove_orphan_photos(db: AsyncSession, image_paths: list[str]):
+    # Удаляет файлы (исходник вместе с копиями), на которые больше никто не ссылается.
+    # Пути в объявлениях задает клиент: файлы вне хранилища не трогаются
+    bases = {rendition_base(path) for path in image_paths if photo_store.contains(path)}
+    referenced = await get_referenced_photo_bases(db, list(bases))
+    removed = []
+    for base in sorted(bases - referenced):
+        if await run_file_io(photo_store.remove, base):
+            removed.append(base)
+    return removed
+
+
+# Объекты, которым принадлежат задачи обработки фото
+IMAGE_JOB_TARGETS = {"listing_photo": ListingPhoto, "user_photo": User}
+
+
+async def enqueue_image_job(db: AsyncSession, kind: str, obj):
+    # Задача пишется в той же транзакции, что и фото: после commit она переживет перезапуск
+    await db.flush()
+    job = ImageJob(kind=kind, object_id=obj.id, source_path=obj.image_path)
+    db.add(job)
+    await db.flush()
+    return job
+
+
+async def claim_image_jobs(db: AsyncSession, limit: int, lease_seconds: float, max_attempts: int):
+    # Забирает до limit готовых задач, включая зависшие в running с истекшей арендой.
+    # В PostgreSQL параллельные воркеры пропускают чужие строки (SKIP LOCKED),
+    # SQLite выполняет UPDATE целиком под блокировкой записи
+    now = datetime.now(UTC)
+    # Брошенная задача, исчерпавшая попытки (например, каждый раз роняет процесс), проваливается
+    await db.execute(
+        update(ImageJob)
+        .where(ImageJob.status == "running", ImageJob.run_after <= now, ImageJob.attempts >= max_attempts)
+        .values(status="failed", error="Lease expired after the last attempt", updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    candidates = (
+        select(ImageJob.id)
+        .where(ImageJob.status.in_(("pending", "running")), ImageJob.run_after <= now,
+               ImageJob.attempts < max_attempts)
+        .order_by(ImageJob.run_after, ImageJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = await db.execute(
+        update(ImageJob)
+        .where(ImageJob.id.in_(candidates.scalar_subquery()))
+        .values(status="running", attempts=ImageJob.attempts + 1,
+                run_after=now + timedelta(seconds=lease_seconds), updated_at=now)
+        .returning(ImageJob.id, ImageJob.kind, ImageJob.object_id, ImageJob.source_path, ImageJob.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    return rows.all()
+
+
+async def complete_image_job(db: AsyncSession, job, renditions: dict):
+    # Копии записываются в объект, только если он еще существует и ссылается на тот же исходник.
+    # Возвращает False, если фото успели удалить или заменить — тогда файлы никому не нужны
+    obj = await db.get(IMAGE_JOB_TARGETS[job.kind], job.object_id)
+    current = obj is not None and obj.image_path is not None \
+        and rendition_base(obj.image_path) == rendition_base(job.source_path)
+    if current:
+        set_renditions(obj, renditions)
+        if job.kind == "listing_photo":
+            await bump_listing_versions(db, [obj.listing_id])
+            await add_photo_added_event(db, obj)
+    await db.execute(
+        update(ImageJob)
+        .where(ImageJob.id == job.id)
+        .values(status="done", error=None, updated_at=datetime.now(UTC))
+    )
+    return current
+
+
+async def fail_image_job(db: AsyncSession, job_id: int, error: str, retry_in: float | None):
+    # retry_in — через сколько секунд повторить; None — задача провалена окончательно
+    now = datetime.now(UTC)
+    await db.execute(
+        update(ImageJob)
+        .where(ImageJob.id == job_id)
+        .values(
+            status="failed" if retry_in is None else "pending",
+            error=error,
+            run_after=now if retry_in is None else now + timedelta(seconds=retry_in),
+            updated_at=now,
+        )
+    )
+
+
+async def release_image_job(db: AsyncSession, job_id: int, retry_in: float):
+    # Возвращает задачу в очередь, не засчитывая попытку: сбой был не в ней самой
+    now = datetime.now(UTC)
+    await db.execute(
+        update(ImageJob)
+        .where(ImageJob.id == job_id)
+        .values(status="pending", attempts=ImageJob.attempts - 1,
+                run_after=now + timedelta(seconds=retry_in), updated_at=now)
+    )
+
+
+# События ленты для push-канала (/feed/events): пишутся в той же транзакции, что и изменение
+LISTING_EVENT_FIELDS = ("title", "price", "rooms", "type", "address_city", "user_id", "created_at")
+
+
+def listing_created_event(listing_id: int, values: dict):
+    return {
+        "kind": "listing_created", "listing_id": listing_id,
+        "city": values.get("address_city"), "user_id": values.get("user_id"),
+        "payload": {"id": listing_id, **{field: values.get(field) for field in LISTING_EVENT_FIELDS}},
+    }
+
+
+def listing_deleted_event(listing: Listing):
+    return {
+        "kind": "listing_deleted", "listing_id": listing.id,
+        "city": listing.address_city, "user_id": listing.user_id,
+        "payload": {"id": listing.id},
+    }
+
+
+async def add_photo_added_event(db: AsyncSession, photo: ListingPhoto):
+    listing = await db.get(Listing, photo.listing_id)
+    if listing is not None:
+        await add_feed_events(db, [{
+            "kind": "photo_added", "listing_id": listing.id,
+            "city": listing.address_city, "user_id": listing.user_id,
+            "payload": {"id": listing.id, "photo_id": photo.id, "image_url": listing_photo_url(photo.id)},
+        }])
+
+
+async def add_feed_events(db: AsyncSession, events: list[dict]):
+    if events:
+        db.info["feed_events"] = True
+        now = datetime.now(UTC)
+        await db.execute(insert(FeedEvent), [
+            {**event, "payload": orjson.dumps(event["payload"]).decode(), "created_at": now}
+            for event in events
+        ])
+
+
+async def get_feed_events_after(db: AsyncSession, last_id: int, limit: int):
+    return list(await db.scalars(
+        select(FeedEvent).where(FeedEvent.id > last_id).order_by(FeedEvent.id).limit(limit)
+    ))
+
+
+async def get_feed_events_since(db: AsyncSession, since: datetime, kinds: tuple[str, ...] | None = None):
+    query = select(FeedEvent).where(FeedEvent.created_at >= since)
+    if kinds is not None:
+        query = query.where(FeedEvent.kind.in_(kinds))
+    return list(await db.scalars(query.order_by(FeedEvent.id)))
+
+
+async def get_first_feed_event_id(db: AsyncSession):
+    return await db.scalar(select(func.min(FeedEvent.id)))
+
+
+async def prune_feed_events(db: AsyncSession, before: datetime):
+    await db.execute(delete(FeedEvent).where(FeedEvent.created_at < before))
+
+
+# Свертки для аналитики (analytics.py): меняются в той же транзакции, что и объявления
+ROLLUP_KEY_COLUMNS = [getattr(ListingRollup, column) for column in ROLLUP_KEY]
+EMPTY_ROLLUP = {**dict.fromkeys(ROLLUP_COLUMNS, 0), **dict.fromkeys(SKETCH_COLUMNS)}
+
+
+def listing_rollup_values(listing: Listing):
+    return {field: getattr(listing, field) for field in ROLLUP_FIELDS}
+
+
+def apply_rollup_delta(rollup: ListingRollup, delta: dict):
+    for column in ROLLUP_COLUMNS:
+        setattr(rollup, column, getattr(rollup, column) + delta[column])
+    for metric, column in zip(SKETCH_METRICS, SKETCH_COLUMNS):
+        if delta[metric]:
+            sketch = Sketch.merge([Sketch.decode(getattr(rollup, column)), Sketch.from_buckets(delta[metric])])
+            setattr(rollup, column, sketch.encode())
+
+
+async def change_listing_rollups(db: AsyncSession, rows: list[dict], sign: int):
+    # sign=1 — объявления созданы, -1 — удалены. Строки свертки блокируются до конца транзакции
+    # (скетчи пересчитываются здесь же) и всегда в порядке ключа — без взаимных блокировок
+    deltas = aggregate_listings(rows, sign)
+    if not deltas:
+        return
+    keys = sorted(deltas)
+    await db.execute(
+        dialect_insert(db)(ListingRollup).on_conflict_do_nothing(index_elements=list(ROLLUP_KEY)),
+        [{**dict(zip(ROLLUP_KEY, key)), **EMPTY_ROLLUP} for key in keys],
+    )
+    rollups = await db.scalars(
+        select(ListingRollup)
+        .where(tuple_(*ROLLUP_KEY_COLUMNS).in_(keys))
+        .order_by(*ROLLUP_KEY_COLUMNS)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    for rollup in rollups:
+        apply_rollup_delta(rollup, deltas[tuple(getattr(rollup, column) for column in ROLLUP_KEY)])
+        if rollup.count <= 0:
+            # Опустевшие группы не копятся
+            await db.delete(rollup)
+    await db.flush()
+
+
+async def get_listing_rollups(db: AsyncSession, filters: dict, since=None, until=None):
+    # Строки сверток под фильтры: их число зависит от числа групп и месяцев, а не объявлений
+    conditions = [getattr(ListingRollup, column) == value for column, value in filters.items()]
+    if since is not None:
+        conditions.append(ListingRollup.month >= since)
+    if until is not None:
+        conditions.append(ListingRollup.month <= until)
+    return (await db.execute(
+        select(*(getattr(ListingRollup, column) for column in (*ROLLUP_KEY, *ROLLUP_COLUMNS, *SKETCH_COLUMNS)))
+        .where(*conditions)
+    )).all()
+
+
+async def begin_rollup_check(db: AsyncSession, repair: bool):
+    # Сверка читает объявления и свертки из одного снимка. При пересборке создание и удаление
+    # объявлений ждут ее окончания, иначе их приращения затрутся
+    if db.get_bind().dialect.name == "postgresql":
+        if repair:
+            await db.execute(text("LOCK TABLE listing_rollups IN EXCLUSIVE MODE"))
+        else:
+            await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    elif repair:
+        # SQLite: пустой DELETE открывает пишущую транзакцию, остальные записи ждут
+        await db.execute(delete(ListingRollup).where(false()))
+
+
+async def stream_listing_rollup_values(db: AsyncSession, batch_size: int):
+    result = await db.stream(
+        select(*(getattr(Listing, field) for field in ROLLUP_FIELDS)).execution_options(yield_per=batch_size)
+    )
+    async for rows in result.mappings().partitions():
+        yield rows
+
+
+async def get_stored_rollups(db: AsyncSession):
+    width = len(ROLLUP_KEY)
+    return {
+        tuple(row[:width]): dict(zip((*ROLLUP_COLUMNS, *SKETCH_COLUMNS), row[width:]))
+        for row in await db.execute(select(
+            *(getattr(ListingRollup, column) for column in (*ROLLUP_KEY, *ROLLUP_COLUMNS, *SKETCH_COLUMNS))
+        ))
+    }
+
+
+async def replace_listing_rollups(db: AsyncSession, rollups: dict, batch_size: int):
+    # rollups — в форме get_stored_rollups
+    await db.execute(delete(ListingRollup))
+    rows = [{**dict(zip(ROLLUP_KEY, key)), **values} for key, values in sorted(rollups.items()) if values["count"]]
+    for start in range(0, len(rows), batch_size):
+        await db.execute(insert(ListingRollup), rows[start:start + batch_size])
@@ -1,9 +1,16 @@
-from sqlalchemy import create_engine
+import random
+import time
+
+from sqlalchemy import Delete, Insert, Update, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
 from dotenv import load_dotenv
 
+from metrics import instrument_engine
+
 load_dotenv()
 
 DB_USER = os.getenv("DB_USER")
@@ -12,8 +19,91 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT", 5432)
 DB_NAME = os.getenv("DB_NAME")
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Реплики только для чтения, через запятую. Пусто — все идет в основную базу
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Сколько соединений держит один воркер на каждую базу: DB_POOL_SIZE постоянных и до
+# DB_MAX_OVERFLOW временных. Остальные запросы ждут соединение не дольше DB_POOL_TIMEOUT секунд
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 0))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Соединения старше DB_POOL_RECYCLE секунд переоткрываются (-1 — никогда),
+# DB_POOL_PRE_PING проверяет соединение перед выдачей из пула
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Сколько секунд после записи клиент читает из основной базы, а не с реплик,
+# чтобы видеть свои изменения, пока реплики догоняют
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", 5))
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
-engine = create_engine(DATABASE_URL)
+
+def async_database_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+# Синхронный движок — для скриптов и создания таблиц
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Асинхронные движки — для запросов приложения
+async_engine = create_async_engine(async_database_url(DATABASE_URL), **POOL_OPTIONS)
+replica_engines = [create_async_engine(async_database_url(url), **POOL_OPTIONS) for url in DATABASE_REPLICA_URLS]
+
+
+class RoutingSession(Session):
+    # Сессия чтения получает реплику в info["replica"]: через нее идут SELECT,
+    # а flush и явные INSERT/UPDATE/DELETE все равно уходят в основную базу
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is None or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return async_engine.sync_engine
+        return replica
+
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def read_session(sticky_until: float | None = None):
+    # Сессия для эндпоинтов только на чтение: случайная реплика, если они есть
+    # и клиент недавно ничего не записывал
+    if not replica_engines or (sticky_until and sticky_until > time.time()):
+        return AsyncSessionLocal()
+    return AsyncSessionLocal(info={"replica": random.choice(replica_engines).sync_engine})
+
+# SQLite по умолчанию не проверяет внешние ключи
+if make_url(DATABASE_URL).get_backend_name() == "sqlite":
+    def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    for engine_ in (engine, async_engine, *replica_engines):
+        event.listen(getattr(engine_, "sync_engine", engine_), "connect", enable_sqlite_foreign_keys)
+
+# Время и число SQL-запросов на каждый HTTP-запрос — см. metrics.py
+for engine_ in (async_engine, *replica_engines):
+    instrument_engine(engine_.sync_engine)
+
 Base = declarative_base()
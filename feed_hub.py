@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import event
+
+from crud import get_feed_events_after, get_feed_events_since, get_first_feed_event_id, prune_feed_events
+from db import AsyncSessionLocal, RoutingSession
+
+logger = logging.getLogger("feed_hub")
+
+# Push-канал лент (SSE). Один опрос feed_events на воркер раз в FEED_POLL_SECONDS, сколько бы
+# ни было подключений; изменения из этого же процесса будят опрос сразу (notify)
+FEED_POLL_SECONDS = float(os.getenv("FEED_POLL_SECONDS", 1))
+# Транзакция с меньшим id может закоммититься позже соседней: последние FEED_SETTLE_SECONDS
+# перечитываются при каждом опросе, уже разосланные id пропускаются
+FEED_SETTLE_SECONDS = float(os.getenv("FEED_SETTLE_SECONDS", 5))
+# На подключение держится не больше FEED_SUBSCRIBER_QUEUE событий: медленный клиент
+# получает reset и перечитывает ленту, а не копит память воркера
+FEED_SUBSCRIBER_QUEUE = int(os.getenv("FEED_SUBSCRIBER_QUEUE", 64))
+FEED_MAX_SUBSCRIBERS = int(os.getenv("FEED_MAX_SUBSCRIBERS", 10000))
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", 15))
+# Сколько событий досылается по Last-Event-ID; больше — reset
+FEED_REPLAY_LIMIT = int(os.getenv("FEED_REPLAY_LIMIT", 1000))
+# Старые события удаляются раз в FEED_PRUNE_SECONDS фоновой задачей каждого процесса,
+# независимо от того, есть ли подключения
+FEED_EVENTS_RETENTION_SECONDS = int(os.getenv("FEED_EVENTS_RETENTION_SECONDS", 24 * 3600))
+FEED_PRUNE_SECONDS = float(os.getenv("FEED_PRUNE_SECONDS", 300))
+
+FEED_KINDS = ("listing_created", "listing_deleted", "likes_changed", "photo_added")
+
+RETRY_FRAME = b"retry: 3000\n\n"
+# Клиент пропустил события: нужно заново загрузить ленту и продолжать слушать
+RESET_FRAME = b"event: reset\ndata: {}\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+
+
+class FeedHubFull(Exception):
+    pass
+
+
+class FeedMessage:
+    # Кадр SSE собирается один раз и рассылается всем подходящим подключениям
+    __slots__ = ("id", "kind", "city", "user_id", "frame")
+
+    def __init__(self, feed_event):
+        self.id = feed_event.id
+        self.kind = feed_event.kind
+        self.city = feed_event.city
+        self.user_id = feed_event.user_id
+        self.frame = f"id: {feed_event.id}\nevent: {feed_event.kind}\ndata: {feed_event.payload}\n\n".encode()
+
+
+class Subscription:
+    __slots__ = ("city", "user_id", "kinds", "queue")
+
+    def __init__(self, city: str | None, user_id: int | None, kinds: set[str] | None):
+        self.city = city
+        self.user_id = user_id
+        self.kinds = kinds
+        self.queue = asyncio.Queue(FEED_SUBSCRIBER_QUEUE)
+
+    def matches(self, message: FeedMessage):
+        return (
+            (self.city is None or message.city == self.city)
+            and (self.user_id is None or message.user_id == self.user_id)
+            and (self.kinds is None or message.kind in self.kinds)
+        )
+
+    def push(self, message: FeedMessage):
+        if not self.matches(message):
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Очередь сбрасывается, вместо нее — одно указание перечитать ленту
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class FeedHub:
+    def __init__(self, poll_seconds: float, max_subscribers: int):
+        self.poll_seconds = poll_seconds
+        self.max_subscribers = max_subscribers
+        self.subscriptions = set()
+        self._seen = {}
+        self._task = None
+        self._prune_task = None
+        self._wakeup = asyncio.Event()
+
+    def check_capacity(self):
+        if len(self.subscriptions) >= self.max_subscribers:
+            raise FeedHubFull()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def start_pruning(self):
+        if self._prune_task is None:
+            self._prune_task = asyncio.create_task(self._prune())
+
+    async def stop_pruning(self):
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            try:
+                await self._prune_task
+            except asyncio.CancelledError:
+                pass
+            self._prune_task = None
+
+    async def _prune(self):
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await prune_feed_events(db, datetime.now(UTC) - timedelta(seconds=FEED_EVENTS_RETENTION_SECONDS))
+                    await db.commit()
+            except Exception:
+                logger.exception("feed events prune failed")
+            await asyncio.sleep(FEED_PRUNE_SECONDS)
+
+    async def stream(self, city: str | None, user_id: int | None, kinds: set[str] | None,
+                     last_event_id: int | None):
+        # Тело ответа SSE: досылка пропущенного по Last-Event-ID, затем живые события
+        subscription = Subscription(city, user_id, kinds)
+        self.subscriptions.add(subscription)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            yield RETRY_FRAME
+            replayed = set()
+            if last_event_id is not None:
+                async with AsyncSessionLocal() as db:
+                    first_id = await get_first_feed_event_id(db)
+                    events = await get_feed_events_after(db, last_event_id, FEED_REPLAY_LIMIT + 1)
+                if len(events) > FEED_REPLAY_LIMIT or (first_id is not None and first_id > last_event_id + 1):
+                    yield RESET_FRAME
+                else:
+                    for feed_event in events:
+                        replayed.add(feed_event.id)
+                        message = FeedMessage(feed_event)
+                        if subscription.matches(message):
+                            yield message.frame
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), FEED_HEARTBEAT_SECONDS)
+                except TimeoutError:
+                    yield HEARTBEAT_FRAME
+                    continue
+                if message is None:
+                    yield RESET_FRAME
+                elif message.id not in replayed:
+                    yield message.frame
+        finally:
+            self.subscriptions.discard(subscription)
+
+    async def _run(self):
+        # Работает, пока есть подписчики. Первый опрос может разослать события последних
+        # FEED_SETTLE_SECONDS секунд до подключения: они абсолютные (счетчик, id), повтор безвреден
+        since = datetime.now(UTC) - timedelta(seconds=FEED_SETTLE_SECONDS)
+        while self.subscriptions:
+            self._wakeup.clear()
+            poll_started = datetime.now(UTC)
+            try:
+                async with AsyncSessionLocal() as db:
+                    events = await get_feed_events_since(db, since)
+            except Exception:
+                logger.exception("feed events poll failed")
+            else:
+                since = poll_started - timedelta(seconds=FEED_SETTLE_SECONDS)
+                self._dispatch(events)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except TimeoutError:
+                pass
+        self._task = None
+
+    def _dispatch(self, events):
+        now = time.monotonic()
+        for feed_event in events:
+            if feed_event.id in self._seen:
+                continue
+            self._seen[feed_event.id] = now
+            message = FeedMessage(feed_event)
+            for subscription in self.subscriptions:
+                subscription.push(message)
+        cutoff = now - FEED_SETTLE_SECONDS * 2
+        self._seen = {event_id: seen for event_id, seen in self._seen.items() if seen >= cutoff}
+
+
+feed_hub = FeedHub(FEED_POLL_SECONDS, FEED_MAX_SUBSCRIBERS)
+
+
+# add_feed_events помечает сессию; после commit опрос этого процесса запускается сразу
+@event.listens_for(RoutingSession, "after_commit")
+def notify_after_commit(session):
+    if session.info.pop("feed_events", False):
+        feed_hub.notify()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def forget_after_rollback(session):
+    session.info.pop("feed_events", None)
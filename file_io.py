@@ -0,0 +1,22 @@
+import os
+
+import anyio
+from anyio import to_thread
+
+# Чтение/запись фото и обработка картинок уходят из event loop в потоки,
+# одновременно — не больше FILE_IO_CONCURRENCY задач на воркер
+FILE_IO_CONCURRENCY = int(os.getenv("FILE_IO_CONCURRENCY", 16))
+
+_limiter = None
+
+
+def _get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(FILE_IO_CONCURRENCY)
+    return _limiter
+
+
+async def run_file_io(func, *args):
+    return await to_thread.run_sync(func, *args, limiter=_get_limiter())
+
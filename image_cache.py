@@ -0,0 +1,182 @@
+import base64
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только внутри процесса
+    fcntl = None
+
+from metrics import record_encode, record_file_read
+
+
+def default_cache_dir():
+    # /dev/shm — tmpfs: записи лежат в общей памяти, и все воркеры uvicorn
+    # читают одни и те же страницы, а не держат по копии на процесс
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "realestate-image-cache")
+
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR") or default_cache_dir()
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Общие для всех процессов счетчики: hits, misses, evictions, bytes
+_STATS = struct.Struct("<QQQQ")
+HITS, MISSES, EVICTIONS, BYTES = range(4)
+
+# После вытеснения оставляем запас, чтобы не чистить кэш на каждом промахе
+_EVICT_TO = 0.9
+
+
+class ImageCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._thread_lock = threading.Lock()
+        self._stats_file = None
+        self._stats = None
+
+    def _open(self):
+        if self._stats is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        stats_path = os.path.join(self.directory, "stats")
+        stats_file = open(stats_path, "a+b")
+        if os.fstat(stats_file.fileno()).st_size < _STATS.size:
+            stats_file.truncate(_STATS.size)
+        self._stats = mmap.mmap(stats_file.fileno(), _STATS.size)
+        self._stats_file = stats_file
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            self._open()
+            if fcntl is not None:
+                fcntl.flock(self._stats_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._stats_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_stats(self):
+        return list(_STATS.unpack_from(self._stats))
+
+    def _increment(self, index: int, delta: int = 1):
+        # Вызывается под _locked
+        values = self._read_stats()
+        values[index] += delta
+        _STATS.pack_into(self._stats, 0, *values)
+        return values
+
+    def _entry_path(self, image_path: str, stat_result: os.stat_result):
+        key = f"{os.path.abspath(image_path)}\0{stat_result.st_mtime_ns}\0{stat_result.st_size}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".b64")
+
+    def get_base64(self, image_path: str | None):
+        # Ключ включает mtime и размер: замененный файл получает новую запись,
+        # а старая уходит по LRU
+        if not image_path:
+            return None
+        try:
+            stat_result = os.stat(image_path)
+        except OSError:
+            return None
+
+        if self._stats is None:
+            with self._thread_lock:
+                self._open()
+        entry_path = self._entry_path(image_path, stat_result)
+        try:
+            with open(entry_path, "rb") as entry:
+                encoded = entry.read()
+            record_file_read(len(encoded))
+            # mtime записи — время последнего обращения, по нему идет вытеснение
+            os.utime(entry_path)
+            with self._locked():
+                self._increment(HITS)
+            return encoded.decode("ascii")
+        except FileNotFoundError:
+            pass
+
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+        record_file_read(len(data))
+        started = time.perf_counter()
+        encoded = base64.b64encode(data)
+        record_encode(time.perf_counter() - started)
+        with self._locked():
+            self._increment(MISSES)
+        if len(encoded) <= self.max_bytes:
+            self._store(entry_path, encoded)
+        return encoded.decode("ascii")
+
+    def _store(self, entry_path: str, encoded: bytes):
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as entry:
+            entry.write(encoded)
+
+        with self._locked():
+            existed = os.path.exists(entry_path)
+            os.replace(tmp_path, entry_path)
+            if existed:
+                return
+            values = self._increment(BYTES, len(encoded))
+            if values[BYTES] > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.name.endswith(".b64"):
+                    try:
+                        stat_result = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat_result.st_mtime_ns, stat_result.st_size, item.path))
+        return entries
+
+    def _evict(self):
+        # Вызывается под _locked. Размер пересчитывается по диску,
+        # так что счетчик не расходится с реальностью после гонок и рестартов
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * _EVICT_TO
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        values = self._read_stats()
+        values[BYTES] = total
+        values[EVICTIONS] += evicted
+        _STATS.pack_into(self._stats, 0, *values)
+
+    def stats(self):
+        with self._locked():
+            hits, misses, evictions, used = self._read_stats()
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
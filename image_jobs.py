@@ -0,0 +1,153 @@
+# Фоновая обработка фото: очередь в таблице image_jobs, картинки — в пуле процессов.
+# По умолчанию воркер запускается в каждом процессе приложения; можно выключить
+# (IMAGE_WORKER_ENABLED=false) и запускать отдельно: python image_jobs.py
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from crud import claim_image_jobs, complete_image_job, fail_image_job, release_image_job, remove_orphan_photos
+from db import AsyncSessionLocal
+from images import make_renditions
+from photo_store import photo_store
+
+logger = logging.getLogger("image_jobs")
+
+IMAGE_WORKER_ENABLED = os.getenv("IMAGE_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Процессов обработки на каждый процесс приложения: при N воркерах uvicorn их будет N * IMAGE_JOB_WORKERS,
+# и все они делят ядра с обработкой запросов. Для большой очереди лучше выключить воркер в приложении
+# и запустить python image_jobs.py с IMAGE_JOB_WORKERS по числу ядер отдельной машины
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", 1))
+# Сколько задач берется из очереди за раз и как часто очередь проверяется без уведомлений
+IMAGE_JOB_BATCH_SIZE = int(os.getenv("IMAGE_JOB_BATCH_SIZE", IMAGE_JOB_WORKERS * 2))
+IMAGE_JOB_POLL_SECONDS = float(os.getenv("IMAGE_JOB_POLL_SECONDS", 2))
+# Задача в running дольше IMAGE_JOB_LEASE_SECONDS считается брошенной и берется заново
+IMAGE_JOB_LEASE_SECONDS = float(os.getenv("IMAGE_JOB_LEASE_SECONDS", 300))
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", 5))
+IMAGE_JOB_RETRY_SECONDS = float(os.getenv("IMAGE_JOB_RETRY_SECONDS", 5))
+
+
+class ImageJobWorker:
+    def __init__(self, workers: int, batch_size: int, poll_seconds: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._executor = None
+        self._task = None
+        self._wakeup = None
+
+    def _get_executor(self):
+        # spawn, как и у хэширования паролей: воркер приложения уже держит потоки и соединения
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _discard_executor(self, executor):
+        # Один упавший дочерний процесс ломает весь пул: следующие задачи получат новый
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def notify(self):
+        # Новая задача в этом процессе — не ждать следующего опроса
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.run_batch()
+            except Exception:
+                logger.exception("image job batch failed")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except TimeoutError:
+                pass
+
+    async def run_batch(self):
+        async with AsyncSessionLocal() as db:
+            jobs = await claim_image_jobs(db, self.batch_size, IMAGE_JOB_LEASE_SECONDS, IMAGE_JOB_MAX_ATTEMPTS)
+            await db.commit()
+        await asyncio.gather(*(self.process(job) for job in jobs))
+        return len(jobs)
+
+    async def process(self, job):
+        if not photo_store.contains(job.source_path):
+            # Задачи ставятся только для файлов хранилища; старые задачи на чужие пути не выполняются
+            async with AsyncSessionLocal() as db:
+                await fail_image_job(db, job.id, "Source is outside the photo store", None)
+                await db.commit()
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            renditions = await loop.run_in_executor(executor, make_renditions, job.source_path)
+        except BrokenProcessPool:
+            # Пул ломается для всех задач сразу, виновную не отличить — повтор на новом пуле
+            # без траты попытки
+            self._discard_executor(executor)
+            async with AsyncSessionLocal() as db:
+                await release_image_job(db, job.id, IMAGE_JOB_RETRY_SECONDS)
+                await db.commit()
+            return
+        except Exception as error:
+            # Сбой обработки — повтор с растущей задержкой
+            retry_in = IMAGE_JOB_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            async with AsyncSessionLocal() as db:
+                await fail_image_job(db, job.id, repr(error),
+                                     retry_in if job.attempts < IMAGE_JOB_MAX_ATTEMPTS else None)
+                await db.commit()
+            return
+
+        async with AsyncSessionLocal() as db:
+            if not renditions:
+                # Файла нет или это не картинка: повтор не поможет
+                await fail_image_job(db, job.id, "Source file is missing or is not an image", None)
+                await db.commit()
+                return
+            current = await complete_image_job(db, job, renditions)
+            await db.commit()
+            if not current:
+                await remove_orphan_photos(db, [job.source_path])
+
+
+image_worker = ImageJobWorker(IMAGE_JOB_WORKERS, IMAGE_JOB_BATCH_SIZE, IMAGE_JOB_POLL_SECONDS)
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    image_worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await image_worker.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import os
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Обработанные копии загруженного фото: {имя: (суффикс файла, вписать в прямоугольник, формат, качество)}.
+# "full" — оригинал после нормализации: повернут по EXIF, без метаданных, не больше IMAGE_MAX_SIZE.
+# WebP-копии отдаются клиентам, которые присылают Accept: image/webp
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE", 2560))
+RENDITIONS = {
+    "full": ("_full.jpg", (IMAGE_MAX_SIZE, IMAGE_MAX_SIZE), "JPEG", 90),
+    "thumb": ("_thumb.jpg", (320, 320), "JPEG", 80),
+    "medium": ("_medium.jpg", (1024, 1024), "JPEG", 80),
+    "thumb_webp": ("_thumb.webp", (320, 320), "WEBP", 80),
+    "medium_webp": ("_medium.webp", (1024, 1024), "WEBP", 80),
+}
+RENDITION_SIZES = {name: size for name, (_, size, _, _) in RENDITIONS.items()}
+# Куда записывается каждая копия у ListingPhoto и User
+RENDITION_FIELDS = {
+    "full": "image_path",
+    "thumb": "thumbnail_path",
+    "medium": "medium_path",
+    "thumb_webp": "thumbnail_webp_path",
+    "medium_webp": "medium_webp_path",
+}
+
+
+def rendition_base(image_path: str):
+    # Общая часть имени у исходника и всех его копий: путь без расширения и суффикса копии
+    for suffix, _, _, _ in RENDITIONS.values():
+        if image_path.endswith(suffix):
+            return image_path[:-len(suffix)]
+    return os.path.splitext(image_path)[0]
+
+
+def rendition_path(image_path: str, name: str):
+    return rendition_base(image_path) + RENDITIONS[name][0]
+
+
+def make_renditions(image_path: str | None):
+    # Создает копии рядом с исходником, возвращает {имя: путь}.
+    # Если файла нет или это не картинка — пустой словарь, исходник остается как есть
+    if not image_path or not os.path.isfile(image_path):
+        return {}
+
+    try:
+        with Image.open(image_path) as image:
+            # exif_transpose поворачивает пиксели, а метаданные в копии не попадают:
+            # save без exif= их не пишет
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            renditions = {}
+            for name, (_, size, image_format, quality) in RENDITIONS.items():
+                rendition = image.copy()
+                rendition.thumbnail(size)
+                path = rendition_path(image_path, name)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                rendition.save(temp_path, image_format, quality=quality, optimize=True)
+                os.replace(temp_path, path)
+                renditions[name] = path
+            return renditions
+    except (UnidentifiedImageError, OSError):
+        return {}
+
+
+def existing_renditions(image_path: str):
+    # Копии, уже созданные для того же содержимого; None, если хотя бы одной нет
+    renditions = {name: rendition_path(image_path, name) for name in RENDITIONS}
+    if all(os.path.isfile(path) for path in renditions.values()):
+        return renditions
+    return None
+
+
+def set_renditions(obj, renditions: dict):
+    # obj — ListingPhoto или User. Без копий остается исходник, уменьшенных копий нет
+    for name, field in RENDITION_FIELDS.items():
+        if name == "full":
+            obj.image_path = renditions.get(name, obj.image_path)
+        else:
+            setattr(obj, field, renditions.get(name))
+
+
+def apply_renditions(obj, image_path: str | None):
+    set_renditions(obj, make_renditions(image_path))
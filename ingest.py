@@ -0,0 +1,132 @@
+import codecs
+import csv
+import json
+import os
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import bulk_create_listings
+from schemas import ListingBase
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 1000))
+# Сколько ошибок по строкам возвращать клиенту: остальные только считаются
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", 1000))
+
+CSV_LIST_SEPARATOR = "|"
+
+
+async def iter_lines(chunks):
+    # Поток байтов -> строки текста, без чтения всего тела в память
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_ndjson(chunks):
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, error
+
+
+async def iter_csv(chunks):
+    # Поле в кавычках может содержать перевод строки: запись копится, пока кавычек нечетно
+    header = None
+    record, record_line = "", 0
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        record = f"{record}\n{line}" if record else line
+        record_line = record_line or line_number
+        if record.count('"') % 2:
+            continue
+
+        values = next(csv.reader([record.rstrip("\r")]), [])
+        record, start_line, record_line = "", record_line, 0
+        if header is None:
+            header = values
+            continue
+        if not any(values):
+            continue
+        yield start_line, csv_row(header, values)
+
+
+def csv_row(header: list[str], values: list[str]):
+    # Пустые ячейки не передаются: срабатывают значения по умолчанию из ListingBase
+    row = {name: value for name, value in zip(header, values) if value != ""}
+    if "image_paths" in row:
+        row["image_paths"] = row["image_paths"].split(CSV_LIST_SEPARATOR)
+    return row
+
+
+class BulkIngestResult:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line: int, errors):
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"line": line, "errors": errors})
+
+    def as_dict(self):
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors}
+
+
+async def ingest_listings(db: AsyncSession, rows):
+    result = BulkIngestResult()
+    batch = []
+
+    async for line, row in rows:
+        if isinstance(row, Exception):
+            result.add_error(line, [{"msg": f"Invalid JSON: {row}"}])
+            continue
+        try:
+            batch.append((line, ListingBase.model_validate(row)))
+        except ValidationError as error:
+            result.add_error(line, json.loads(error.json(include_url=False)))
+            continue
+
+        if len(batch) >= BULK_BATCH_SIZE:
+            await insert_batch(db, batch, result)
+            batch = []
+
+    if batch:
+        await insert_batch(db, batch, result)
+    return result
+
+
+async def insert_batch(db: AsyncSession, batch: list[tuple[int, ListingBase]], result: BulkIngestResult):
+    # Пачка пишется в своей точке сохранения и сразу коммитится. Если база отвергла пачку
+    # (например, несуществующий user_id), строки повторяются по одной, чтобы найти виноватые
+    try:
+        async with db.begin_nested():
+            await bulk_create_listings(db, [listing for _, listing in batch])
+        await db.commit()
+        result.inserted += len(batch)
+        return
+    except Exception:
+        await db.rollback()
+
+    for line, listing in batch:
+        try:
+            async with db.begin_nested():
+                await bulk_create_listings(db, [listing])
+            result.inserted += 1
+        except Exception as error:
+            result.add_error(line, [{"msg": str(getattr(error, "orig", None) or error)}])
+    await db.commit()
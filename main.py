@@ -1,23 +1,48 @@
 import base64
-import os
-from uuid import uuid4
+import io
+import time
+from datetime import date
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import FileResponse
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-import bcrypt
-
-from db import SessionLocal, engine, Base
-from models import User, Listing, ListingPhoto, Like
-from schemas import UserCreate, UserOut, ListingBase, ListingSchema, UserLogin, UserLoginResponse, ListingPreview, \
-    ListingRead
-from crud import get_listings, create_listing
-
-# Создаем таблицы
-Base.metadata.create_all(bind=engine)
+from typing import Literal
 
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, UploadFile, File, Query, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette.datastructures import UploadFile as StarletteUploadFile
+
+from auth import hash_password, verify_password, password_hasher, PasswordHasherBusy
+from db import AsyncSessionLocal, read_session, replica_engines, DB_REPLICA_STICKY_SECONDS
+from models import User, Listing, ListingPhoto, ImageJob
+from schemas import UserCreate, UserOut, ListingBase, ListingSchema, UserLogin, UserLoginResponse, \
+    ListingRead, ListingBatch, ListingPage, ListingSearch, ListingSearchPage, PreviewOptions, LikeBatch, \
+    MarketStats
+from crud import get_listings, create_listing, add_likes, remove_likes, bump_cache_versions, bump_listing_versions, \
+    remove_orphan_photos, enqueue_image_job, add_feed_events, add_photo_added_event, listing_deleted_event, \
+    get_listings_by_ids, change_listing_rollups, listing_rollup_values, get_listing_rollups
+from previews import build_listing_previews, build_listing_details, load_preview_rows, iter_preview_chunks
+from streaming import listing_page_stream, PREVIEW_STREAM_CHUNK, STREAM_MEDIA_TYPES
+from search import build_search_query, get_facets
+from ingest import ingest_listings, iter_ndjson, iter_csv
+from image_cache import image_cache
+from metrics import MetricsMiddleware, render_metrics
+from compression import CompressionMiddleware, response_compressor
+from response_cache import response_cache, listing_versions
+from file_io import run_file_io
+from feed_hub import feed_hub, FeedHubFull, FEED_KINDS
+from image_jobs import image_worker, IMAGE_WORKER_ENABLED
+from photo_store import photo_store, normalize_extension, PhotoTooLarge
+from similar import similar_listings
+from analytics import ROLLUP_KEY, ANALYTICS_SKETCH_ACCURACY, summarize_rollups
+from photos import photo_response, photo_path, accepts_webp, listing_photo_url, user_photo_url, if_none_match_tags
+
+# Схема создается и обновляется миграциями (alembic upgrade head), при старте к базе не обращаемся
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -27,191 +52,359 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Зависимость - сессия базы
-def get_db():
-    db = SessionLocal()
+# Сжатие gzip/br/zstd по Accept-Encoding. Добавляется раньше MetricsMiddleware, то есть
+# оказывается внутри нее: время сжатия попадает в Server-Timing и гистограммы
+app.add_middleware(CompressionMiddleware)
+
+# Server-Timing, гистограммы для /metrics, лог медленных запросов и профайлер
+app.add_middleware(MetricsMiddleware)
+
+# Очередь хэширования паролей переполнена — быстрый отказ вместо ожидания
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many authentication requests"},
+                        headers={"Retry-After": "1"})
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+# Обработка фото из очереди image_jobs в фоне этого процесса
+@app.on_event("startup")
+def start_image_worker():
+    if IMAGE_WORKER_ENABLED:
+        image_worker.start()
+
+@app.on_event("shutdown")
+async def stop_image_worker():
+    await image_worker.stop()
+
+# Очистка feed_events по расписанию, а не только пока подключены клиенты /feed/events
+@app.on_event("startup")
+def start_feed_pruning():
+    feed_hub.start_pruning()
+
+@app.on_event("shutdown")
+async def stop_feed_pruning():
+    await feed_hub.stop_pruning()
+
+PRIMARY_STICKY_COOKIE = "db_primary_until"
+
+# Зависимость - сессия основной базы. При наличии реплик клиент после записи
+# какое-то время читает из основной базы (read-your-writes)
+async def get_db(request: Request, response: Response):
+    if replica_engines and request.method not in ("GET", "HEAD"):
+        response.set_cookie(PRIMARY_STICKY_COOKIE, str(time.time() + DB_REPLICA_STICKY_SECONDS),
+                            max_age=int(DB_REPLICA_STICKY_SECONDS) + 1, httponly=True)
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Зависимость - сессия для эндпоинтов только на чтение: SELECT идут на реплики
+async def get_read_db(request: Request):
     try:
+        sticky_until = float(request.cookies.get(PRIMARY_STICKY_COOKIE, 0))
+    except ValueError:
+        sticky_until = None
+    async with read_session(sticky_until) as db:
         yield db
-    finally:
-        db.close()
+
+# Загрузка читает временный файл multipart кусками и пишет в хранилище, считая sha256 по ходу.
+# Обработка (поворот, очистка EXIF, копии) ставится в очередь, если это содержимое еще не встречалось.
+# Возвращает задачу или None, если готовые копии нашлись сразу
+async def store_photo(db: AsyncSession, kind: str, obj, source, filename: str | None):
+    try:
+        ready = await run_file_io(photo_store.attach, obj, source, normalize_extension(filename))
+    except PhotoTooLarge:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    db.add(obj)
+    return None if ready else await enqueue_image_job(db, kind, obj)
+
+def image_job_status(job):
+    if job is None:
+        return {"job_id": None, "status": "done"}
+    image_worker.notify()
+    return {"job_id": job.id, "status": job.status}
+
+async def cleanup_photo_files(image_paths: list[str]):
+    async with AsyncSessionLocal() as db:
+        await remove_orphan_photos(db, image_paths)
+
+PhotoSize = Literal["thumb", "medium", "original"]
 
 class ListingPhotoBase64(BaseModel):
     base64_data: str  # строка base64 (без data:image/jpeg;base64, если что — обрежем)
     extension: str = ".jpg"  # или ".png" и т.п.
 
-@app.get("/listings/", response_model=list[ListingPreview])
-def read_listings(skip: int = 1, limit: int = 100, db: Session = Depends(get_db)):
-    listings = get_listings(db, skip=skip, limit=limit)
-    result = []
+# Зависимость - что включать в превью ленты
+def get_preview_options(inline_images: bool = True, likers: bool = True):
+    return PreviewOptions(inline_images=inline_images, likers=likers)
 
-    for listing in listings:
-        image_data = None
-        if listing.photos:
-            first_photo = listing.photos[0]
-            if first_photo.image_path and os.path.isfile(first_photo.image_path):
-                with open(first_photo.image_path, "rb") as image_file:
-                    image_data = base64.b64encode(image_file.read()).decode("utf-8")
-        db_user = db.query(User).filter(User.id == listing.user_id).first()
-        liked_ids = [user.id for user in listing.liked_by_users]
-        result.append(ListingPreview(
-            id=listing.id,
-            title=listing.title,
-            price=listing.price,
-            owner_name=db_user.name if db_user else "",
-            image_base64=image_data,
-            liked_by_users=liked_ids,
-        ))
-
-    return result
-
-@app.get("/my-listings/", response_model=list[ListingPreview])
-def read_my_listings(user_id: int, skip: int = 1, limit: int = 100, db: Session = Depends(get_db)):
-    listings = get_listings(db, skip=skip, limit=limit)
-    result = []
-
-    for listing in listings:
-        if listing.user_id == user_id:
-            image_data = None
-            if listing.photos:
-                first_photo = listing.photos[0]
-                if first_photo.image_path and os.path.isfile(first_photo.image_path):
-                    with open(first_photo.image_path, "rb") as image_file:
-                        image_data = base64.b64encode(image_file.read()).decode("utf-8")
-            db_user = db.query(User).filter(User.id == listing.user_id).first()
-            liked_ids = [user.id for user in listing.liked_by_users]
-            result.append(ListingPreview(
-                id=listing.id,
-                title=listing.title,
-                price=listing.price,
-                owner_name=db_user.name,
-                image_base64=image_data,
-                liked_by_users=liked_ids,
-            ))
-
-    return result
-
-@app.get("/liked-listings/", response_model=list[ListingPreview])
-def read_liked_listings(user_id: int, skip: int = 1, limit: int = 100, db: Session = Depends(get_db)):
-    listings = get_listings(db, skip=skip, limit=limit)
-    result = []
-
-    current_user = db.query(User).filter(User.id == user_id).first()
-
-    for listing in listings:
-        if current_user in listing.liked_by_users:
-            image_data = None
-            if listing.photos:
-                first_photo = listing.photos[0]
-                if first_photo.image_path and os.path.isfile(first_photo.image_path):
-                    with open(first_photo.image_path, "rb") as image_file:
-                        image_data = base64.b64encode(image_file.read()).decode("utf-8")
-            db_user = db.query(User).filter(User.id == listing.user_id).first()
-            liked_ids = [user.id for user in listing.liked_by_users]
-            result.append(ListingPreview(
-                id=listing.id,
-                title=listing.title,
-                price=listing.price,
-                owner_name=db_user.name,
-                image_base64=image_data,
-                liked_by_users=liked_ids,
-            ))
-
-    return result
-
-@app.get("/filtered-listings/", response_model=list[ListingPreview])
-def read_filtered_listings(query: str, value: str, db: Session = Depends(get_db)):
-    result = []
-    listings = []
-    if query == "city":
-        listings = db.query(Listing).filter(Listing.address_city.ilike(f"%{value}%")).all()
-    elif query == "user":
-        listings = (
-            db.query(Listing)
-            .join(User, Listing.user_id == User.id)
-            .filter(User.name.ilike(f"%{value}%"))
-            .all()
-        )
-    elif query == "price":
-        listings = db.query(Listing).filter(Listing.price <= int(value)).all()
+StreamFormat = Literal["json", "ndjson"]
 
-    for listing in listings:
-        image_data = None
-        if listing.photos:
-            first_photo = listing.photos[0]
-            if first_photo.image_path and os.path.isfile(first_photo.image_path):
-                with open(first_photo.image_path, "rb") as image_file:
-                    image_data = base64.b64encode(image_file.read()).decode("utf-8")
-        db_user = db.query(User).filter(User.id == listing.user_id).first()
-        liked_ids = [user.id for user in listing.liked_by_users]
-        result.append(ListingPreview(
-            id=listing.id,
-            title=listing.title,
-            price=listing.price,
-            owner_name=db_user.name,
-            image_base64=image_data,
-            liked_by_users=liked_ids,
-        ))
-
-    return result
+# Зависимость - потоковая выдача ленты: ?stream=json|ndjson или Accept: application/x-ndjson
+def get_stream_format(request: Request, stream: StreamFormat | None = None):
+    if stream is None and STREAM_MEDIA_TYPES["ndjson"] in request.headers.get("accept", ""):
+        return "ndjson"
+    return stream
+
+async def load_listings(db: AsyncSession, limit: int, cursor: str | None, **filters):
+    try:
+        return await get_listings(db, limit=limit, cursor=cursor, **filters)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def build_listing_page(db: AsyncSession, limit: int, cursor: str | None, options: PreviewOptions, **filters):
+    listings, next_cursor = await load_listings(db, limit, cursor, **filters)
+    page = ListingPage(items=await build_listing_previews(db, listings, options), next_cursor=next_cursor)
+    return page, listing_versions(listings)
+
+# Лента целиком из кэша или потоком. В потоковом режиме запросы к базе выполняются
+# до начала ответа, а картинки читаются и сериализуются пачками по ходу отправки
+async def listing_page_response(request: Request, db: AsyncSession, scopes: list[str], stream: str | None,
+                                limit: int, cursor: str | None, options: PreviewOptions, **filters):
+    if stream is None:
+        response = await cached_json(request, db, scopes,
+                                     lambda: build_listing_page(db, limit, cursor, options, **filters))
+    else:
+        listings, next_cursor = await load_listings(db, limit, cursor, **filters)
+        rows = await load_preview_rows(db, listings, options)
+        response = listing_page_stream(iter_preview_chunks(rows, options, PREVIEW_STREAM_CHUNK), next_cursor, stream)
+    # Формат зависит и от Accept (get_stream_format): кэши не должны отдать NDJSON тому, кто ждет JSON
+    response.headers.add_vary_header("Accept")
+    return response
+
+# Ответ из кэша, если не изменились версии scopes и попавших в него объявлений.
+# Ключ — путь и отсортированные query-параметры. ETag строится из тех же версий:
+# клиент с актуальным ETag получает 304 без сборки и передачи тела
+async def cached_json(request: Request, db: AsyncSession, scopes: list[str], build):
+    key = f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+    etag, body = await response_cache.get_or_build(db, key, scopes, build, if_none_match_tags(request))
+    headers = {"etag": etag, "cache-control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/listings/", response_model=ListingPage)
+async def read_listings(request: Request, cursor: str | None = None, limit: int = Query(100, ge=1, le=100),
+                        options: PreviewOptions = Depends(get_preview_options),
+                        stream: StreamFormat | None = Depends(get_stream_format),
+                        db: AsyncSession = Depends(get_read_db)):
+    return await listing_page_response(request, db, ["listings"], stream, limit, cursor, options)
+
+@app.get("/my-listings/", response_model=ListingPage)
+async def read_my_listings(request: Request, user_id: int, cursor: str | None = None,
+                           limit: int = Query(100, ge=1, le=100),
+                           options: PreviewOptions = Depends(get_preview_options),
+                           stream: StreamFormat | None = Depends(get_stream_format),
+                           db: AsyncSession = Depends(get_read_db)):
+    return await listing_page_response(request, db, ["listings"], stream, limit, cursor, options, user_id=user_id)
+
+@app.get("/liked-listings/", response_model=ListingPage)
+async def read_liked_listings(request: Request, user_id: int, cursor: str | None = None,
+                              limit: int = Query(100, ge=1, le=100),
+                              options: PreviewOptions = Depends(get_preview_options),
+                              stream: StreamFormat | None = Depends(get_stream_format),
+                              db: AsyncSession = Depends(get_read_db)):
+    return await listing_page_response(request, db, ["listings", f"likes:{user_id}"], stream,
+                                       limit, cursor, options, liked_by=user_id)
+
+# Зависимость - критерии поиска из query-параметров
+def get_listing_search(q: str | None = None, city: str | None = None, street: str | None = None,
+                       owner: str | None = None, min_price: int | None = None, max_price: int | None = None,
+                       rooms: list[int] | None = Query(None), type: str | None = None,
+                       min_total_area: float | None = None, max_total_area: float | None = None,
+                       min_kitchen_area: float | None = None, max_kitchen_area: float | None = None,
+                       min_floor: int | None = None, max_floor: int | None = None,
+                       allowed_children: bool | None = None, allowed_pets: bool | None = None,
+                       allowed_smoking: bool | None = None):
+    return ListingSearch(
+        q=q, city=city, street=street, owner=owner, min_price=min_price, max_price=max_price,
+        rooms=rooms, type=type, min_total_area=min_total_area, max_total_area=max_total_area,
+        min_kitchen_area=min_kitchen_area, max_kitchen_area=max_kitchen_area,
+        min_floor=min_floor, max_floor=max_floor, allowed_children=allowed_children,
+        allowed_pets=allowed_pets, allowed_smoking=allowed_smoking,
+    )
+
+@app.get("/filtered-listings/", response_model=ListingPage)
+async def read_filtered_listings(request: Request, query: str | None = None, value: str | None = None,
+                                 search: ListingSearch = Depends(get_listing_search), cursor: str | None = None,
+                                 limit: int = Query(100, ge=1, le=100),
+                                 options: PreviewOptions = Depends(get_preview_options),
+                                 stream: StreamFormat | None = Depends(get_stream_format),
+                                 db: AsyncSession = Depends(get_read_db)):
+    # Старый формат: один критерий в паре query/value
+    if query is not None:
+        if query == "city":
+            search.city = value
+        elif query == "user":
+            search.owner = value
+        elif query == "price":
+            try:
+                search.max_price = int(value)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid price")
+        else:
+            return ListingPage(items=[])
+
+    listings_query, rank = build_search_query(db, search)
+    return await listing_page_response(request, db, ["listings"], stream, limit, cursor, options,
+                                       query=listings_query, rank=rank)
+
+@app.get("/search/listings", response_model=ListingSearchPage)
+async def search_listings(request: Request, search: ListingSearch = Depends(get_listing_search),
+                          cursor: str | None = None, limit: int = Query(100, ge=1, le=100),
+                          options: PreviewOptions = Depends(get_preview_options),
+                          db: AsyncSession = Depends(get_read_db)):
+    listings_query, rank = build_search_query(db, search)
+
+    async def build():
+        page, versions = await build_listing_page(db, limit, cursor, options, query=listings_query, rank=rank)
+        facets = await get_facets(db, listings_query)
+        return ListingSearchPage(items=page.items, next_cursor=page.next_cursor, facets=facets), versions
+
+    return await cached_json(request, db, ["listings"], build)
 
 @app.post("/listings/", response_model=ListingSchema)
-def create_listing_endpoint(listing: ListingBase, db: Session = Depends(get_db)):
-    return create_listing(db, listing)
+async def create_listing_endpoint(listing: ListingBase, db: AsyncSession = Depends(get_db)):
+    db_listing = await create_listing(db, listing)
+    if listing.image_paths:
+        image_worker.notify()
+    return db_listing
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/ndjson"}
+CSV_CONTENT_TYPES = {"text/csv", "application/csv"}
+
+@app.post("/listings/bulk", status_code=status.HTTP_200_OK)
+async def bulk_create_listings_endpoint(request: Request, db: AsyncSession = Depends(get_db)):
+    # Тело читается потоком: NDJSON (объект ListingBase на строку) или CSV с заголовком
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        rows = iter_ndjson(request.stream())
+    elif content_type in CSV_CONTENT_TYPES:
+        rows = iter_csv(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Expected application/x-ndjson or text/csv")
+
+    result = await ingest_listings(db, rows)
+    return result.as_dict()
+
+# Поля для fields= в /listings/batch: id и все поля ListingRead, кроме путей к файлам
+LISTING_READ_FIELDS = {"id", *ListingRead.model_fields} - {"image_paths"}
+LISTING_BATCH_MAX_IDS = 100
+
+def parse_csv_param(value: str):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+# Карточки нескольких объявлений одним запросом: ?ids=3,1,2 (порядок сохраняется) и
+# ?fields=price,address_city — только эти поля, картинки и лайкнувшие — только если запрошены
+@app.get("/listings/batch", response_model=ListingBatch)
+async def read_listings_batch(request: Request, ids: str, fields: str | None = None,
+                              db: AsyncSession = Depends(get_read_db)):
+    try:
+        listing_ids = list(dict.fromkeys(int(item) for item in parse_csv_param(ids)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    if not listing_ids or len(listing_ids) > LISTING_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Expected 1 to {LISTING_BATCH_MAX_IDS} ids")
+
+    requested = set(parse_csv_param(fields)) if fields else set(LISTING_READ_FIELDS)
+    unknown = requested - LISTING_READ_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    # Версии берутся только у найденных объявлений: scope "listings" меняется при создании и удалении,
+    # чтобы id из missing перепроверялись
+    return await cached_json(request, db, ["listings"], lambda: build_listing_details(db, listing_ids, requested))
 
 @app.get("/listing/{listing_id}", response_model=ListingRead)
-def read_listing(listing_id: int, db: Session = Depends(get_db)):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=400, detail="Listing not found")
-    listing.owner_name = listing.user.name
-    listing.owner_email = listing.user.email
-    listing.owner_phone = listing.user.phone
-    image_data = None
-    if listing.photos:
-        first_photo = listing.photos[0]
-        if first_photo.image_path and os.path.isfile(first_photo.image_path):
-            with open(first_photo.image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode("utf-8")
-    listing.image_base64 = image_data
-    listing.liked_user_ids = [user.id for user in listing.liked_by_users]
-    return listing
+async def read_listing(request: Request, listing_id: int, db: AsyncSession = Depends(get_read_db)):
+    async def build():
+        listing = await db.scalar(
+            select(Listing)
+            .where(Listing.id == listing_id)
+            .options(selectinload(Listing.user), selectinload(Listing.photos), selectinload(Listing.liked_by_users))
+        )
+        if not listing:
+            raise HTTPException(status_code=400, detail="Listing not found")
+        listing.owner_name = listing.user.name
+        listing.owner_email = listing.user.email
+        listing.owner_phone = listing.user.phone
+        listing.image_base64 = None
+        listing.image_url = None
+        if listing.photos:
+            first_photo = listing.photos[0]
+            listing.image_base64 = await run_file_io(image_cache.get_base64, first_photo.image_path)
+            listing.image_url = listing_photo_url(first_photo.id, "medium")
+        listing.liked_user_ids = [user.id for user in listing.liked_by_users]
+        return ListingRead.model_validate(listing, from_attributes=True), listing_versions([listing])
+
+    return await cached_json(request, db, [], build)
+
+# Похожие объявления: ближайшие по цене, комнатам, площади, этажности, типу и правилам.
+# По умолчанию только из того же города, ?same_city=false — из любого
+@app.get("/listing/{listing_id}/similar", response_model=ListingPage)
+async def read_similar_listings(request: Request, listing_id: int, limit: int = Query(10, ge=1, le=50),
+                                same_city: bool = True, options: PreviewOptions = Depends(get_preview_options),
+                                db: AsyncSession = Depends(get_read_db)):
+    async def build():
+        listing_ids = await similar_listings.nearest(db, listing_id, limit, same_city)
+        if listing_ids is None:
+            raise HTTPException(status_code=400, detail="Listing not found")
+        listings = await get_listings_by_ids(db, listing_ids)
+        return ListingPage(items=await build_listing_previews(db, listings, options)), listing_versions(listings)
+
+    return await cached_json(request, db, ["listings"], build)
 
 @app.delete("/listing/{listing_id}", status_code=status.HTTP_200_OK)
-def delete_listing(listing_id: int, db: Session = Depends(get_db)):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
+async def delete_listing(listing_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    listing = await db.scalar(
+        select(Listing).where(Listing.id == listing_id).options(selectinload(Listing.photos))
+    )
     if not listing:
         raise HTTPException(status_code=400, detail="Listing not found")
-    db.delete(listing)
-    db.commit()
+    image_paths = [photo.image_path for photo in listing.photos]
+    await add_feed_events(db, [listing_deleted_event(listing)])
+    await change_listing_rollups(db, [listing_rollup_values(listing)], -1)
+    await db.delete(listing)
+    await bump_cache_versions(db, ["listings"])
+    await db.commit()
+    # Файлы фото удаляются после ответа, если их не используют другие объявления
+    if image_paths:
+        background_tasks.add_task(cleanup_photo_files, image_paths)
     return {"message": "Объявление удалено!!"}
 
 @app.post("/register", response_model=UserOut)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
+    hashed_password = await hash_password(user.password)
     new_user = User(
         name=user.name,
         email=user.email,
         phone=user.phone,
-        hashed_password=bcrypt.hashpw(user.password.encode(), bcrypt.gensalt()).decode()
+        hashed_password=hashed_password
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @app.post("/login", response_model=UserLoginResponse)
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not bcrypt.checkpw(user.password.encode(), db_user.hashed_password.encode()):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
+    if not db_user:
+        raise HTTPException(status_code=400, detail="Invalid credentials")
+    verified, new_hash = await verify_password(user.password, db_user.hashed_password)
+    if not verified:
         raise HTTPException(status_code=400, detail="Invalid credentials")
+    # Хэш со старой стоимостью пересчитывается, пока пароль известен
+    if new_hash:
+        db_user.hashed_password = new_hash
+        await db.commit()
 
-    photo_base64 = None
-    if db_user.image_path and os.path.isfile(db_user.image_path):
-        with open(db_user.image_path, "rb") as image_file:
-            photo_base64 = base64.b64encode(image_file.read()).decode("utf-8")
+    photo_base64 = await run_file_io(image_cache.get_base64, db_user.thumbnail_path or db_user.image_path)
 
     return UserLoginResponse(
         id=db_user.id,
@@ -219,126 +412,237 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
         email=db_user.email,
         phone=db_user.phone,
         created_at=db_user.created_at,
-        photo_base64=photo_base64
+        photo_base64=photo_base64,
+        photo_url=user_photo_url(db_user.id) if db_user.image_path else None,
     )
 
 @app.get("/user-photo/{user_id}")
-def get_user_photo(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user_photo(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
 
     if not user or not user.image_path:
         raise HTTPException(status_code=404, detail="User or photo not found")
 
-    image_path = user.image_path
-    if not os.path.isfile(image_path):
+    photo_base64 = await run_file_io(image_cache.get_base64, user.image_path)
+    if photo_base64 is None:
         raise HTTPException(status_code=404, detail="Image file not found")
-    with open(user.image_path, "rb") as image_file:
-        photo_base64 = base64.b64encode(image_file.read()).decode("utf-8")
     return {"image_base64": photo_base64}
 
 @app.post("/user-photo/{user_id}")
-def upload_user_photo(user_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def upload_user_photo(user_id: int, background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                            db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Создаём путь к файлу
-    filename = f"static/users/user_{user_id}{os.path.splitext(file.filename)[1]}"
-    with open(filename, "wb") as image_file:
-        image_file.write(file.file.read())
+    old_path = user.image_path
+    job = await store_photo(db, "user_photo", user, file.file, file.filename)
+    await db.commit()
 
-    # Обновляем путь в БД
-    user.image_path = filename
-    db.commit()
+    # Прежний аватар удаляется, если на тот же файл больше никто не ссылается
+    if old_path and old_path != user.image_path:
+        background_tasks.add_task(cleanup_photo_files, [old_path])
+    return {"message": "Photo uploaded successfully", "image_path": user.image_path, **image_job_status(job)}
 
-    return {"message": "Photo uploaded successfully", "image_path": filename}
+@app.get("/user-photos/{user_id}")
+async def get_user_photo_file(user_id: int, request: Request, size: PhotoSize = "thumb",
+                              db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if not user or not user.image_path:
+        raise HTTPException(status_code=404, detail="User or photo not found")
 
-@app.get("/listing-photo/{listing_id}")
-def get_listing_photo(listing_id: int, db: Session = Depends(get_db)):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
+    # URL аватара не меняется при новой загрузке, поэтому только с ревалидацией
+    return photo_response(request, photo_path(user, size, accepts_webp(request)))
 
-    if not listing or not listing.image_path:
+@app.get("/listing-photo/{listing_id}")
+async def get_listing_photo(listing_id: int, request: Request, size: PhotoSize = "original",
+                            db: AsyncSession = Depends(get_db)):
+    photo = await db.scalar(
+        select(ListingPhoto)
+        .where(ListingPhoto.listing_id == listing_id)
+        .order_by(ListingPhoto.id)
+        .limit(1)
+    )
+    if not photo:
         raise HTTPException(status_code=404, detail="listing or photo not found")
 
-    image_path = listing.image_path
+    # Пока фото обрабатывается, вместо копий отдается исходник — его нельзя кэшировать навсегда
+    return photo_response(request, photo_path(photo, size, accepts_webp(request)),
+                          immutable=photo.thumbnail_path is not None)
 
-    if not os.path.isfile(image_path):
-        raise HTTPException(status_code=404, detail="Image file not found")
+@app.get("/listing-photos/{photo_id}")
+async def get_listing_photo_file(photo_id: int, request: Request, size: PhotoSize = "original",
+                                 db: AsyncSession = Depends(get_db)):
+    photo = await db.scalar(select(ListingPhoto).where(ListingPhoto.id == photo_id))
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
 
-    return FileResponse(image_path, media_type="image/png")
+    # Обработанное фото не меняется: новое содержимое — новое фото
+    return photo_response(request, photo_path(photo, size, accepts_webp(request)),
+                          immutable=photo.thumbnail_path is not None)
 
 
-@app.post("/listing-photo/{listing_id}")
-def upload_listing_photo(listing_id: int, photo_data: ListingPhotoBase64, db: Session = Depends(get_db)):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
+async def add_listing_photo(db: AsyncSession, listing_id: int, source, filename: str | None):
+    if not await db.scalar(select(Listing.id).where(Listing.id == listing_id)):
         raise HTTPException(status_code=404, detail="Listing not found")
 
-    # Создаём путь к файлу
+    new_photo = ListingPhoto(listing_id=listing_id)
+    job = await store_photo(db, "listing_photo", new_photo, source, filename)
+    if job is None:
+        # Готовые копии нашлись сразу; иначе событие пошлет воркер после обработки
+        await db.flush()
+        await add_photo_added_event(db, new_photo)
+    await bump_listing_versions(db, [listing_id])
+    await db.commit()
+
+    return {"message": "Photo uploaded successfully", "id": new_photo.id, **image_job_status(job)}
+
+@app.get("/image-jobs/{job_id}")
+async def get_image_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.get(ImageJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": job.id, "kind": job.kind, "object_id": job.object_id, "status": job.status,
+            "attempts": job.attempts, "error": job.error}
+
+# Загрузка фото объявления. multipart (поле file) читается кусками, без декодирования в память;
+# JSON {"base64_data", "extension"} — прежний формат: тело на треть больше и декодируется целиком
+@app.post("/listing-photo/{listing_id}")
+async def upload_listing_photo(listing_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        async with request.form() as form:
+            file = form.get("file")
+            if not isinstance(file, StarletteUploadFile):
+                raise HTTPException(status_code=422, detail="Expected an image in the file field")
+            return await add_listing_photo(db, listing_id, file.file, file.filename)
+    # Без Content-Type тело считается JSON, как и при разборе модели FastAPI
+    if content_type and content_type != "application/json" and not content_type.endswith("+json"):
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data or application/json")
+
+    try:
+        photo_data = ListingPhotoBase64.model_validate_json(await request.body())
+    except ValidationError as error:
+        raise RequestValidationError([{**item, "loc": ("body", *item["loc"])}
+                                      for item in error.errors(include_url=False)])
     if "," in photo_data.base64_data:
         _, base64_str = photo_data.base64_data.split(",", 1)
     else:
         base64_str = photo_data.base64_data
 
     try:
-        image_bytes = base64.b64decode(base64_str)
+        image_bytes = await run_file_io(base64.b64decode, base64_str)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid base64 string")
-    filename = f"static/listings/listing_{listing_id}_{uuid4().hex}{photo_data.extension}"
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-    with open(filename, "wb") as image_file:
-        image_file.write(image_bytes)
-
-    new_photo = ListingPhoto(
-        listing_id=listing_id,
-        image_path=filename,
-    )
-    db.add(new_photo)
-    db.commit()
-    db.refresh(new_photo)
+    return await add_listing_photo(db, listing_id, io.BytesIO(image_bytes), photo_data.extension)
 
-    return {"message": "Photo uploaded successfully", "id": new_photo.id}
-
-@app.post("/listing-like", status_code=status.HTTP_200_OK)
-def like_listing(listing_id: int, user_id: int, db: Session = Depends(get_db), ):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
+async def ensure_listing_exists(db: AsyncSession, listing_id: int):
+    if not await db.scalar(select(Listing.id).where(Listing.id == listing_id)):
         raise HTTPException(status_code=404, detail="Объявление не найдено")
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+@app.post("/listing-like", status_code=status.HTTP_200_OK)
+async def like_listing(listing_id: int, user_id: int, db: AsyncSession = Depends(get_db), ):
+    try:
+        liked = await add_likes(db, user_id, [listing_id])
+        await db.commit()
+    except IntegrityError:
         raise HTTPException(status_code=404, detail="User not found")
 
-    like = db.query(Like).filter((Like.user_id == user_id) & (Like.listing_id == listing_id)).first()
-
-    if not like:
-        like = Like(listing_id=listing_id, user_id=user_id)
-
-        db.add(like)
-        db.commit()
-        db.refresh(like)
+    if liked:
         return {"message": "Лайк добавлен"}
 
-    else:
-        return {"message": "Лайк уже был добавлен!"}
+    # Сюда попадаем только если лайк уже был или объявления нет
+    await ensure_listing_exists(db, listing_id)
+    return {"message": "Лайк уже был добавлен!"}
 
 @app.delete("/listing-unlike", status_code=status.HTTP_200_OK)
-def unlike_listing(listing_id: int, user_id: int, db: Session = Depends(get_db), ):
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+async def unlike_listing(listing_id: int, user_id: int, db: AsyncSession = Depends(get_db), ):
+    unliked = await remove_likes(db, user_id, [listing_id])
+    await db.commit()
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    if unliked:
+        return {"message": "Лайк был удален!"}
+
+    await ensure_listing_exists(db, listing_id)
+    return {"message": "Лайк не существует!"}
+
+@app.post("/listing-likes/batch", status_code=status.HTTP_200_OK)
+async def batch_like_listings(batch: LikeBatch, db: AsyncSession = Depends(get_db)):
+    # Возвращает только те id, для которых лайк действительно добавлен/удален
+    try:
+        liked = await add_likes(db, batch.user_id, batch.like)
+        unliked = await remove_likes(db, batch.user_id, batch.unlike)
+        await db.commit()
+    except IntegrityError:
         raise HTTPException(status_code=404, detail="User not found")
+    return {"liked": liked, "unliked": unliked}
 
-    like = db.query(Like).filter((Like.user_id == user_id) & (Like.listing_id == listing_id)).first()
+FeedEventKind = Literal[FEED_KINDS]
 
-    if like:
-        db.delete(like)
-        db.commit()
-        return {"message": "Лайк был удален!"}
+# Push-канал лент (SSE) вместо опроса /listings/: новые и удаленные объявления, лайки, фото.
+# Фильтры: город, владелец (user_id — "мои объявления"), типы событий. После обрыва
+# EventSource сам присылает Last-Event-ID; событие reset — перечитать ленту целиком
+@app.get("/feed/events")
+async def stream_feed_events(request: Request, city: str | None = None, user_id: int | None = None,
+                             kinds: list[FeedEventKind] | None = Query(None), last_event_id: int | None = None):
+    try:
+        feed_hub.check_capacity()
+    except FeedHubFull:
+        raise HTTPException(status_code=503, detail="Too many feed subscribers", headers={"Retry-After": "5"})
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(
+        feed_hub.stream(city, user_id, set(kinds) if kinds else None, last_event_id),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
 
-    else:
-        return {"message": "Лайк не существует!"}
\ No newline at end of file
+ANALYTICS_DEFAULT_QUANTILES = "0.25,0.5,0.75"
+
+# Рыночная статистика по сверткам, без обращения к listings: ?group_by=city,rooms,type,month
+# (month — помесячный тренд), фильтры city/rooms/type и диапазон месяцев since/until
+@app.get("/analytics/listings", response_model=MarketStats)
+async def read_listing_analytics(request: Request, group_by: str = "", city: str | None = None,
+                                 rooms: int | None = None, type: str | None = None, since: date | None = None,
+                                 until: date | None = None, quantiles: str = ANALYTICS_DEFAULT_QUANTILES,
+                                 db: AsyncSession = Depends(get_read_db)):
+    groups = list(dict.fromkeys(parse_csv_param(group_by)))
+    unknown = set(groups) - set(ROLLUP_KEY)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(sorted(unknown))}")
+    try:
+        levels = [float(item) for item in parse_csv_param(quantiles)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="quantiles must be comma-separated numbers")
+    if not all(0 <= level <= 1 for level in levels):
+        raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+    filters = {column: value for column, value in (("city", city), ("rooms", rooms), ("type", type))
+               if value is not None}
+
+    async def build():
+        rows = await get_listing_rollups(db, filters, since and since.replace(day=1), until and until.replace(day=1))
+        stats = MarketStats(groups=summarize_rollups(groups, rows, levels),
+                            relative_accuracy=ANALYTICS_SKETCH_ACCURACY)
+        return stats, {}
+
+    return await cached_json(request, db, ["listings"], build)
+
+@app.get("/image-cache/stats")
+def get_image_cache_stats():
+    return image_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/response-cache/stats")
+def get_response_cache_stats():
+    return response_cache.stats()
+
+@app.get("/compression/stats")
+def get_compression_stats():
+    return response_compressor.stats()
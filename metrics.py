@@ -0,0 +1,272 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+logger = logging.getLogger("metrics")
+
+# Запросы дольше SLOW_REQUEST_SECONDS пишутся в лог вместе с SQL
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 1.0))
+SLOW_REQUEST_MAX_STATEMENTS = 50
+
+# Семплирующий профайлер, по умолчанию выключен. Стеки запросов дольше
+# PROFILE_THRESHOLD_SECONDS сохраняются в PROFILE_DIR в формате folded (flamegraph.pl, speedscope)
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_THRESHOLD_SECONDS = float(os.getenv("PROFILE_THRESHOLD_SECONDS", 0.5))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.005))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+BYTES_BUCKETS = (0, 1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2)
+
+
+class RequestMetrics:
+    # Счетчики одного HTTP-запроса: заполняются хуками SQLAlchemy и кэшем картинок
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.statements = []
+        self.file_bytes = 0
+        self.encode_seconds = 0.0
+        self.compress_seconds = 0.0
+
+    def server_timing(self, total_seconds: float):
+        return ", ".join((
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f"encode;dur={self.encode_seconds * 1000:.1f}",
+            f"compress;dur={self.compress_seconds * 1000:.1f}",
+            f'file;desc="{self.file_bytes} bytes"',
+            f"total;dur={total_seconds * 1000:.1f}",
+        ))
+
+
+# Контекст копируется в потоки run_file_io и в greenlet'ы асинхронного SQLAlchemy
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def record_file_read(size: int):
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.file_bytes += size
+
+
+def record_encode(seconds: float):
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.encode_seconds += seconds
+
+
+def record_compress(seconds: float):
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.compress_seconds += seconds
+
+
+def instrument_engine(engine):
+    # Время и текст каждого SQL-запроса относятся к текущему HTTP-запросу
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        request_metrics = current_request.get()
+        if request_metrics is None:
+            return
+        request_metrics.db_seconds += elapsed
+        request_metrics.queries += 1
+        if len(request_metrics.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+            request_metrics.statements.append((statement, elapsed))
+
+
+class Histogram:
+    # Гистограмма в формате Prometheus: накопительные корзины, _sum и _count по набору меток
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.setdefault(labels, [[0] * len(self.buckets), 0, 0.0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, count, total) in sorted(self.series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+# Метрики считаются в памяти воркера: при нескольких воркерах Prometheus опрашивает каждый
+REQUEST_LABELS = ("method", "route", "status")
+ROUTE_LABELS = ("method", "route")
+request_duration = Histogram("http_request_duration_seconds", "Request duration", REQUEST_LABELS, DURATION_BUCKETS)
+request_db_duration = Histogram("http_request_db_seconds", "Time spent in SQL per request", ROUTE_LABELS,
+                                DURATION_BUCKETS)
+request_queries = Histogram("http_request_queries", "SQL statements per request", ROUTE_LABELS, QUERY_BUCKETS)
+request_file_bytes = Histogram("http_request_file_bytes", "Bytes read from image files per request", ROUTE_LABELS,
+                               BYTES_BUCKETS)
+request_encode_duration = Histogram("http_request_encode_seconds", "Time spent in base64 encoding per request",
+                                    ROUTE_LABELS, DURATION_BUCKETS)
+request_compress_duration = Histogram("http_request_compress_seconds", "Time spent compressing the response body",
+                                      ROUTE_LABELS, DURATION_BUCKETS)
+HISTOGRAMS = (request_duration, request_db_duration, request_queries, request_file_bytes, request_encode_duration,
+              request_compress_duration)
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+class StackSampler:
+    # Один поток на процесс снимает стек потока event loop и раздает его всем
+    # запросам, которые сейчас выполняются. Конкурентные запросы видят стеки друг друга
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread_id = None
+        self.thread = None
+
+    def start(self, samples: Counter):
+        with self.lock:
+            self.thread_id = threading.get_ident()
+            self.active[id(samples)] = samples
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+
+    def stop(self, samples: Counter):
+        with self.lock:
+            self.active.pop(id(samples), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                frame = sys._current_frames().get(self.thread_id) if self.active else None
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                folded = ";".join(reversed(stack))
+                for samples in self.active.values():
+                    samples[folded] += 1
+
+
+stack_sampler = StackSampler(PROFILE_INTERVAL_SECONDS) if PROFILE_ENABLED else None
+
+
+def dump_profile(route: str, duration: float, samples: Counter):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{duration * 1000:.0f}ms.folded")
+    with open(path, "w") as file:
+        for stack, count in samples.most_common():
+            file.write(f"{stack} {count}\n")
+    return path
+
+
+class MetricsMiddleware:
+    # ASGI-middleware: заводит RequestMetrics на запрос, добавляет Server-Timing,
+    # после ответа пишет гистограммы, лог медленных запросов и, если включено, профиль
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        samples = Counter()
+        if stack_sampler is not None:
+            stack_sampler.start(samples)
+        status = 500
+        event_stream = False
+
+        async def send_with_timing(message):
+            nonlocal status, event_stream
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                event_stream = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                                   for name, value in message.get("headers", []))
+                total = time.perf_counter() - request_metrics.started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", request_metrics.server_timing(total).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            if stack_sampler is not None:
+                stack_sampler.stop(samples)
+            self.finish(scope, status, request_metrics, samples, event_stream)
+
+    def finish(self, scope, status: int, request_metrics: RequestMetrics, samples: Counter,
+               event_stream: bool = False):
+        duration = time.perf_counter() - request_metrics.started
+        route = getattr(scope.get("route"), "path", "unmatched")
+        method = scope["method"]
+
+        request_duration.observe((method, route, str(status)), duration)
+        request_db_duration.observe((method, route), request_metrics.db_seconds)
+        request_queries.observe((method, route), request_metrics.queries)
+        request_file_bytes.observe((method, route), request_metrics.file_bytes)
+        request_encode_duration.observe((method, route), request_metrics.encode_seconds)
+        request_compress_duration.observe((method, route), request_metrics.compress_seconds)
+
+        # Подключения SSE живут долго по определению — это не медленные запросы
+        if event_stream:
+            return
+
+        if duration >= SLOW_REQUEST_SECONDS:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": method,
+                "route": route,
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(duration * 1000, 1),
+                "db_ms": round(request_metrics.db_seconds * 1000, 1),
+                "queries": request_metrics.queries,
+                "file_bytes": request_metrics.file_bytes,
+                "encode_ms": round(request_metrics.encode_seconds * 1000, 1),
+                "compress_ms": round(request_metrics.compress_seconds * 1000, 1),
+                "statements": [
+                    {"sql": statement, "ms": round(elapsed * 1000, 1)}
+                    for statement, elapsed in request_metrics.statements
+                ],
+            }, ensure_ascii=False))
+
+        if samples and duration >= PROFILE_THRESHOLD_SECONDS:
+            logger.warning("profile for %s %s saved to %s", method, route, dump_profile(route, duration, samples))
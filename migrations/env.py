@@ -0,0 +1,55 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from db import engine, Base
+import models  # noqa: F401 — регистрирует таблицы в Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# FTS5-таблица SQLite и ее теневые таблицы создаются миграцией вручную, autogenerate их не трогает
+IGNORED_TABLES_PREFIX = "listings_fts"
+
+
+def include_object(object_, name, type_, reflected, compare_to):
+    if type_ == "table" and name.startswith(IGNORED_TABLES_PREFIX):
+        return False
+    # Индексы только для одной СУБД (ddl_if в models.py) не сравниваются на других
+    ddl_if = getattr(object_, "_ddl_if", None)
+    if ddl_if is not None and ddl_if.dialect and ddl_if.dialect != context.get_bind().dialect.name:
+        return False
+    return True
+
+
+def run_migrations_offline():
+    context.configure(
+        url=engine.url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        include_object=include_object,
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,82 @@
+"""Исходная схема, как ее создавал Base.metadata.create_all
+
+Базы, созданные через create_all, отмечаются этой ревизией без изменений:
+alembic stamp 0001 && alembic upgrade head
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("phone", sa.String(), nullable=True),
+        sa.Column("email", sa.String()),
+        sa.Column("image_path", sa.String(), nullable=True),
+        sa.Column("hashed_password", sa.String()),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_name", "users", ["name"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "listings",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String()),
+        sa.Column("price", sa.Integer()),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+        sa.Column("rooms", sa.Integer()),
+        sa.Column("total_area", sa.Float()),
+        sa.Column("kitchen_area", sa.Float()),
+        sa.Column("floor", sa.Integer()),
+        sa.Column("total_floors", sa.Integer()),
+        sa.Column("deposit", sa.Integer()),
+        sa.Column("commission_percent", sa.Float()),
+        sa.Column("utilities_separate", sa.Boolean()),
+        sa.Column("allowed_children", sa.Boolean()),
+        sa.Column("allowed_pets", sa.Boolean()),
+        sa.Column("allowed_smoking", sa.Boolean()),
+        sa.Column("address_city", sa.String()),
+        sa.Column("address_street", sa.String()),
+        sa.Column("address_house", sa.String()),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("description", sa.Text()),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+    )
+    op.create_index("ix_listings_id", "listings", ["id"])
+    op.create_index("ix_listings_title", "listings", ["title"])
+
+    op.create_table(
+        "listing_photos",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("listing_id", sa.Integer(), sa.ForeignKey("listings.id", ondelete="CASCADE")),
+        sa.Column("image_path", sa.String(), nullable=False),
+    )
+    op.create_index("ix_listing_photos_id", "listing_photos", ["id"])
+
+    op.create_table(
+        "listing_likes",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("listing_id", sa.Integer(), sa.ForeignKey("listings.id", ondelete="CASCADE")),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE")),
+    )
+    op.create_index("ix_listing_likes_id", "listing_likes", ["id"])
+
+
+def downgrade():
+    op.drop_table("listing_likes")
+    op.drop_table("listing_photos")
+    op.drop_table("listings")
+    op.drop_table("users")
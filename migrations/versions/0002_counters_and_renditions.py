@@ -0,0 +1,66 @@
+"""Счетчик лайков, версии для кэша ответов, пути миниатюр, уникальность лайков
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+LIKES_UNIQUE = "uq_listing_likes_listing_id_user_id"
+
+
+def upgrade():
+    # Столбцы с константным DEFAULT в PostgreSQL добавляются без переписывания таблицы
+    op.add_column("listings", sa.Column("like_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("listings", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+    for table in ("users", "listing_photos"):
+        op.add_column(table, sa.Column("thumbnail_path", sa.String(), nullable=True))
+        op.add_column(table, sa.Column("medium_path", sa.String(), nullable=True))
+
+    op.create_table(
+        "cache_versions",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+    )
+
+    # Повторные лайки раньше не запрещались: перед уникальным индексом остается один из дублей
+    op.execute(
+        "DELETE FROM listing_likes WHERE id NOT IN "
+        "(SELECT min(id) FROM listing_likes GROUP BY listing_id, user_id)"
+    )
+    op.execute(
+        "UPDATE listings SET like_count = "
+        "(SELECT count(*) FROM listing_likes WHERE listing_likes.listing_id = listings.id)"
+    )
+
+    # В PostgreSQL уникальный индекс строится без блокировки записи и затем становится
+    # ограничением. SQLite не умеет добавлять ограничения — таблица пересоздается
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.create_index(LIKES_UNIQUE, "listing_likes", ["listing_id", "user_id"], unique=True,
+                            postgresql_concurrently=True, if_not_exists=True)
+        op.execute(f"ALTER TABLE listing_likes ADD CONSTRAINT {LIKES_UNIQUE} UNIQUE USING INDEX {LIKES_UNIQUE}")
+    else:
+        with op.batch_alter_table("listing_likes") as batch_op:
+            batch_op.create_unique_constraint(LIKES_UNIQUE, ["listing_id", "user_id"])
+
+
+def downgrade():
+    with op.batch_alter_table("listing_likes") as batch_op:
+        batch_op.drop_constraint(LIKES_UNIQUE, type_="unique")
+    op.drop_table("cache_versions")
+    with op.batch_alter_table("listing_photos") as batch_op:
+        batch_op.drop_column("medium_path")
+        batch_op.drop_column("thumbnail_path")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("medium_path")
+        batch_op.drop_column("thumbnail_path")
+    with op.batch_alter_table("listings") as batch_op:
+        batch_op.drop_column("version")
+        batch_op.drop_column("like_count")
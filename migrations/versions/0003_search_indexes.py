@@ -0,0 +1,75 @@
+"""Полнотекстовый и нечеткий поиск: tsvector и pg_trgm (PostgreSQL), FTS5 (SQLite)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# Выражение должно совпадать с models.listing_search_document, иначе планировщик не возьмет индекс
+SEARCH_DOCUMENT = (
+    "(((setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(address_city, '')), 'B')) || "
+    "setweight(to_tsvector('russian', coalesce(address_street, '')), 'B')) || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'C'))"
+)
+TRIGRAM_INDEXES = (
+    ("ix_listings_address_city_trgm", "listings", "address_city"),
+    ("ix_listings_address_street_trgm", "listings", "address_street"),
+    ("ix_users_name_trgm", "users", "name"),
+)
+
+FTS_COLUMNS = "title, description, address_city, address_street"
+FTS_NEW = "new.id, new.title, new.description, new.address_city, new.address_street"
+FTS_OLD = "'delete', old.id, old.title, old.description, old.address_city, old.address_street"
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_search_document "
+                f"ON listings USING gin (({SEARCH_DOCUMENT}))"
+            )
+            for name, table, column in TRIGRAM_INDEXES:
+                op.execute(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)"
+                )
+    elif op.get_bind().dialect.name == "sqlite":
+        op.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5({FTS_COLUMNS}, "
+            f"content='listings', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings BEGIN "
+            f"INSERT INTO listings_fts(rowid, {FTS_COLUMNS}) VALUES ({FTS_NEW}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings BEGIN "
+            f"INSERT INTO listings_fts(listings_fts, rowid, {FTS_COLUMNS}) VALUES ({FTS_OLD}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS listings_fts_au AFTER UPDATE OF {FTS_COLUMNS} ON listings BEGIN "
+            f"INSERT INTO listings_fts(listings_fts, rowid, {FTS_COLUMNS}) VALUES ({FTS_OLD}); "
+            f"INSERT INTO listings_fts(rowid, {FTS_COLUMNS}) VALUES ({FTS_NEW}); END"
+        )
+        # Индексация уже существующих объявлений
+        op.execute("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, _, _ in TRIGRAM_INDEXES:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_listings_search_document")
+    elif op.get_bind().dialect.name == "sqlite":
+        for trigger in ("listings_fts_ai", "listings_fts_ad", "listings_fts_au"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS listings_fts")
@@ -0,0 +1,45 @@
+"""Индексы горячих путей: ленты, фильтры поиска, фото и лайки
+
+Все индексы строятся CONCURRENTLY: таблицы остаются доступны на запись.
+Если построение прервалось, PostgreSQL оставляет индекс INVALID — его нужно
+удалить (DROP INDEX CONCURRENTLY) и повторить upgrade.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    # Keyset-пагинация лент: /listings/ и /my-listings/ (покрывает и фильтр по user_id)
+    ("ix_listings_created_at_id", "listings", ["created_at", "id"]),
+    ("ix_listings_user_id_created_at_id", "listings", ["user_id", "created_at", "id"]),
+    # Фильтры поиска (город — первым столбцом, поэтому покрывает и address_city отдельно)
+    ("ix_listings_address_city_price", "listings", ["address_city", "price"]),
+    ("ix_listings_rooms_price", "listings", ["rooms", "price"]),
+    ("ix_listings_type_rooms_price", "listings", ["type", "rooms", "price"]),
+    # Первое фото объявления: min(id) по listing_id
+    ("ix_listing_photos_listing_id_id", "listing_photos", ["listing_id", "id"]),
+    # /liked-listings/; (listing_id, user_id) покрыт уникальным индексом из 0002
+    ("ix_listing_likes_user_id_listing_id", "listing_likes", ["user_id", "listing_id"]),
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+    if op.get_bind().dialect.name == "postgresql":
+        for table in ("listings", "listing_photos", "listing_likes"):
+            op.execute(f"ANALYZE {table}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,43 @@
+"""Очередь обработки фото и WebP-копии
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ("users", "listing_photos"):
+        op.add_column(table, sa.Column("thumbnail_webp_path", sa.String(), nullable=True))
+        op.add_column(table, sa.Column("medium_webp_path", sa.String(), nullable=True))
+
+    op.create_table(
+        "image_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("object_id", sa.Integer(), nullable=False),
+        sa.Column("source_path", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("run_after", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_image_jobs_status_run_after", "image_jobs", ["status", "run_after"])
+
+
+def downgrade():
+    op.drop_index("ix_image_jobs_status_run_after", table_name="image_jobs")
+    op.drop_table("image_jobs")
+    for table in ("listing_photos", "users"):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("medium_webp_path")
+            batch_op.drop_column("thumbnail_webp_path")
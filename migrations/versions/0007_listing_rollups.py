@@ -0,0 +1,41 @@
+"""Свертки объявлений для рыночной аналитики
+
+Для уже существующих объявлений свертки заполняются отдельно: python check_rollups.py --repair
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "listing_rollups",
+        sa.Column("city", sa.String(), primary_key=True),
+        sa.Column("rooms", sa.Integer(), primary_key=True),
+        sa.Column("type", sa.String(), primary_key=True),
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("price_count", sa.Integer(), nullable=False),
+        sa.Column("price_sum", sa.Float(), nullable=False),
+        sa.Column("price_per_m2_count", sa.Integer(), nullable=False),
+        sa.Column("price_per_m2_sum", sa.Float(), nullable=False),
+        sa.Column("deposit_count", sa.Integer(), nullable=False),
+        sa.Column("deposit_sum", sa.Float(), nullable=False),
+        sa.Column("commission_percent_count", sa.Integer(), nullable=False),
+        sa.Column("commission_percent_sum", sa.Float(), nullable=False),
+        sa.Column("price_sketch", sa.LargeBinary(), nullable=True),
+        sa.Column("price_per_m2_sketch", sa.LargeBinary(), nullable=True),
+        sa.Column("deposit_sketch", sa.LargeBinary(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("listing_rollups")
@@ -0,0 +1,73 @@
+"""Общая часть имени файла фото (image_base) с индексом
+
+Уборка файлов проверяет ссылки равенством по image_base вместо LIKE 'base%' по image_path.
+Для существующих строк image_base заполняется здесь же, пачками по id: каждая пачка
+коммитится сразу, блокировки строк не держатся до конца миграции. Индексы строятся
+CONCURRENTLY, как в 0004: если построение прервалось, INVALID-индекс нужно удалить
+(DROP INDEX CONCURRENTLY) и повторить upgrade.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+TABLES = ("listing_photos", "users")
+BATCH_SIZE = 10000
+# Суффиксы копий на момент миграции (images.RENDITIONS)
+RENDITION_SUFFIXES = ("_full.jpg", "_thumb.jpg", "_medium.jpg", "_thumb.webp", "_medium.webp")
+
+
+def rendition_base(image_path: str):
+    for suffix in RENDITION_SUFFIXES:
+        if image_path.endswith(suffix):
+            return image_path[:-len(suffix)]
+    return os.path.splitext(image_path)[0]
+
+
+def fill_image_base(table_name: str):
+    connection = op.get_bind()
+    table = sa.table(table_name, sa.column("id", sa.Integer()), sa.column("image_path", sa.String()),
+                     sa.column("image_base", sa.String()))
+    last_id = 0
+    while rows := connection.execute(
+        sa.select(table.c.id, table.c.image_path)
+        .where(table.c.id > last_id, table.c.image_path.isnot(None))
+        .order_by(table.c.id)
+        .limit(BATCH_SIZE)
+    ).all():
+        connection.execute(
+            table.update().where(table.c.id == sa.bindparam("row_id")).values(image_base=sa.bindparam("base")),
+            [{"row_id": row_id, "base": rendition_base(image_path)} for row_id, image_path in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column("image_base", sa.String(), nullable=True))
+    # Вне транзакции миграции: каждый UPDATE пачки коммитится сам по себе
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            fill_image_base(table)
+            op.create_index(f"ix_{table}_image_base", table, ["image_base"],
+                            postgresql_concurrently=True, if_not_exists=True)
+    if op.get_bind().dialect.name == "postgresql":
+        for table in TABLES:
+            op.execute(f"ANALYZE {table}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in reversed(TABLES):
+            op.drop_index(f"ix_{table}_image_base", table_name=table, postgresql_concurrently=True, if_exists=True)
+    for table in reversed(TABLES):
+        op.drop_column(table, "image_base")
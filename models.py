@@ -1,9 +1,11 @@
 from datetime import datetime, UTC
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, Text, ForeignKey, Date, DateTime, Index, DDL, \
+    LargeBinary, UniqueConstraint, event, func, literal_column
 from sqlalchemy.orm import relationship
 
 from db import Base
+from images import rendition_base
 
 
 class User(Base):
@@ -14,6 +16,12 @@ class User(Base):
     phone = Column(String, nullable=True)
     email = Column(String, unique=True, index=True)
     image_path = Column(String, nullable=True)
+    # rendition_base(image_path): по нему с индексом ищутся ссылки на файлы хранилища
+    image_base = Column(String, nullable=True, index=True)
+    thumbnail_path = Column(String, nullable=True)
+    medium_path = Column(String, nullable=True)
+    thumbnail_webp_path = Column(String, nullable=True)
+    medium_webp_path = Column(String, nullable=True)
     hashed_password = Column(String)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
 
@@ -64,6 +72,11 @@ class Listing(Base):
     # Описание
     description = Column(Text)
 
+    # Счетчик лайков, поддерживается при лайке/снятии лайка
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Версия для кэша ответов: растет при любом изменении, видимом в превью и карточке
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
     # Пользователь
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
 
@@ -74,6 +87,16 @@ class Listing(Base):
         viewonly=True
     )
 
+    # Индексы под keyset-пагинацию лент
+    __table_args__ = (
+        Index("ix_listings_created_at_id", "created_at", "id"),
+        Index("ix_listings_user_id_created_at_id", "user_id", "created_at", "id"),
+        # Составные индексы под фильтры комбинированного поиска
+        Index("ix_listings_address_city_price", "address_city", "price"),
+        Index("ix_listings_rooms_price", "rooms", "price"),
+        Index("ix_listings_type_rooms_price", "type", "rooms", "price"),
+    )
+
 
 class ListingPhoto(Base):
     __tablename__ = "listing_photos"
@@ -81,12 +104,166 @@ class ListingPhoto(Base):
     id = Column(Integer, primary_key=True, index=True)
     listing_id = Column(Integer, ForeignKey("listings.id", ondelete="CASCADE"))
     image_path = Column(String, nullable=False)
+    image_base = Column(String, nullable=True, index=True)
+    thumbnail_path = Column(String, nullable=True)
+    medium_path = Column(String, nullable=True)
+    thumbnail_webp_path = Column(String, nullable=True)
+    medium_webp_path = Column(String, nullable=True)
 
     listing = relationship("Listing", back_populates="photos")
 
+    # Первое фото объявления — min(id) по listing_id
+    __table_args__ = (
+        Index("ix_listing_photos_listing_id_id", "listing_id", "id"),
+    )
+
+class CacheVersion(Base):
+    # Счетчики версий для кэша ответов: "listings" — состав лент, "likes:<user_id>" — лайки пользователя
+    __tablename__ = "cache_versions"
+
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+class ImageJob(Base):
+    # Очередь обработки фото: pending -> running -> done/failed. Для pending run_after — когда
+    # можно брать (повтор с задержкой), для running — когда аренда истекает и задачу
+    # подхватит другой воркер (процесс упал или перезапущен)
+    __tablename__ = "image_jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # "listing_photo" или "user_photo"
+    object_id = Column(Integer, nullable=False)
+    source_path = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    run_after = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+
+    __table_args__ = (
+        Index("ix_image_jobs_status_run_after", "status", "run_after"),
+    )
+
+class FeedEvent(Base):
+    # Изменения лент для push-канала: id — Last-Event-ID в SSE. Хранятся FEED_EVENTS_RETENTION_SECONDS
+    __tablename__ = "feed_events"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # listing_created, listing_deleted, likes_changed, photo_added
+    listing_id = Column(Integer, nullable=False)
+    # Поля для фильтров подписки: город и владелец объявления
+    city = Column(String, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC))
+
+    # AUTOINCREMENT: в SQLite id не переиспользуются после очистки старых событий
+    __table_args__ = (
+        Index("ix_feed_events_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+class ListingRollup(Base):
+    # Помесячные свертки объявлений для аналитики (analytics.py) по городу, комнатам и типу.
+    # Меняются в той же транзакции, что создание и удаление объявлений
+    __tablename__ = "listing_rollups"
+
+    city = Column(String, primary_key=True)  # "" — город не указан
+    rooms = Column(Integer, primary_key=True)
+    type = Column(String, primary_key=True)
+    month = Column(Date, primary_key=True)  # первое число месяца created_at (UTC)
+
+    count = Column(Integer, nullable=False, default=0)
+    # Для средних: сколько объявлений со значением метрики и сумма значений
+    price_count = Column(Integer, nullable=False, default=0)
+    price_sum = Column(Float, nullable=False, default=0)
+    price_per_m2_count = Column(Integer, nullable=False, default=0)
+    price_per_m2_sum = Column(Float, nullable=False, default=0)
+    deposit_count = Column(Integer, nullable=False, default=0)
+    deposit_sum = Column(Float, nullable=False, default=0)
+    commission_percent_count = Column(Integer, nullable=False, default=0)
+    commission_percent_sum = Column(Float, nullable=False, default=0)
+    # Скетчи квантилей (analytics.Sketch): int32 [нули, первая корзина, счетчики корзин...]
+    price_sketch = Column(LargeBinary, nullable=True)
+    price_per_m2_sketch = Column(LargeBinary, nullable=True)
+    deposit_sketch = Column(LargeBinary, nullable=True)
+
 class Like(Base):
     __tablename__ = "listing_likes"
 
     id = Column(Integer, primary_key=True, index=True)
     listing_id = Column(Integer, ForeignKey("listings.id", ondelete="CASCADE"))
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
\ No newline at end of file
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+
+    __table_args__ = (
+        UniqueConstraint("listing_id", "user_id", name="uq_listing_likes_listing_id_user_id"),
+        Index("ix_listing_likes_user_id_listing_id", "user_id", "listing_id"),
+    )
+
+
+# Полнотекстовый поиск (PostgreSQL): GIN-индекс по выражению tsvector.
+# Конфигурация и пустые строки — литералы, а не параметры, чтобы выражение в запросе
+# совпадало с индексным и планировщик мог использовать индекс
+SEARCH_TS_CONFIG = literal_column("'russian'")
+
+
+def _weighted(column, weight: str):
+    return func.setweight(
+        func.to_tsvector(SEARCH_TS_CONFIG, func.coalesce(column, literal_column("''"))),
+        literal_column(f"'{weight}'"),
+    )
+
+
+listing_search_document = (
+    _weighted(Listing.title, "A")
+    .op("||")(_weighted(Listing.address_city, "B"))
+    .op("||")(_weighted(Listing.address_street, "B"))
+    .op("||")(_weighted(Listing.description, "C"))
+)
+
+Listing.__table__.append_constraint(
+    Index("ix_listings_search_document", listing_search_document, postgresql_using="gin").ddl_if(dialect="postgresql")
+)
+
+# Нечеткий поиск по городу, улице и имени владельца — триграммные индексы pg_trgm
+for _table, _column in ((Listing, "address_city"), (Listing, "address_street"), (User, "name")):
+    Index(
+        f"ix_{_table.__tablename__}_{_column}_trgm",
+        getattr(_table, _column),
+        postgresql_using="gin",
+        postgresql_ops={_column: "gin_trgm_ops"},
+    ).ddl_if(dialect="postgresql")
+
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+# Запасной вариант для SQLite: FTS5-таблица с внешним содержимым, синхронизируется триггерами
+_FTS_COLUMNS = "title, description, address_city, address_street"
+_FTS_NEW = "new.id, new.title, new.description, new.address_city, new.address_street"
+_FTS_OLD = "'delete', old.id, old.title, old.description, old.address_city, old.address_street"
+
+for _statement in (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5({_FTS_COLUMNS}, "
+    f"content='listings', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings BEGIN "
+    f"INSERT INTO listings_fts(rowid, {_FTS_COLUMNS}) VALUES ({_FTS_NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings BEGIN "
+    f"INSERT INTO listings_fts(listings_fts, rowid, {_FTS_COLUMNS}) VALUES ({_FTS_OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS listings_fts_au AFTER UPDATE OF {_FTS_COLUMNS} ON listings BEGIN "
+    f"INSERT INTO listings_fts(listings_fts, rowid, {_FTS_COLUMNS}) VALUES ({_FTS_OLD}); "
+    f"INSERT INTO listings_fts(rowid, {_FTS_COLUMNS}) VALUES ({_FTS_NEW}); END",
+):
+    event.listen(Listing.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+# image_base следует за image_path у объектов ORM; массовые INSERT передают его сами
+def _set_image_base(target, value, oldvalue, initiator):
+    target.image_base = rendition_base(value) if value else None
+
+
+for _model in (User, ListingPhoto):
+    event.listen(_model.image_path, "set", _set_image_base)
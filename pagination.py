@@ -0,0 +1,31 @@
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(created_at: datetime, listing_id: int):
+    payload = json.dumps([created_at.isoformat(), listing_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, listing_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(listing_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def encode_rank_cursor(rank: float, listing_id: int):
+    payload = json.dumps([rank, listing_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, listing_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), int(listing_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
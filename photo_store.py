@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from images import existing_renditions, set_renditions
+
+# Хранилище фото с адресацией по содержимому: файл называется sha256 содержимого и лежит
+# в PHOTO_STORE_DIR/ab/cd/abcd...ext. Два уровня по 256 каталогов держат каталоги маленькими
+# и при миллионах файлов, одинаковые загрузки занимают место один раз
+PHOTO_STORE_DIR = os.getenv("PHOTO_STORE_DIR", "static/photos")
+PHOTO_UPLOAD_CHUNK = int(os.getenv("PHOTO_UPLOAD_CHUNK", 1024 * 1024))
+PHOTO_UPLOAD_MAX_BYTES = int(os.getenv("PHOTO_UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+# Файлы, которые трогали последние PHOTO_ORPHAN_GRACE_SECONDS секунд, не удаляются:
+# их могла только что переиспользовать параллельная загрузка того же содержимого
+PHOTO_ORPHAN_GRACE_SECONDS = int(os.getenv("PHOTO_ORPHAN_GRACE_SECONDS", 600))
+
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+DEFAULT_EXTENSION = ".jpg"
+
+
+class PhotoTooLarge(Exception):
+    pass
+
+
+def normalize_extension(filename: str | None):
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if extension in PHOTO_EXTENSIONS else DEFAULT_EXTENSION
+
+
+def sniff_extension(head: bytes, fallback: str):
+    # Расширение по сигнатуре файла: одинаковое содержимое всегда получает одно имя
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return fallback
+
+
+class PhotoStore:
+    def __init__(self, root: str, chunk_size: int, max_bytes: int):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+
+    def path_for(self, digest: str, extension: str):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + extension)
+
+    def save(self, source, extension: str):
+        # Копирует файловый объект кусками во временный файл, считая sha256 по ходу,
+        # и атомарно переносит его на место. Возвращает (путь, создан ли новый файл)
+        temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp:
+            try:
+                while chunk := source.read(self.chunk_size):
+                    if not size:
+                        head = chunk[:16]
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise PhotoTooLarge(size)
+                    digest.update(chunk)
+                    temp.write(chunk)
+            except BaseException:
+                temp.close()
+                os.unlink(temp.name)
+                raise
+
+        path = self.path_for(digest.hexdigest(), sniff_extension(head, extension))
+        if os.path.exists(path):
+            # Такое содержимое уже есть: mtime обновляется, чтобы уборка сирот его не тронула
+            os.unlink(temp.name)
+            os.utime(path)
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp.name, path)
+        return path, True
+
+    def attach(self, obj, source, extension: str):
+        # Сохраняет исходник в image_path у ListingPhoto или User. Если то же содержимое уже
+        # обработано, копии подставляются сразу (True), иначе нужна задача обработки (False)
+        path, created = self.save(source, extension)
+        obj.image_path = path
+        renditions = None if created else existing_renditions(path)
+        set_renditions(obj, renditions or {})
+        return renditions is not None
+
+    def contains(self, path: str):
+        # Путь указывает внутрь хранилища (с учетом .. и символических ссылок)
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(path)
+        return path != root and os.path.commonpath([root, path]) == root
+
+    def remove(self, base: str):
+        # Удаляет исходник и все копии (файлы с общей частью имени base, см. rendition_base),
+        # если ни один из них давно не трогали. Вне хранилища ничего не удаляется
+        if not self.contains(base):
+            return False
+        directory, stem = os.path.split(os.path.realpath(base))
+        try:
+            entries = [
+                entry for entry in os.scandir(directory)
+                if entry.name.startswith(stem) and entry.name[len(stem):len(stem) + 1] in (".", "_")
+            ]
+        except FileNotFoundError:
+            return True
+        cutoff = time.time() - PHOTO_ORPHAN_GRACE_SECONDS
+        if any(entry.stat().st_mtime > cutoff for entry in entries):
+            return False
+        for entry in entries:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def iter_shards(self):
+        # Каталоги первого уровня: по ним удобно обходить хранилище порциями
+        if not os.path.isdir(self.root):
+            return
+        for name in sorted(os.listdir(self.root)):
+            if len(name) == 2 and os.path.isdir(os.path.join(self.root, name)):
+                yield os.path.join(self.root, name)
+
+    def clear_temp(self):
+        # Недописанные загрузки, оставшиеся после падения процесса
+        temp_dir = os.path.join(self.root, "tmp")
+        if os.path.isdir(temp_dir):
+            cutoff = time.time() - PHOTO_ORPHAN_GRACE_SECONDS
+            for entry in os.scandir(temp_dir):
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+
+
+photo_store = PhotoStore(PHOTO_STORE_DIR, PHOTO_UPLOAD_CHUNK, PHOTO_UPLOAD_MAX_BYTES)
@@ -0,0 +1,91 @@
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from metrics import record_file_read
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+
+def accepts_webp(request: Request):
+    return "image/webp" in request.headers.get("accept", "")
+
+
+def photo_path(obj, size: str, webp: bool = False):
+    # obj — ListingPhoto или User; если уменьшенной копии нет (фото еще обрабатывается), отдаем оригинал
+    if size == "thumb":
+        path = (webp and obj.thumbnail_webp_path) or obj.thumbnail_path
+    elif size == "medium":
+        path = (webp and obj.medium_webp_path) or obj.medium_path
+    else:
+        path = None
+    return path or obj.image_path
+
+
+def listing_photo_url(photo_id: int | None, size: str = "thumb"):
+    if photo_id is None:
+        return None
+    return f"/listing-photos/{photo_id}?size={size}"
+
+
+def user_photo_url(user_id: int, size: str = "thumb"):
+    return f"/user-photos/{user_id}?size={size}"
+
+
+def make_etag(stat_result: os.stat_result):
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def if_none_match_tags(request: Request):
+    # Для If-None-Match используется слабое сравнение (RFC 9110, 13.1.2)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return frozenset()
+    return frozenset(tag.strip().removeprefix("W/") for tag in if_none_match.split(",") if tag.strip())
+
+
+def is_not_modified(request: Request, etag: str, stat_result: os.stat_result):
+    tags = if_none_match_tags(request)
+    if tags:
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+
+    return False
+
+
+def photo_response(request: Request, path: str | None, immutable: bool = False):
+    # Отдает файл как есть: ETag, Last-Modified, 304 на условные запросы,
+    # Range/If-Range обрабатывает сам FileResponse
+    try:
+        stat_result = os.stat(path) if path else None
+    except OSError:
+        stat_result = None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Image file not found")
+
+    etag = make_etag(stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        # thumb/medium бывают в WebP для клиентов с Accept: image/webp
+        "vary": "Accept",
+    }
+
+    if is_not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    record_file_read(stat_result.st_size)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
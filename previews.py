@@ -0,0 +1,82 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import get_listing_details, get_preview_data
+from file_io import run_file_io
+from image_cache import image_cache
+from models import Listing
+from photos import listing_photo_url
+from schemas import ListingBatch, ListingPreview, PreviewOptions
+
+
+def encode_images(image_paths: list[str | None]):
+    return [image_cache.get_base64(image_path) for image_path in image_paths]
+
+
+async def load_preview_rows(db: AsyncSession, listings: list[Listing], options: PreviewOptions):
+    # Все, что нужно из базы для превью страницы, — фиксированным набором запросов,
+    # без ленивой загрузки photos/liked_by_users и запроса владельца на каждую строку
+    owner_names, first_photos, liked_ids = await get_preview_data(db, listings, options.likers)
+    rows = []
+    for listing in listings:
+        photo_id, image_path = first_photos.get(listing.id, (None, None))
+        rows.append(dict(
+            id=listing.id,
+            title=listing.title,
+            price=listing.price,
+            owner_name=owner_names.get(listing.user_id, ""),
+            image_path=image_path,
+            image_url=listing_photo_url(photo_id),
+            like_count=listing.like_count,
+            liked_by_users=liked_ids.get(listing.id, []),
+        ))
+    return rows
+
+
+async def iter_preview_chunks(rows: list[dict], options: PreviewOptions, chunk_size: int):
+    # Превью отдаются пачками по chunk_size: картинки пачки читаются одним заходом
+    # в пул потоков, и в памяти одновременно только одна пачка base64
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        images = [None] * len(chunk)
+        if options.inline_images:
+            images = await run_file_io(encode_images, [row["image_path"] for row in chunk])
+        yield [
+            {**{key: value for key, value in row.items() if key != "image_path"}, "image_base64": image_base64}
+            for row, image_base64 in zip(chunk, images)
+        ]
+
+
+async def build_listing_previews(db: AsyncSession, listings: list[Listing], options: PreviewOptions):
+    rows = await load_preview_rows(db, listings, options)
+    previews = []
+    async for chunk in iter_preview_chunks(rows, options, chunk_size=max(len(rows), 1)):
+        previews.extend(ListingPreview(**fields) for fields in chunk)
+    return previews
+
+
+async def build_listing_details(db: AsyncSession, listing_ids: list[int], fields: set[str]):
+    # Пачка карточек в порядке listing_ids. Картинки читаются одним заходом в пул потоков
+    # и только если запрошен image_base64. Возвращает (ListingBatch, версии для кэша)
+    rows, first_photos, liked_ids = await get_listing_details(db, listing_ids, fields)
+    found = [listing_id for listing_id in listing_ids if listing_id in rows]
+
+    images = {}
+    if "image_base64" in fields:
+        image_paths = [first_photos.get(listing_id, (None, None))[1] for listing_id in found]
+        images = dict(zip(found, await run_file_io(encode_images, image_paths)))
+
+    items = []
+    versions = {}
+    for listing_id in found:
+        row = rows[listing_id]
+        versions[str(listing_id)] = row.pop("version")
+        if "image_url" in fields:
+            row["image_url"] = listing_photo_url(first_photos.get(listing_id, (None, None))[0], "medium")
+        if "image_base64" in fields:
+            row["image_base64"] = images[listing_id]
+        if "liked_user_ids" in fields:
+            row["liked_user_ids"] = liked_ids.get(listing_id, [])
+        items.append(row)
+
+    missing = [listing_id for listing_id in listing_ids if listing_id not in rows]
+    return ListingBatch(items=items, missing=missing), versions
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import get_cache_versions, get_listing_versions
+
+# Пусто — кэш в памяти воркера, redis://... — общий кэш в Redis (или совместимом сервере)
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Валидаторы (ETag и версии без тела) живут дольше самих ответов: 304 не требует хранить тело
+RESPONSE_CACHE_VALIDATOR_TTL = int(os.getenv("RESPONSE_CACHE_VALIDATOR_TTL", 24 * 3600))
+VALIDATOR_PREFIX = "etag:"
+
+
+class MemoryCacheBackend:
+    # LRU в памяти процесса с ограничением по байтам и TTL на запись
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+class RedisCacheBackend:
+    # Вытеснение по размеру — на стороне сервера (maxmemory + allkeys-lru)
+    def __init__(self, url: str, prefix: str = "response:"):
+        from redis import asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(self.prefix + key, value, ex=ttl)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class ResponseCache:
+    # Запись хранит версии, прочитанные до построения ответа: счетчики из cache_versions
+    # и версии попавших в ответ объявлений. Запись отдается, только если все они
+    # совпадают с текущими, так что после записи в базу старый ответ не вернется.
+    # ETag — хэш ключа и тех же версий, тело для него не нужно: клиенту с актуальным
+    # ETag отвечаем 304 по отдельной записи-валидатору, не читая и не строя ответ
+    def __init__(self, backend, ttl: int, validator_ttl: int = RESPONSE_CACHE_VALIDATOR_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.validator_ttl = validator_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.not_modified = 0
+        self.rebuild_seconds = 0.0
+
+    async def get_or_build(self, db: AsyncSession, key: str, scopes: list[str], build, if_none_match=frozenset()):
+        # -> (etag, тело); тело None — у клиента актуальная версия (if_none_match — теги из If-None-Match)
+        versions = await get_cache_versions(db, scopes) if scopes else {}
+
+        if if_none_match:
+            raw = await self.backend.get(VALIDATOR_PREFIX + key)
+            if raw is not None:
+                entry = json.loads(raw)
+                if etag_matches(entry.get("etag"), if_none_match) and entry["versions"] == versions \
+                        and await self._listings_current(db, entry["listings"]):
+                    self.not_modified += 1
+                    return entry["etag"], None
+
+        raw = await self.backend.get(key)
+        if raw is not None:
+            header, body = raw.split(b"\n", 1)
+            entry = json.loads(header)
+            # Записи, сохраненные до появления ETag, пересобираются
+            if "etag" in entry and entry["versions"] == versions \
+                    and await self._listings_current(db, entry["listings"]):
+                self.hits += 1
+                return entry["etag"], None if etag_matches(entry["etag"], if_none_match) else body
+            self.stale += 1
+        else:
+            self.misses += 1
+
+        started = time.perf_counter()
+        response, listing_versions = await build()
+        body = response.model_dump_json().encode()
+        self.rebuild_seconds += time.perf_counter() - started
+
+        etag = make_etag(key, versions, listing_versions)
+        header = json.dumps({"versions": versions, "listings": listing_versions, "etag": etag}).encode()
+        await self.backend.set(key, header + b"\n" + body, self.ttl)
+        await self.backend.set(VALIDATOR_PREFIX + key, header, self.validator_ttl)
+        if etag_matches(etag, if_none_match):
+            # Ответ пересобран (тело вытеснено), но данные не менялись — клиенту все равно 304
+            self.not_modified += 1
+            return etag, None
+        return etag, body
+
+    async def _listings_current(self, db: AsyncSession, listing_versions: dict[str, int]):
+        if not listing_versions:
+            return True
+        return await get_listing_versions(db, [int(listing_id) for listing_id in listing_versions]) == listing_versions
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.stale
+        rebuilds = self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "avg_rebuild_ms": self.rebuild_seconds * 1000 / rebuilds if rebuilds else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def make_etag(key: str, versions: dict[str, int], listing_versions: dict[str, int]):
+    # Сильный ETag из версий данных: меняется с любой записью, которая сбросила бы кэш
+    payload = json.dumps([key, versions, listing_versions], sort_keys=True).encode()
+    return f'"{hashlib.blake2b(payload, digest_size=12).hexdigest()}"'
+
+
+def etag_matches(etag: str | None, tags):
+    return etag is not None and (etag in tags or "*" in tags)
+
+
+def listing_versions(listings):
+    # Версии объявлений берутся из тех же строк, из которых строится ответ
+    return {str(listing.id): listing.version for listing in listings}
+
+
+response_cache = ResponseCache(
+    RedisCacheBackend(RESPONSE_CACHE_URL) if RESPONSE_CACHE_URL else MemoryCacheBackend(RESPONSE_CACHE_MAX_BYTES),
+    RESPONSE_CACHE_TTL,
+)
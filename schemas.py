@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
@@ -10,8 +10,59 @@ class ListingPreview(BaseModel):
     price: int
     owner_name: str
     image_base64: str | None
+    image_url: str | None = None
+    like_count: int = 0
     liked_by_users: list[int] = []
 
+class PreviewOptions(BaseModel):
+    inline_images: bool = True
+    likers: bool = True  # без id лайкнувших остается только like_count
+
+class ListingPage(BaseModel):
+    items: list[ListingPreview]
+    next_cursor: str | None = None
+
+class ListingSearch(BaseModel):
+    q: str | None = None  # полнотекстовый запрос по заголовку, адресу и описанию
+    city: str | None = None
+    street: str | None = None
+    owner: str | None = None
+    min_price: int | None = None
+    max_price: int | None = None
+
+    # О квартире
+    rooms: list[int] | None = None
+    min_total_area: float | None = None
+    max_total_area: float | None = None
+    min_kitchen_area: float | None = None
+    max_kitchen_area: float | None = None
+    min_floor: int | None = None
+    max_floor: int | None = None
+    type: str | None = None
+
+    # Правила
+    allowed_children: bool | None = None
+    allowed_pets: bool | None = None
+    allowed_smoking: bool | None = None
+
+class FacetCount(BaseModel):
+    value: str | int
+    count: int
+
+class PriceBucketCount(BaseModel):
+    min_price: int | None
+    max_price: int | None
+    count: int
+
+class ListingFacets(BaseModel):
+    total: int = 0
+    rooms: list[FacetCount] = []
+    price: list[PriceBucketCount] = []
+    city: list[FacetCount] = []
+
+class ListingSearchPage(ListingPage):
+    facets: ListingFacets
+
 class ListingBase(BaseModel):
     title: str
     price: int
@@ -60,11 +111,44 @@ class ListingRead(ListingBase):
     owner_email: str
     owner_phone: str
     image_base64: str | None = None
+    image_url: str | None = None
+    like_count: int = 0
     liked_user_ids: list[int] = []
 
     class Config:
         orm_mode = True
 
+class MarketMetric(BaseModel):
+    count: int  # объявлений, у которых есть значение
+    avg: float | None
+    quantiles: dict[str, float | None] = {}  # {"p50": ...}, приближенно (ANALYTICS_SKETCH_ACCURACY)
+
+class MarketStatsGroup(BaseModel):
+    # Поля группировки заполнены, только если указаны в group_by
+    city: str | None = None
+    rooms: int | None = None
+    type: str | None = None
+    month: date | None = None
+    count: int
+    price: MarketMetric
+    price_per_m2: MarketMetric
+    deposit: MarketMetric
+    commission_percent: MarketMetric
+
+class MarketStats(BaseModel):
+    groups: list[MarketStatsGroup]
+    relative_accuracy: float
+
+class ListingBatch(BaseModel):
+    # Записи в форме ListingRead с id; при fields= — только запрошенные поля
+    items: list[dict]
+    missing: list[int] = []
+
+class LikeBatch(BaseModel):
+    user_id: int
+    like: list[int] = []
+    unlike: list[int] = []
+
 class UserCreate(BaseModel):
     name: str
     email: EmailStr
@@ -82,6 +166,7 @@ class UserLoginResponse(BaseModel):
     phone: Optional[str] = None
     created_at: datetime
     photo_base64: str | None = None
+    photo_url: str | None = None
 
 class UserOut(BaseModel):
     id: int
@@ -0,0 +1,177 @@
+import re
+
+from sqlalchemy import String, case, cast, column, func, literal_column, null, or_, select, table, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Listing, User, listing_search_document, SEARCH_TS_CONFIG
+from schemas import ListingSearch, ListingFacets, FacetCount, PriceBucketCount
+
+
+def like_pattern(value: str):
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class LikeSearchBackend:
+    # Запасной вариант для СУБД без полнотекстового поиска: ILIKE без ранжирования
+    def match_text(self, query, text: str):
+        pattern = like_pattern(text)
+        return query.where(or_(
+            Listing.title.ilike(pattern, escape="\\"),
+            Listing.description.ilike(pattern, escape="\\"),
+            Listing.address_city.ilike(pattern, escape="\\"),
+            Listing.address_street.ilike(pattern, escape="\\"),
+        )), None
+
+    def fuzzy(self, column_, value: str):
+        return column_.ilike(like_pattern(value), escape="\\")
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    # tsvector + GIN для текста, pg_trgm для нечеткого совпадения города, улицы и имени.
+    # ILIKE '%...%' и оператор % оба обслуживаются триграммным GIN-индексом
+    def match_text(self, query, text: str):
+        ts_query = func.websearch_to_tsquery(SEARCH_TS_CONFIG, text)
+        rank = func.ts_rank_cd(listing_search_document, ts_query)
+        return query.where(listing_search_document.op("@@")(ts_query)), rank
+
+    def fuzzy(self, column_, value: str):
+        return or_(column_.ilike(like_pattern(value), escape="\\"), column_.op("%")(value))
+
+
+listings_fts = table("listings_fts", column("rowid"), column("rank"))
+
+
+class SqliteSearchBackend(LikeSearchBackend):
+    # FTS5: таблица listings_fts из models.py, rank — bm25 (меньше — лучше)
+    def match_text(self, query, text: str):
+        terms = re.findall(r"\w+", text)
+        if not terms:
+            return query, None
+        fts_query = " ".join('"{}"*'.format(term) for term in terms)
+        # MATCH вычисляется один раз в материализованном CTE: иначе планировщик SQLite
+        # может идти по другому индексу и повторять полнотекстовый поиск на каждой строке
+        matches = (
+            select(listings_fts.c.rowid.label("listing_id"), listings_fts.c.rank.label("rank"))
+            .where(literal_column("listings_fts").op("MATCH")(fts_query))
+            .cte("fts_matches")
+            .prefix_with("MATERIALIZED")
+        )
+        query = query.join(matches, matches.c.listing_id == Listing.id)
+        return query, -matches.c.rank
+
+
+search_backends = {
+    "postgresql": PostgresSearchBackend(),
+    "sqlite": SqliteSearchBackend(),
+}
+
+
+def register_search_backend(dialect_name: str, backend):
+    search_backends[dialect_name] = backend
+
+
+def get_search_backend(db: AsyncSession):
+    return search_backends.get(db.get_bind().dialect.name, LikeSearchBackend())
+
+
+def build_search_query(db: AsyncSession, search: ListingSearch):
+    # Все критерии объединяются через AND; rank есть только при текстовом запросе
+    backend = get_search_backend(db)
+    query = select(Listing)
+    rank = None
+
+    if search.q:
+        query, rank = backend.match_text(query, search.q)
+    if search.city:
+        query = query.where(backend.fuzzy(Listing.address_city, search.city))
+    if search.street:
+        query = query.where(backend.fuzzy(Listing.address_street, search.street))
+    if search.owner:
+        query = query.join(User, Listing.user_id == User.id).where(backend.fuzzy(User.name, search.owner))
+
+    if search.rooms:
+        query = query.where(Listing.rooms.in_(search.rooms))
+    if search.type:
+        query = query.where(Listing.type == search.type)
+
+    for column_, low, high in (
+        (Listing.price, search.min_price, search.max_price),
+        (Listing.total_area, search.min_total_area, search.max_total_area),
+        (Listing.kitchen_area, search.min_kitchen_area, search.max_kitchen_area),
+        (Listing.floor, search.min_floor, search.max_floor),
+    ):
+        if low is not None:
+            query = query.where(column_ >= low)
+        if high is not None:
+            query = query.where(column_ <= high)
+
+    for column_, allowed in (
+        (Listing.allowed_children, search.allowed_children),
+        (Listing.allowed_pets, search.allowed_pets),
+        (Listing.allowed_smoking, search.allowed_smoking),
+    ):
+        if allowed is not None:
+            query = query.where(column_.is_(allowed))
+
+    return query, rank
+
+
+# Границы ценовых корзин для фасета price: [0, 20000), [20000, 30000), ..., [150000, ∞)
+PRICE_BUCKETS = [20000, 30000, 40000, 50000, 70000, 100000, 150000]
+CITY_FACET_LIMIT = 20
+
+
+def price_bucket(price):
+    return case(
+        *[(price < edge, index) for index, edge in enumerate(PRICE_BUCKETS)],
+        else_=len(PRICE_BUCKETS),
+    )
+
+
+async def get_facets(db: AsyncSession, query):
+    # Все фасеты считаются одним запросом: отфильтрованная выборка — общий CTE,
+    # группировки по комнатам, ценовым корзинам и городу склеены через UNION ALL
+    filtered = query.with_only_columns(
+        Listing.rooms.label("rooms"),
+        price_bucket(Listing.price).label("price_bucket"),
+        Listing.address_city.label("city"),
+    ).cte("filtered").prefix_with("MATERIALIZED")
+
+    def facet(name: str, column_=None):
+        facet_query = select(
+            literal_column(f"'{name}'").label("facet"),
+            cast(column_ if column_ is not None else null(), String).label("value"),
+            func.count().label("count"),
+        ).select_from(filtered)
+        return facet_query if column_ is None else facet_query.group_by(column_)
+
+    rows = await db.execute(union_all(
+        facet("total"),
+        facet("rooms", filtered.c.rooms),
+        facet("price", filtered.c.price_bucket),
+        facet("city", filtered.c.city),
+    ))
+
+    facets = ListingFacets()
+    for name, value, count in rows:
+        if name == "total":
+            facets.total = count
+        elif value is None:
+            continue
+        elif name == "rooms":
+            facets.rooms.append(FacetCount(value=int(value), count=count))
+        elif name == "price":
+            index = int(value)
+            facets.price.append(PriceBucketCount(
+                min_price=PRICE_BUCKETS[index - 1] if index > 0 else None,
+                max_price=PRICE_BUCKETS[index] if index < len(PRICE_BUCKETS) else None,
+                count=count,
+            ))
+        elif name == "city":
+            facets.city.append(FacetCount(value=value, count=count))
+
+    facets.rooms.sort(key=lambda item: item.value)
+    facets.price.sort(key=lambda item: item.min_price or 0)
+    facets.city = sorted(facets.city, key=lambda item: -item.count)[:CITY_FACET_LIMIT]
+    return facets
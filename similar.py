@@ -0,0 +1,282 @@
+# Похожие объявления. Признаки всех объявлений лежат в памяти процесса матрицей numpy,
+# расстояние до выбранного считается одним векторным проходом, лучшие k — через argpartition.
+# Матрица загружается из базы один раз, при первом запросе, а дальше догоняется по событиям
+# listing_created/listing_deleted из feed_events — так видны и изменения других воркеров
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+import numpy as np
+from anyio import to_thread
+
+from crud import get_feed_events_since, get_listing_features, stream_listing_features
+from feed_hub import FEED_EVENTS_RETENTION_SECONDS, FEED_SETTLE_SECONDS
+
+SIMILAR_LOAD_BATCH = int(os.getenv("SIMILAR_LOAD_BATCH", 10000))
+# Расстояния считаются блоками по SIMILAR_BLOCK_ROWS строк: временные массивы блока
+# помещаются в кэш процессора, а не занимают размер всей матрицы
+SIMILAR_BLOCK_ROWS = int(os.getenv("SIMILAR_BLOCK_ROWS", 32768))
+
+# Признаки и их веса. Числовые признаки делятся на стандартное отклонение по всем объявлениям
+# (суммы ведутся при каждом изменении), цена и площадь — в логарифме
+FEATURES = ("price", "rooms", "total_area", "kitchen_area", "floor_ratio", "total_floors",
+            "allowed_children", "allowed_pets", "allowed_smoking")
+FEATURE_WEIGHTS = np.array([3.0, 2.0, 2.0, 0.5, 0.5, 0.5, 0.3, 0.3, 0.3])
+# Штрафы за другой тип жилья и другой город, в единицах взвешенного квадрата расстояния
+TYPE_MISMATCH_PENALTY = np.float32(4.0)
+CITY_MISMATCH_PENALTY = np.float32(25.0)
+# Расстояние до исключенных строк (удаленные, другой город при same_city) — в выдачу не попадают
+EXCLUDED = np.float32(1e30)
+
+SIMILAR_EVENT_KINDS = ("listing_created", "listing_deleted")
+
+
+class FeatureMatrix:
+    # Объявления упорядочены по id: новые дописываются в конец, удаленные помечаются
+    # и вычищаются, когда их становится больше четверти. Признаки хранятся по столбцам:
+    # расстояние считается проходами по непрерывным массивам одного признака
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.ids = np.empty(capacity, np.int64)
+        self.features = np.empty((len(FEATURES), capacity), np.float32)
+        self.types = np.empty(capacity, np.int32)
+        self.cities = np.empty(capacity, np.int32)
+        self.alive = np.zeros(capacity, bool)
+        self.dead = 0
+        self.codes = {"type": {}, "city": {}}
+        self._sum = np.zeros(len(FEATURES))
+        self._sumsq = np.zeros(len(FEATURES))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size - self.dead
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.ids, self.features, self.types, self.cities, self.alive))
+
+    def _code(self, category: str, value):
+        codes = self.codes[category]
+        return codes.setdefault(value, len(codes))
+
+    def _encode(self, rows):
+        # Строки LISTING_FEATURE_COLUMNS -> id, признаки, коды типа и города.
+        # Пропуски заполняются текущим средним
+        raw = np.array([row[1:10] for row in rows], dtype=np.float64).reshape(-1, 9)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            features = np.column_stack([
+                np.log1p(raw[:, 0]), raw[:, 1], np.log1p(raw[:, 2]), raw[:, 3],
+                np.where(raw[:, 5] > 0, raw[:, 4] / raw[:, 5], np.nan), raw[:, 5],
+                raw[:, 6], raw[:, 7], raw[:, 8],
+            ])
+        missing = ~np.isfinite(features)
+        if missing.any():
+            features[missing] = np.broadcast_to(self._mean(), features.shape)[missing]
+        ids = np.array([row[0] for row in rows], np.int64)
+        types = np.array([self._code("type", row[10]) for row in rows], np.int32)
+        cities = np.array([self._code("city", row[11]) for row in rows], np.int32)
+        return ids, features, types, cities
+
+    def _mean(self):
+        count = len(self)
+        return self._sum / count if count else np.zeros(len(FEATURES))
+
+    def _weights(self):
+        count = len(self)
+        if count < 2:
+            return FEATURE_WEIGHTS.astype(np.float32)
+        variance = self._sumsq / count - (self._sum / count) ** 2
+        variance[variance < 1e-9] = 1.0
+        return (FEATURE_WEIGHTS / variance).astype(np.float32)
+
+    def _count(self, features, sign: int):
+        self._sum += sign * features.sum(axis=0, dtype=np.float64)
+        self._sumsq += sign * np.square(features, dtype=np.float64).sum(axis=0)
+
+    def _positions(self, ids):
+        positions = np.searchsorted(self.ids[:self.size], ids)
+        positions[positions >= self.size] = 0
+        found = self.ids[positions] == ids if self.size else np.zeros(len(ids), bool)
+        return positions, found
+
+    def _grow(self, size: int):
+        capacity = len(self.ids)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name in ("ids", "types", "cities", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        features = np.zeros((len(FEATURES), capacity), np.float32)
+        features[:, :self.size] = self.features[:, :self.size]
+        self.features = features
+
+    def _reorder(self, order):
+        # order — номера строк, которые встают на первые len(order) мест
+        count = len(order)
+        for name in ("ids", "types", "cities", "alive"):
+            array = getattr(self, name)
+            array[:count] = array[order]
+        self.features[:, :count] = self.features[:, order]
+
+    def upsert(self, rows):
+        # Новые и измененные объявления. Повтор той же строки ничего не меняет
+        if not rows:
+            return
+        ids, features, types, cities = self._encode(rows)
+        with self._lock:
+            positions, found = self._positions(ids)
+            if found.any():
+                existing = positions[found]
+                was_alive = self.alive[existing]
+                self._count(self.features[:, existing[was_alive]].T, -1)
+                self.dead -= int((~was_alive).sum())
+                self.features[:, existing] = features[found].T
+                self.types[existing] = types[found]
+                self.cities[existing] = cities[found]
+                self.alive[existing] = True
+                self._count(features[found], 1)
+            new = ~found
+            if new.any():
+                self._append(ids[new], features[new], types[new], cities[new])
+
+    def _append(self, ids, features, types, cities):
+        order = np.argsort(ids, kind="stable")
+        ids, features, types, cities = ids[order], features[order], types[order], cities[order]
+        start, end = self.size, self.size + len(ids)
+        self._grow(end)
+        self.ids[start:end] = ids
+        self.features[:, start:end] = features.T
+        self.types[start:end] = types
+        self.cities[start:end] = cities
+        self.alive[start:end] = True
+        self.size = end
+        self._count(features, 1)
+        if start and ids[0] < self.ids[start - 1]:
+            # Транзакция с меньшим id закоммитилась позже — редкий случай, строки пересортировываются
+            self._reorder(np.argsort(self.ids[:end], kind="stable"))
+
+    def remove(self, ids):
+        if not len(ids):
+            return
+        with self._lock:
+            positions, found = self._positions(np.asarray(ids, np.int64))
+            positions = positions[found]
+            positions = positions[self.alive[positions]]
+            self.alive[positions] = False
+            self.dead += len(positions)
+            self._count(self.features[:, positions].T, -1)
+            if self.dead * 4 > self.size:
+                self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        self._reorder(keep)
+        self.alive[len(keep):self.size] = False
+        self.size = len(keep)
+        self.dead = 0
+
+    def nearest(self, listing_id: int, limit: int, same_city: bool):
+        # id ближайших объявлений по возрастанию расстояния; None — объявления нет в матрице
+        with self._lock:
+            positions, found = self._positions(np.array([listing_id], np.int64))
+            position = int(positions[0])
+            if not found[0] or not self.alive[position]:
+                return None
+            target = self.features[:, position].copy()
+            type_code = self.types[position]
+            city_code = self.cities[position]
+            weights = self._weights()
+            city_penalty = EXCLUDED if same_city else CITY_MISMATCH_PENALTY
+            distances = np.zeros(self.size, np.float32)
+            buffer = np.empty(min(SIMILAR_BLOCK_ROWS, self.size), np.float32)
+            for start in range(0, self.size, SIMILAR_BLOCK_ROWS):
+                stop = min(start + SIMILAR_BLOCK_ROWS, self.size)
+                block = distances[start:stop]
+                diff = buffer[:stop - start]
+                for column, value, weight in zip(self.features[:, start:stop], target, weights):
+                    np.subtract(column, value, out=diff)
+                    np.square(diff, out=diff)
+                    diff *= weight
+                    block += diff
+                # Штрафы прибавляются умножением маски: запись по маске вразнобой в разы медленнее
+                np.multiply(self.types[start:stop] != type_code, TYPE_MISMATCH_PENALTY, out=diff)
+                block += diff
+                np.multiply(self.cities[start:stop] != city_code, city_penalty, out=diff)
+                block += diff
+            np.copyto(distances, EXCLUDED, where=~self.alive[:self.size])
+            distances[position] = EXCLUDED
+
+            limit = min(limit, self.size)
+            top = np.argpartition(distances, limit - 1)[:limit]
+            top = top[np.argsort(distances[top], kind="stable")]
+            return self.ids[top[distances[top] < EXCLUDED]].tolist()
+
+
+class SimilarListings:
+    def __init__(self):
+        self.matrix = None
+        self._since = None
+        self._synced_at = 0.0
+        self._sync_started = 0.0
+        self._applied = {}
+        self._sync_lock = asyncio.Lock()
+
+    async def nearest(self, db, listing_id: int, limit: int, same_city: bool = True):
+        await self.sync(db)
+        return await to_thread.run_sync(self.matrix.nearest, listing_id, limit, same_city)
+
+    async def sync(self, db):
+        # Перед каждым ранжированием матрица догоняет базу одним запросом к feed_events.
+        # Одновременные запросы ждут одну общую синхронизацию
+        requested = time.monotonic()
+        async with self._sync_lock:
+            if self._sync_started >= requested:
+                return
+            self._sync_started = time.monotonic()
+            # События старше FEED_EVENTS_RETENTION_SECONDS удаляются: после долгого простоя — заново
+            if self.matrix is None or self._sync_started - self._synced_at > FEED_EVENTS_RETENTION_SECONDS / 2:
+                await self.load(db)
+            else:
+                await self.catch_up(db)
+            self._synced_at = self._sync_started
+
+    async def load(self, db):
+        started = datetime.now(UTC)
+        matrix = FeatureMatrix()
+        async for rows in stream_listing_features(db, SIMILAR_LOAD_BATCH):
+            await to_thread.run_sync(matrix.upsert, rows)
+        self.matrix = matrix
+        self._since = started - timedelta(seconds=FEED_SETTLE_SECONDS)
+        self._applied = {}
+        # Объявления, созданные во время загрузки, придут событиями
+        await self.catch_up(db)
+
+    async def catch_up(self, db):
+        # Как и в feed_hub, последние FEED_SETTLE_SECONDS перечитываются, примененные события пропускаются.
+        # Для объявления важно только последнее событие: удаленное остается удаленным
+        started = datetime.now(UTC)
+        events = await get_feed_events_since(db, self._since, SIMILAR_EVENT_KINDS)
+        now = time.monotonic()
+        latest = {}
+        for feed_event in events:
+            if feed_event.id not in self._applied:
+                self._applied[feed_event.id] = now
+                latest[feed_event.listing_id] = feed_event.kind
+        created = [listing_id for listing_id, kind in latest.items() if kind == "listing_created"]
+        rows = await get_listing_features(db, created) if created else []
+        # Запись ждет блокировку, пока в потоке идет ранжирование (nearest): тоже в потоке,
+        # чтобы не останавливать event loop
+        await to_thread.run_sync(self.matrix.upsert, rows)
+        await to_thread.run_sync(self.matrix.remove, list(latest.keys() - {row[0] for row in rows}))
+
+        self._since = started - timedelta(seconds=FEED_SETTLE_SECONDS)
+        cutoff = now - FEED_SETTLE_SECONDS * 2
+        self._applied = {event_id: seen for event_id, seen in self._applied.items() if seen >= cutoff}
+
+
+similar_listings = SimilarListings()
@@ -0,0 +1,37 @@
+import os
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+# Сколько превью сериализуется и отправляется за один шаг потоковой ленты
+PREVIEW_STREAM_CHUNK = int(os.getenv("PREVIEW_STREAM_CHUNK", 10))
+
+STREAM_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+async def json_page_stream(chunks, next_cursor: str | None):
+    # Тот же формат, что у ListingPage: {"items": [...], "next_cursor": ...}
+    yield b'{"items":['
+    separator = b""
+    async for chunk in chunks:
+        if chunk:
+            yield separator + b",".join(orjson.dumps(item) for item in chunk)
+            separator = b","
+    yield b'],"next_cursor":' + orjson.dumps(next_cursor) + b"}"
+
+
+async def ndjson_page_stream(chunks):
+    async for chunk in chunks:
+        if chunk:
+            yield b"".join(orjson.dumps(item) + b"\n" for item in chunk)
+
+
+def listing_page_stream(chunks, next_cursor: str | None, stream_format: str):
+    # Курсор следующей страницы известен заранее и дублируется в заголовке:
+    # в NDJSON ему больше негде быть
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    body = json_page_stream(chunks, next_cursor) if stream_format == "json" else ndjson_page_stream(chunks)
+    return StreamingResponse(body, media_type=STREAM_MEDIA_TYPES[stream_format], headers=headers)
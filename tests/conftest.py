@@ -0,0 +1,33 @@
+# Тесты идут на отдельной базе: по умолчанию временный файл SQLite (aiosqlite),
+# TEST_DATABASE_URL — своя база, например PostgreSQL. Схема — миграциями, данные — из benchmarks.datagen
+import os
+import sys
+import tempfile
+
+import pytest
+from alembic import command
+from alembic.config import Config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TEST_DIR = tempfile.mkdtemp(prefix="listings-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+
+USERS = 20
+LISTINGS = 100
+LIKES = 400
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from benchmarks.datagen import insert_likes, insert_listing_photos, insert_listings, insert_users
+    from db import engine
+
+    command.upgrade(Config(os.path.join(ROOT, "alembic.ini")), "head")
+    user_ids = insert_users(engine, USERS, "not-a-hash")
+    insert_listings(engine, LISTINGS, user_ids=user_ids)
+    # Файлы фото не нужны: тесты не читают картинки
+    insert_listing_photos(engine, [{"image_path": os.path.join(TEST_DIR, "photo.jpg")}], per_listing=2)
+    insert_likes(engine, LIKES, user_ids)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from crud import get_listings
+from db import AsyncSessionLocal, async_engine
+from previews import build_listing_previews
+from schemas import PreviewOptions
+
+
+def page_queries(limit: int, options: PreviewOptions):
+    # Страница ленты целиком: выборка объявлений и данные превью. -> (число превью, число SQL-запросов)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            listings, _ = await get_listings(db, limit=limit)
+            return await build_listing_previews(db, listings, options)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        previews = asyncio.run(run())
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+        asyncio.run(async_engine.dispose())
+    return len(previews), len(statements)
+
+
+@pytest.mark.parametrize("likers", [True, False])
+def test_preview_queries_do_not_depend_on_page_size(likers):
+    options = PreviewOptions(inline_images=False, likers=likers)
+    small, small_queries = page_queries(1, options)
+    large, large_queries = page_queries(50, options)
+    assert (small, large) == (1, 50)
+    assert small_queries == large_queries
+
+
+def test_preview_fields():
+    async def run():
+        async with AsyncSessionLocal() as db:
+            listings, _ = await get_listings(db, limit=20)
+            return listings, await build_listing_previews(db, listings, PreviewOptions(inline_images=False))
+
+    listings, previews = asyncio.run(run())
+    asyncio.run(async_engine.dispose())
+    assert [preview.id for preview in previews] == [listing.id for listing in listings]
+    for listing, preview in zip(listings, previews):
+        assert preview.like_count == listing.like_count == len(preview.liked_by_users)
+        assert preview.owner_name.startswith("user_")
+        assert preview.image_url is not None
+        assert preview.image_base64 is None
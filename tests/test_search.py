@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from crud import get_listings
+from db import AsyncSessionLocal, async_engine, engine
+from schemas import ListingSearch
+from search import build_search_query
+
+SEARCHES = [
+    ListingSearch(q="квартира"),
+    ListingSearch(q="светлая балкон", city="Москва", rooms=[1, 2], max_price=80000),
+]
+
+
+def search_plan(search: ListingSearch):
+    # План того запроса, который get_listings выполняет для поиска: текст SQL и параметры
+    # перехватываются при выполнении и повторяются через EXPLAIN QUERY PLAN
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            query, rank = build_search_query(db, search)
+            event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+            try:
+                listings, _ = await get_listings(db, limit=20, query=query, rank=rank)
+            finally:
+                event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+            statement, parameters = captured[0]
+            connection = await db.connection()
+            plan = await connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            return listings, [row[3] for row in plan]
+
+    try:
+        return asyncio.run(run())
+    finally:
+        asyncio.run(async_engine.dispose())
+
+
+@pytest.mark.skipif(engine.dialect.name != "sqlite", reason="EXPLAIN QUERY PLAN is SQLite-specific")
+@pytest.mark.parametrize("search", SEARCHES)
+def test_text_search_uses_fts_index(search):
+    listings, plan = search_plan(search)
+    assert listings
+    assert any(step.startswith("SCAN listings_fts VIRTUAL TABLE INDEX") for step in plan), plan
+    assert not any(step.startswith("SCAN listings") and "listings_fts" not in step for step in plan), plan
+    assert "SEARCH listings USING INTEGER PRIMARY KEY (rowid=?)" in plan